@@ -4,5 +4,6 @@ File contains admin configuration for authentication app.
 from django.contrib import admin
 
 from authentication.models import OTP
+from core.admin import SoftDeleteAdmin
 
-admin.site.register(OTP)
+admin.site.register(OTP, SoftDeleteAdmin)
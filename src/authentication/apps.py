@@ -10,3 +10,9 @@ class AuthenticationConfig(AppConfig):
     """
     default_auto_field = "django.db.models.BigAutoField"
     name = "authentication"
+
+    def ready(self):
+        """
+        Connect the signal receivers and register the system checks of the app.
+        """
+        from authentication import checks, signals  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
@@ -0,0 +1,246 @@
+"""
+File with the authentication classes of the API.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import partial
+
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from authentication.tokens import is_token_revoked
+from core.conf import get_app_setting
+from user.models import User
+
+SCHEMA_VERSION = 1
+
+DEFAULT_USER_CACHE_SETTINGS = {
+    "MAX_SIZE": 10000,
+    "TTL": 30,
+    "CACHE_ALIAS": "default",
+}
+
+
+class RevocableJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that rejects the tokens revoked by the user.
+
+    It works as the JWTAuthentication of simplejwt, and also rejects the tokens issued before
+    the revocation epoch of the user (see authentication.tokens).
+    """
+
+    def get_user(self, validated_token):
+        """
+        Find the user of the token and check that the token is not revoked.
+
+        Raises:
+            InvalidToken: If the token was issued before the revocation epoch of the user.
+        """
+        user = super().get_user(validated_token)
+        if is_token_revoked(validated_token, user.tokens_revoked_at):
+            raise InvalidToken(_("Token has been revoked"))
+        return user
+
+
+class UserCache:
+    """
+    Bounded per-process LRU cache of authenticated users, with a time to live, checked against the shared cache.
+
+    The users are stored as a tuple with the values of their concrete fields, and a new User instance
+    is built from it on each hit, so the requests never share an instance.
+    Each user has a generation in the shared cache, a random token changed every time the user is invalidated
+    (see authentication.signals and revoke_user_tokens), and another generation covers every user. An entry is only
+    valid for the generations it was loaded with, so a user deactivated or logged out in a process is rejected
+    by the other processes on their next request, with one read of the shared cache instead of a query.
+    """
+
+    def __init__(self, max_size, ttl, cache_alias="default"):
+        """
+        Initialize the cache.
+
+        Args:
+            max_size (int): The maximum number of users kept in the cache.
+            ttl (float): The seconds an entry is valid.
+            cache_alias (str, optional): The alias of the shared cache of the generations. Defaults to "default".
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.attnames = [field.attname for field in User._meta.concrete_fields]
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_generation_keys(user_id):
+        """
+        Get the keys of the shared generations of a user.
+
+        Args:
+            user_id: The id of the user.
+
+        Returns:
+            tuple: The keys of the generation of every user and of the generation of the user.
+        """
+        return f"auth:user:v{SCHEMA_VERSION}:generation", f"auth:user:v{SCHEMA_VERSION}:{user_id}:generation"
+
+    def get_shared_generations(self, user_id):
+        """
+        Get the shared generations of a user, creating the missing ones.
+
+        Args:
+            user_id: The id of the user.
+
+        Returns:
+            tuple: The generation of every user and the generation of the user.
+        """
+        cache = caches[self.cache_alias]
+        keys = self.get_generation_keys(user_id)
+        values = cache.get_many(keys)
+        for key in keys:
+            if values.get(key) is None:
+                cache.add(key, uuid.uuid4().hex, None)
+                values[key] = cache.get(key)
+        return tuple(values[key] for key in keys)
+
+    def get(self, user_id):
+        """
+        Get a user from the cache.
+
+        Args:
+            user_id: The id of the user.
+
+        Returns:
+            User: A new instance of the user, or None if it is not in the cache, it is expired or it was invalidated.
+        """
+        with self.lock:
+            entry = self.entries.get(user_id)
+        if entry is not None and (entry[0] < time.monotonic() or entry[1] != self.get_shared_generations(user_id)):
+            with self.lock:
+                if self.entries.get(user_id) is entry:
+                    del self.entries[user_id]
+            entry = None
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if user_id in self.entries:
+                self.entries.move_to_end(user_id)
+            self.hits += 1
+        return User.from_db("default", self.attnames, entry[2])
+
+    def begin(self, user_id):
+        """
+        Get the current generations of a user, to be passed to set after loading the user from the database.
+
+        It prevents storing a user loaded before an invalidation, which could be stale.
+
+        Args:
+            user_id: The id of the user.
+        """
+        return self.generation, self.get_shared_generations(user_id)
+
+    def set(self, user, generation):
+        """
+        Store a user in the cache.
+
+        Args:
+            user (User): The user loaded from the database.
+            generation (tuple): The generations returned by begin before loading the user.
+        """
+        local_generation, shared_generations = generation
+        values = tuple(getattr(user, attname) for attname in self.attnames)
+        with self.lock:
+            if local_generation != self.generation:
+                return
+            self.entries[user.pk] = (time.monotonic() + self.ttl, shared_generations, values)
+            self.entries.move_to_end(user.pk)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id=None):
+        """
+        Remove a user from the cache of every process, or every user if no id is given.
+
+        Args:
+            user_id (optional): The id of the user.
+        """
+        with self.lock:
+            self.generation += 1
+            if user_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(user_id, None)
+        every_user_key, user_key = self.get_generation_keys(user_id)
+        caches[self.cache_alias].set(every_user_key if user_id is None else user_key, uuid.uuid4().hex, None)
+
+    def stats(self):
+        """
+        Get the counters of the cache, to tune its size and time to live.
+
+        Returns:
+            dict: The hits, misses, evictions, current size and hit ratio of the cache.
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hit_ratio": self.hits / requests if requests else 0.0,
+            }
+
+
+_get_user_cache_setting = partial(get_app_setting, "AUTH_USER_CACHE", defaults=DEFAULT_USER_CACHE_SETTINGS)
+
+
+user_cache = UserCache(
+    _get_user_cache_setting("MAX_SIZE"), _get_user_cache_setting("TTL"), _get_user_cache_setting("CACHE_ALIAS")
+)
+
+
+class CachedJWTAuthentication(RevocableJWTAuthentication):
+    """
+    JWT authentication that keeps the recently authenticated users in memory.
+
+    It works as RevocableJWTAuthentication, but the user is only loaded from the database when it is not
+    in the user cache, so most authenticated requests do not query the user table. They read the generations
+    of the user in the shared cache, so a deactivation or a revocation is seen by every process at once.
+    """
+
+    def get_user(self, validated_token):
+        """
+        Find the user of the token in the cache, or in the database on a miss.
+
+        Raises:
+            InvalidToken: If the token has no user id or it was issued before the revocation epoch of the user.
+            AuthenticationFailed: If the user does not exist or it is not active.
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user = user_cache.get(user_id)
+        if user is None:
+            generation = user_cache.begin(user_id)
+            user = super().get_user(validated_token)
+            user_cache.set(user, generation)
+            return user
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if is_token_revoked(validated_token, user.tokens_revoked_at):
+            raise InvalidToken(_("Token has been revoked"))
+        return user
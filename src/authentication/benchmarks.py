@@ -0,0 +1,39 @@
+"""
+File with the benchmark suites of the authentication app (see core.benchmark).
+"""
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from authentication.serializers import LoginSerializer
+from core.benchmark import measure
+from user.models import User
+
+BENCHMARK_EMAIL = "benchmark.login@example.com"
+BENCHMARK_PASSWORD = "benchmark-password"
+
+
+def login(iterations=20, **options):
+    """
+    Compare the previous login pipeline with the single lookup one.
+
+    The previous pipeline looked up the user by email in the view and again in authenticate(),
+    the single lookup pipeline passes the user of the view to the serializer.
+
+    Args:
+        iterations (int, optional): The number of measured logins of each pipeline. Defaults to 20.
+
+    Yields:
+        tuple: The name of the pipeline and its measure.
+    """
+    User.objects.create_user(email=BENCHMARK_EMAIL, password=BENCHMARK_PASSWORD, is_active=True)
+    data = {"email": BENCHMARK_EMAIL, "password": BENCHMARK_PASSWORD}
+
+    def legacy():
+        User.objects.filter(email=BENCHMARK_EMAIL).first()
+        TokenObtainPairSerializer(data=data).is_valid(raise_exception=True)
+
+    def single_lookup():
+        user = User.objects.filter(email=BENCHMARK_EMAIL).first()
+        LoginSerializer(data=data, context={"user": user}).is_valid(raise_exception=True)
+
+    yield "login legacy", measure(legacy, iterations)
+    yield "login single lookup", measure(single_lookup, iterations)
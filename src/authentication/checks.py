@@ -0,0 +1,38 @@
+"""
+File with the system checks of the authentication app.
+"""
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+
+from authentication.authentication import _get_user_cache_setting
+
+
+@register(Tags.caches)
+def check_user_cache_alias(app_configs, **kwargs):  # pylint: disable=unused-argument
+    """
+    Warn when the invalidations of the user cache are not shared by the processes.
+
+    The users cached by CachedJWTAuthentication are invalidated through the cache CACHE_ALIAS of AUTH_USER_CACHE,
+    so a local memory (or dummy) cache lets the other processes authenticate a stale user until the TTL expires.
+
+    Args:
+        app_configs: The app configs to check, unused since the check is global.
+        **kwargs: The other arguments of the check.
+
+    Returns:
+        list: The warnings found.
+    """
+    alias = _get_user_cache_setting("CACHE_ALIAS")
+    if not isinstance(caches[alias], (LocMemCache, DummyCache)):
+        return []
+    return [
+        Warning(
+            f"The cache '{alias}' of AUTH_USER_CACHE is local to each process.",
+            hint="Configure a shared cache backend (database, Redis, Memcached...) when several processes serve "
+            "the API, the user invalidations are not seen by the other processes otherwise.",
+            obj="AUTH_USER_CACHE",
+            id="authentication.W001",
+        )
+    ]
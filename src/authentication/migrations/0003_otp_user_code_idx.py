@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("authentication", "0002_otp_deleted_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="otp",
+            index=models.Index(fields=["user", "code", "is_active", "created_at"], name="auth_otp_user_code_idx"),
+        ),
+    ]
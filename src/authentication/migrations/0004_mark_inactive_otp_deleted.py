@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+def mark_inactive_otp_deleted(apps, schema_editor):
+    """Set the deleted_at of the OTP codes consumed before the field existed, so the managers exclude them."""
+    OTP = apps.get_model("authentication", "OTP")
+    OTP.objects.filter(is_active=False, deleted_at__isnull=True).update(deleted_at=models.F("updated_at"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("authentication", "0003_otp_user_code_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_inactive_otp_deleted, migrations.RunPython.noop),
+    ]
@@ -5,6 +5,8 @@ This module defines the model for the Django app 'authentication'.
 from datetime import timedelta
 
 from django.db import models
+from django.db.models import ExpressionWrapper, Value
+from django.db.models.functions import Cast
 from django.utils import timezone
 
 from core.models import BaseModel
@@ -37,6 +39,45 @@ class OTP(BaseModel):
     code = models.CharField(max_length=6)
     validity_duration = models.PositiveIntegerField(default=10)
 
+    class Meta:
+        """
+        Meta class for OTP
+
+        The index covers the conditional UPDATE used to consume an OTP (see OTP.consume).
+        """
+
+        indexes = [
+            models.Index(fields=["user", "code", "is_active", "created_at"], name="auth_otp_user_code_idx"),
+        ]
+
+    @classmethod
+    def consume(cls, user, code):
+        """
+        Consume an OTP code of a user.
+
+        The OTP is checked and deactivated by a single conditional UPDATE, so two concurrent logins
+        can not consume the same code.
+
+        Args:
+        - user: The user who received the OTP.
+        - code: The OTP code provided by the user.
+
+        Returns:
+        - True if an active and not expired OTP was consumed, False otherwise.
+        """
+        now = timezone.now()
+        validity = ExpressionWrapper(
+            Cast("validity_duration", models.IntegerField()) * timedelta(minutes=1), output_field=models.DurationField()
+        )
+        return bool(
+            cls.objects.filter(
+                user=user,
+                code=code,
+                is_active=True,
+                created_at__gt=ExpressionWrapper(Value(now) - validity, output_field=models.DateTimeField()),
+            ).update(is_active=False, deleted_at=now, updated_at=now)
+        )
+
     def expires_at(self):
         """
         Get the expiration time of the OTP instance.
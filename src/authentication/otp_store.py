@@ -0,0 +1,202 @@
+"""
+File that contains the stores of the OTP (One-Time Password) codes.
+
+The store is chosen with the BACKEND of the OTP_STORE setting:
+- DatabaseOTPStore keeps the codes in the authentication_otp table.
+- CacheOTPStore keeps hashed codes in a Django cache, which removes them when they expire.
+"""
+import secrets
+import threading
+from functools import partial
+
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.module_loading import import_string
+
+from authentication.models import OTP
+from core.conf import get_app_setting
+
+DEFAULT_OTP_STORE_SETTINGS = {
+    "BACKEND": "authentication.otp_store.DatabaseOTPStore",
+    "CACHE_ALIAS": "default",
+    "VALIDITY_DURATION": 10,
+    "MAX_ATTEMPTS": 5,
+}
+
+OTP_VALID = "valid"
+OTP_INVALID = "invalid"
+OTP_EXPIRED = "expired"
+OTP_INACTIVE = "inactive"
+OTP_TOO_MANY_ATTEMPTS = "too_many_attempts"
+
+
+get_otp_store_setting = partial(get_app_setting, "OTP_STORE", defaults=DEFAULT_OTP_STORE_SETTINGS)
+
+
+def generate_code():
+    """
+    Generate a random OTP code of 6 digits.
+
+    Returns:
+        str: The OTP code.
+    """
+    return str(secrets.randbelow(900000) + 100000)
+
+
+class BaseOTPStore:
+    """
+    Base class for the OTP stores.
+
+    A store issues the OTP codes of the users and consumes them once, when the user logs in.
+    """
+
+    def issue(self, user):
+        """
+        Issue a new OTP code for a user.
+
+        Args:
+            user: The user who requested the OTP.
+
+        Returns:
+            tuple: The OTP code and its validity in minutes.
+        """
+        raise NotImplementedError("Subclasses of BaseOTPStore must implement issue")
+
+    def consume(self, user, code):
+        """
+        Consume an OTP code of a user, a code can only be consumed once.
+
+        Args:
+            user: The user who received the OTP.
+            code (str): The OTP code provided by the user.
+
+        Returns:
+            str: OTP_VALID if the code was consumed, or the reason why it was rejected
+                 (OTP_INVALID, OTP_EXPIRED, OTP_INACTIVE or OTP_TOO_MANY_ATTEMPTS).
+        """
+        raise NotImplementedError("Subclasses of BaseOTPStore must implement consume")
+
+
+class DatabaseOTPStore(BaseOTPStore):
+    """
+    Store that keeps the OTP codes in the OTP model.
+    """
+
+    def issue(self, user):
+        """Create an OTP row for the user."""
+        otp = OTP.objects.create(
+            user=user, code=generate_code(), validity_duration=get_otp_store_setting("VALIDITY_DURATION")
+        )
+        return otp.code, otp.validity_duration
+
+    def consume(self, user, code):
+        """
+        Consume the code with a single conditional UPDATE (see OTP.consume).
+
+        Only when it fails, the latest OTP with the code is loaded to return the reason of the error.
+        """
+        if OTP.consume(user, code):
+            return OTP_VALID
+        otp = OTP.all_objects.filter(user=user, code=code).order_by("-created_at").first()
+        if not otp:
+            return OTP_INVALID
+        if otp.is_expired():
+            return OTP_EXPIRED
+        return OTP_INACTIVE
+
+
+class CacheOTPStore(BaseOTPStore):
+    """
+    Store that keeps the OTP codes in a Django cache.
+
+    Each user has at most one code, stored as an HMAC of the code, so the cache never contains the code itself.
+    The cache removes the code when its validity ends, the wrong codes are counted and the code is discarded
+    after MAX_ATTEMPTS, and a code is consumed by deleting its key, which only one request can do.
+    The cache must be shared by all the processes of the project (for example Redis, Memcached or the
+    database cache); the local-memory and file-based caches are enough for tests and benchmarks.
+    """
+
+    def __init__(self):
+        """Initialize the store with the cache defined in the CACHE_ALIAS setting."""
+        self.cache = caches[get_otp_store_setting("CACHE_ALIAS")]
+
+    @staticmethod
+    def _keys(user):
+        """Get the cache keys of the code and the attempts of a user."""
+        return f"otp:{user.pk}:code", f"otp:{user.pk}:attempts"
+
+    @staticmethod
+    def _hash(user, code):
+        """Get the HMAC of a code of a user."""
+        return salted_hmac("authentication.otp_store", f"{user.pk}:{code}", algorithm="sha256").hexdigest()
+
+    def issue(self, user):
+        """Store the hash of a new code for the user, replacing the previous one."""
+        code = generate_code()
+        validity_duration = get_otp_store_setting("VALIDITY_DURATION")
+        code_key, attempts_key = self._keys(user)
+        self.cache.set_many({code_key: self._hash(user, code), attempts_key: 0}, timeout=validity_duration * 60)
+        return code, validity_duration
+
+    def consume(self, user, code):
+        """
+        Check the code against the stored hash and delete it when it matches.
+
+        An expired code is no longer in the cache, so it is reported as invalid.
+        """
+        code_key, attempts_key = self._keys(user)
+        stored_hash = self.cache.get(code_key)
+        if stored_hash is None:
+            return OTP_INVALID
+        try:
+            attempts = self.cache.incr(attempts_key)
+        except ValueError:
+            # The attempts expired together with the code
+            return OTP_INVALID
+        if attempts > get_otp_store_setting("MAX_ATTEMPTS"):
+            self.cache.delete_many([code_key, attempts_key])
+            return OTP_TOO_MANY_ATTEMPTS
+        if not constant_time_compare(stored_hash, self._hash(user, code)):
+            return OTP_INVALID
+        if not self.cache.delete(code_key):
+            # Another request consumed the code first
+            return OTP_INACTIVE
+        self.cache.delete(attempts_key)
+        return OTP_VALID
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_otp_store():
+    """
+    Get the OTP store of the process.
+
+    The store defined in the BACKEND setting is created on the first call and reused afterwards.
+
+    Returns:
+        BaseOTPStore: The OTP store.
+    """
+    global _store  # pylint: disable=global-statement
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = import_string(get_otp_store_setting("BACKEND"))()
+    return _store
+
+
+def reset_otp_store(**kwargs):
+    """
+    Discard the OTP store of the process, so the next call to get_otp_store creates a new one.
+
+    It is connected to the setting_changed signal, so override_settings(OTP_STORE=...) takes effect.
+    """
+    global _store  # pylint: disable=global-statement
+    if kwargs.get("setting", "OTP_STORE") == "OTP_STORE":
+        with _store_lock:
+            _store = None
+
+
+setting_changed.connect(reset_otp_store)
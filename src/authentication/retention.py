@@ -0,0 +1,49 @@
+"""
+File with the retention policies of the authentication app (see core.retention).
+"""
+from datetime import timedelta
+
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from authentication.models import OTP
+from core.retention import RetentionPolicy, get_retention_setting
+
+
+class OTPRetentionPolicy(RetentionPolicy):
+    """
+    Policy that deletes the OTP codes created more than OTP_DAYS days ago.
+
+    An OTP is only valid for some minutes, so the rows are dead long before they are deleted.
+    """
+
+    name = "otp"
+
+    def get_queryset(self, now):
+        """Get the OTP codes created before the retention period."""
+        return OTP.all_objects.filter(created_at__lt=now - timedelta(days=get_retention_setting("OTP_DAYS")))
+
+
+class BlacklistedTokenRetentionPolicy(RetentionPolicy):
+    """
+    Policy that deletes the blacklisted tokens that are expired.
+
+    An expired token is rejected anyway, so it does not need to be blacklisted.
+    """
+
+    name = "blacklisted_token"
+
+    def get_queryset(self, now):
+        """Get the blacklisted tokens whose token is expired."""
+        return BlacklistedToken.objects.filter(token__expires_at__lt=now)
+
+
+class OutstandingTokenRetentionPolicy(RetentionPolicy):
+    """
+    Policy that deletes the outstanding tokens that are expired, with their blacklist entries.
+    """
+
+    name = "outstanding_token"
+
+    def get_queryset(self, now):
+        """Get the outstanding tokens that are expired."""
+        return OutstandingToken.objects.filter(expires_at__lt=now)
@@ -1,8 +1,16 @@
 """
 File for the authentication serializer.
 """
+from django.contrib.auth.models import update_last_login
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from authentication.tokens import is_token_revoked
+from user.models import User, get_email_lookup
 
 
 class LoginSerializer(TokenObtainPairSerializer):
@@ -11,6 +19,7 @@ class LoginSerializer(TokenObtainPairSerializer):
 
     This class extends the TokenObtainPairSerializer from the rest_framework_simplejwt library.
     It adds custom claims and data to the JWT payload, including the user's email, ID, name, and email.
+    The user can be given in the 'user' key of the context, so a view that already loaded it does not query it again.
     """
 
     email = serializers.EmailField(required=False, allow_blank=True)
@@ -20,15 +29,36 @@ class LoginSerializer(TokenObtainPairSerializer):
         """
         Validate the user's login credentials.
 
-        Overrides the parent class method to add custom data to the response, including the user's ID, name, and email.
+        Overrides the parent class method to verify the password against the user of the context, or the user
+        found by email, instead of calling authenticate(), which would query the user again.
+        If the password hasher or its iterations changed, check_password rehashes and saves the password.
+        It adds custom data to the response, including the user's ID, name, and email.
 
         Args:
             attrs: The user's login credentials.
 
         Returns:
             The validated data with custom data added to the response.
+
+        Raises:
+            AuthenticationFailed: If the user does not exist, the password is incorrect or the user is not active.
         """
-        data = super().validate(attrs)
+        user = self.context.get('user')
+        if user is None:
+            user = User.all_objects.filter(get_email_lookup(attrs.get(self.username_field))).first()
+        if (
+            user is None
+            or not user.check_password(attrs['password'])
+            or not api_settings.USER_AUTHENTICATION_RULE(user)
+        ):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        self.user = user
+
+        refresh = self.get_token(self.user)
+        data = {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+        if api_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, self.user)
 
         # Add custom data to response
         data['id'] = self.user.id
@@ -36,3 +66,35 @@ class LoginSerializer(TokenObtainPairSerializer):
         data['email'] = self.user.email
 
         return data
+
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Serializer class for refreshing JWT tokens that rejects the tokens revoked by the user.
+
+    This class extends the TokenRefreshSerializer from the rest_framework_simplejwt library.
+    Before refreshing, it checks that the refresh token was not issued before the revocation epoch of the user.
+    """
+
+    def validate(self, attrs):
+        """
+        Validate the refresh token and return the new tokens.
+
+        Args:
+            attrs: The refresh token.
+
+        Returns:
+            The new access token, and the new refresh token if the rotation is enabled.
+
+        Raises:
+            InvalidToken: If the refresh token was issued before the revocation epoch of the user.
+        """
+        refresh = self.token_class(attrs["refresh"])
+        tokens_revoked_at = (
+            User.all_objects.filter(pk=refresh.get(api_settings.USER_ID_CLAIM))
+            .values_list("tokens_revoked_at", flat=True)
+            .first()
+        )
+        if is_token_revoked(refresh, tokens_revoked_at):
+            raise InvalidToken(_("Token has been revoked"))
+        return super().validate(attrs)
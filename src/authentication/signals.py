@@ -0,0 +1,40 @@
+"""
+File with the signal receivers of the authentication app.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from authentication.authentication import user_cache
+from core.signals import bulk_updated
+from user.models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Remove a user from the user cache of the authentication when it is saved or deleted.
+
+    It covers the soft deactivation of BaseModel.save, so a deactivated user is rejected on the next request.
+    The user is removed again when the transaction is committed, in case another request cached it
+    before the change was visible.
+    """
+    user_id = instance.pk
+    user_cache.invalidate(user_id)
+    transaction.on_commit(lambda: user_cache.invalidate(user_id))
+
+
+@receiver(bulk_updated, sender=User)
+def invalidate_cached_users(sender, pks, **kwargs):
+    """
+    Remove the users updated in bulk from the user cache of the authentication, now and when the transaction
+    is committed, so the users deactivated by QuerySet.soft_delete are rejected on their next request.
+    """
+
+    def invalidate():
+        for user_id in pks:
+            user_cache.invalidate(user_id)
+
+    invalidate()
+    transaction.on_commit(invalidate)
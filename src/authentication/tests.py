@@ -0,0 +1,181 @@
+"""
+Tests for the authentication app.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.authentication import CachedJWTAuthentication, UserCache
+from authentication.checks import check_user_cache_alias
+from authentication.models import OTP
+from authentication.otp_store import (
+    OTP_EXPIRED,
+    OTP_INACTIVE,
+    OTP_INVALID,
+    OTP_TOO_MANY_ATTEMPTS,
+    OTP_VALID,
+    CacheOTPStore,
+    DatabaseOTPStore,
+)
+from authentication.retention import OTPRetentionPolicy, OutstandingTokenRetentionPolicy
+from authentication.tokens import is_token_revoked, revoke_user_tokens
+from core.retention import purge
+from user.models import User
+
+
+class TokenRevocationTests(SimpleTestCase):
+    """Tests for the revocation epoch of the tokens."""
+
+    revoked_at = datetime(2024, 1, 1, 12, 0, 0, 500000, tzinfo=dt_timezone.utc)
+
+    def test_tokens_of_the_second_of_the_revocation_are_revoked(self):
+        second = int(self.revoked_at.timestamp())
+        self.assertTrue(is_token_revoked({"iat": second - 1}, self.revoked_at))
+        self.assertTrue(is_token_revoked({"iat": second}, self.revoked_at))
+        self.assertFalse(is_token_revoked({"iat": second + 1}, self.revoked_at))
+
+    def test_tokens_without_revocation_are_valid(self):
+        self.assertFalse(is_token_revoked({"iat": 0}, None))
+        self.assertTrue(is_token_revoked({}, self.revoked_at))
+
+
+class UserCacheTests(TestCase):
+    """Tests for the invalidations of the user cache shared by the processes."""
+
+    def setUp(self):
+        """Create a user and the caches of two processes."""
+        self.user = User.objects.create_user(email="user@example.com", password="password", is_active=True)
+        self.first = UserCache(max_size=10, ttl=60)
+        self.second = UserCache(max_size=10, ttl=60)
+        for cache in (self.first, self.second):
+            cache.set(self.user, cache.begin(self.user.pk))
+
+    def test_invalidation_is_seen_by_the_other_processes(self):
+        self.assertEqual(self.second.get(self.user.pk), self.user)
+        self.first.invalidate(self.user.pk)
+        self.assertIsNone(self.first.get(self.user.pk))
+        self.assertIsNone(self.second.get(self.user.pk))
+
+    def test_invalidation_of_every_user_is_seen_by_the_other_processes(self):
+        self.first.invalidate()
+        self.assertIsNone(self.second.get(self.user.pk))
+
+    def test_revocation_in_another_process_rejects_the_cached_user(self):
+        token = AccessToken.for_user(self.user)
+        with patch("authentication.authentication.user_cache", self.second):
+            self.assertEqual(CachedJWTAuthentication().get_user(token), self.user)
+            with patch("authentication.authentication.user_cache", self.first):
+                with self.captureOnCommitCallbacks(execute=True):
+                    revoke_user_tokens(self.user.pk)
+            with self.assertRaises(InvalidToken):
+                CachedJWTAuthentication().get_user(token)
+
+    def test_deactivation_in_another_process_rejects_the_cached_user(self):
+        token = AccessToken.for_user(self.user)
+        with patch("authentication.authentication.user_cache", self.second):
+            CachedJWTAuthentication().get_user(token)
+        with patch("authentication.signals.user_cache", self.first):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.is_active = False
+                self.user.save()
+        with patch("authentication.authentication.user_cache", self.second):
+            with self.assertRaises(AuthenticationFailed):
+                CachedJWTAuthentication().get_user(token)
+
+
+class OTPStoreTests(TestCase):
+    """Tests for the single use of the OTP codes of the stores."""
+
+    def setUp(self):
+        """Create a user and clear the cache of the codes."""
+        self.user = User.objects.create_user(email="user@example.com", is_active=True)
+        caches["default"].clear()
+
+    def test_code_is_consumed_once(self):
+        code, _ = DatabaseOTPStore().issue(self.user)
+        self.assertTrue(OTP.consume(self.user, code))
+        self.assertFalse(OTP.consume(self.user, code))
+        self.assertEqual(DatabaseOTPStore().consume(self.user, code), OTP_INACTIVE)
+
+    def test_expired_code_is_rejected(self):
+        code, validity_duration = DatabaseOTPStore().issue(self.user)
+        OTP.objects.filter(user=self.user).update(
+            created_at=timezone.now() - timedelta(minutes=validity_duration, seconds=1)
+        )
+        self.assertFalse(OTP.consume(self.user, code))
+        self.assertEqual(DatabaseOTPStore().consume(self.user, code), OTP_EXPIRED)
+        self.assertTrue(OTP.objects.get(user=self.user).is_active)
+
+    def test_wrong_code_is_rejected(self):
+        code, _ = DatabaseOTPStore().issue(self.user)
+        wrong = "000000" if code != "000000" else "111111"
+        self.assertEqual(DatabaseOTPStore().consume(self.user, wrong), OTP_INVALID)
+        self.assertEqual(DatabaseOTPStore().consume(self.user, code), OTP_VALID)
+
+    def test_cache_store_consumes_a_code_once(self):
+        store = CacheOTPStore()
+        code, _ = store.issue(self.user)
+        self.assertEqual(store.consume(self.user, code), OTP_VALID)
+        self.assertEqual(store.consume(self.user, code), OTP_INVALID)
+
+    def test_cache_store_never_stores_the_code(self):
+        store = CacheOTPStore()
+        code, _ = store.issue(self.user)
+        code_key, _ = store._keys(self.user)
+        self.assertNotIn(code, store.cache.get(code_key))
+        stored = b"".join(value for value in store.cache._cache.values() if isinstance(value, bytes))
+        self.assertNotIn(code.encode(), stored)
+
+    @override_settings(OTP_STORE={"MAX_ATTEMPTS": 2})
+    def test_cache_store_discards_the_code_after_too_many_attempts(self):
+        store = CacheOTPStore()
+        code, _ = store.issue(self.user)
+        wrong = "000000" if code != "000000" else "111111"
+        self.assertEqual(store.consume(self.user, wrong), OTP_INVALID)
+        self.assertEqual(store.consume(self.user, wrong), OTP_INVALID)
+        self.assertEqual(store.consume(self.user, code), OTP_TOO_MANY_ATTEMPTS)
+        self.assertEqual(store.consume(self.user, code), OTP_INVALID)
+
+
+class AuthenticationRetentionTests(TestCase):
+    """Tests for the cutoffs of the retention policies of the authentication app."""
+
+    def setUp(self):
+        """Create a user."""
+        self.user = User.objects.create_user(email="user@example.com", is_active=True)
+        self.now = timezone.now()
+
+    def test_otp_codes_older_than_otp_days_are_deleted(self):
+        old = OTP.objects.create(user=self.user, code="111111")
+        recent = OTP.objects.create(user=self.user, code="222222", is_active=False)
+        OTP.objects.filter(pk=old.pk).update(created_at=self.now - timedelta(days=1, seconds=1))
+        OTP.objects.filter(pk=recent.pk).update(created_at=self.now - timedelta(hours=23))
+        self.assertEqual(purge(OTPRetentionPolicy(), self.now, sleep=0)["rows"], 1)
+        self.assertEqual(list(OTP.all_objects.values_list("pk", flat=True)), [recent.pk])
+
+    def test_expired_outstanding_tokens_are_deleted(self):
+        for jti, expires_at in (("expired", self.now - timedelta(seconds=1)), ("valid", self.now + timedelta(days=1))):
+            OutstandingToken.objects.create(user=self.user, jti=jti, token=jti, expires_at=expires_at)
+        self.assertEqual(purge(OutstandingTokenRetentionPolicy(), self.now, sleep=0)["rows"], 1)
+        self.assertEqual(list(OutstandingToken.objects.values_list("jti", flat=True)), ["valid"])
+
+
+class UserCacheCheckTests(SimpleTestCase):
+    """Tests for the system check of the cache sharing the user invalidations."""
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_local_cache_warns(self):
+        warnings = check_user_cache_alias(None)
+        self.assertEqual([warning.id for warning in warnings], ["authentication.W001"])
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "django_cache"}}
+    )
+    def test_shared_cache_does_not_warn(self):
+        self.assertEqual(check_user_cache_alias(None), [])
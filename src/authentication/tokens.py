@@ -0,0 +1,78 @@
+"""
+File that contains the functions to revoke the JWT tokens of a user.
+
+Each user has a revocation epoch (User.tokens_revoked_at): the tokens issued before it are invalid.
+Logging out of every session only needs to move the epoch, instead of blacklisting each token one by one.
+"""
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from user.models import User
+
+
+def is_token_revoked(token, tokens_revoked_at):
+    """
+    Check if a token was issued before the revocation epoch of its user.
+
+    The 'iat' claim is truncated to seconds, so a token with the same 'iat' as the second of the revocation
+    can not be ordered with it and is considered revoked, whether it was issued just before or just after it.
+
+    Args:
+        token: The validated token (AccessToken or RefreshToken).
+        tokens_revoked_at (datetime): The revocation epoch of the user, or None if it was never set.
+
+    Returns:
+        bool: True if the token is revoked, False otherwise.
+    """
+    if tokens_revoked_at is None:
+        return False
+    issued_at = token.get("iat")
+    return issued_at is None or issued_at <= tokens_revoked_at.timestamp()
+
+
+def blacklist_outstanding_tokens(user_id):
+    """
+    Blacklist every outstanding token of a user that is not expired or blacklisted yet.
+
+    It keeps the simplejwt blacklist consistent with the revocation epoch. The tokens are blacklisted
+    with one bulk insert, so the number of queries does not depend on the number of tokens.
+
+    Args:
+        user_id (int): The id of the user.
+
+    Returns:
+        int: The number of tokens blacklisted.
+    """
+    token_ids = OutstandingToken.objects.filter(
+        user_id=user_id, blacklistedtoken__isnull=True, expires_at__gt=timezone.now()
+    ).values_list("id", flat=True)
+    blacklisted = BlacklistedToken.objects.bulk_create(
+        [BlacklistedToken(token_id=token_id) for token_id in token_ids], ignore_conflicts=True
+    )
+    return len(blacklisted)
+
+
+def revoke_user_tokens(user_id, blacklist=True):
+    """
+    Revoke every token issued to a user until now.
+
+    The revocation epoch of the user is moved with a single UPDATE, and it is checked when a token
+    is used to authenticate or refresh. The UPDATE does not send post_save, so the user is removed
+    from the user cache of the authentication here, now and when the transaction is committed.
+
+    Args:
+        user_id (int): The id of the user.
+        blacklist (bool, optional): Whether the outstanding tokens are also blacklisted. Defaults to True.
+
+    Returns:
+        bool: True if the user exists, False otherwise.
+    """
+    from authentication.authentication import user_cache  # pylint: disable=import-outside-toplevel
+
+    updated = User.all_objects.filter(pk=user_id).update(tokens_revoked_at=timezone.now())
+    user_cache.invalidate(user_id)
+    transaction.on_commit(lambda: user_cache.invalidate(user_id))
+    if updated and blacklist:
+        blacklist_outstanding_tokens(user_id)
+    return bool(updated)
@@ -1,24 +1,29 @@
 """
 File with the authentication views.
 """
-import secrets
-
-from django.template.loader import render_to_string
-from django.utils import timezone
+from django.db import transaction
 from rest_framework import status
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
-from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 
-from authentication.models import OTP
+from authentication.otp_store import (
+    OTP_EXPIRED,
+    OTP_INACTIVE,
+    OTP_INVALID,
+    OTP_TOO_MANY_ATTEMPTS,
+    OTP_VALID,
+    get_otp_store,
+)
 from authentication.serializers import LoginSerializer
-from core.utils import send_email
-from user.models import User
+from authentication.tokens import revoke_user_tokens
+from core.emails import render_email
+from core.outbox import enqueue_email
+from user.models import User, get_email_lookup
 
 
 class LoginView(TokenObtainPairView):
@@ -62,6 +67,7 @@ class LoginView(TokenObtainPairView):
         Overrides the post method of the parent class to add custom functionality for user authentication.
         It checks if the email and password are provided, checks if the email exists in the database,
         and returns a custom response with the user's details and tokens upon successful login.
+        The user is loaded once and passed to the serializer, which verifies the password against it.
 
         Args:
             request: The HTTP request object.
@@ -77,20 +83,20 @@ class LoginView(TokenObtainPairView):
                 {"message": "Error Email or Password not found", "status": status.HTTP_400_BAD_REQUEST},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        if request.data.get('email'):
-            user = User.objects.filter(email=request.data['email']).first()
-            if not user:
-                return Response(
-                    {"message": "Error Email not found", "status": status.HTTP_400_BAD_REQUEST},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-        response = super().post(request)
-
-        refresh_token = response.data["refresh"]
-        access_token = response.data["access"]
-        user_id = response.data["id"]
-        email = response.data["email"]
-        name = response.data["name"]
+        user = User.all_objects.filter(get_email_lookup(request_email)).first()
+        if not user:
+            return Response(
+                {"message": "Error Email not found", "status": status.HTTP_400_BAD_REQUEST},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        serializer = self.get_serializer(data=request.data, context={**self.get_serializer_context(), 'user': user})
+        serializer.is_valid(raise_exception=True)
+
+        refresh_token = serializer.validated_data["refresh"]
+        access_token = serializer.validated_data["access"]
+        user_id = serializer.validated_data["id"]
+        email = serializer.validated_data["email"]
+        name = serializer.validated_data["name"]
 
         return Response(
             {
@@ -172,26 +178,19 @@ class LogoutAllView(APIView):
 
     def post(self, request):
         """
-        Invalidate all outstanding tokens for the authenticated user.
+        Invalidate all the tokens issued to the authenticated user.
 
-        If there are no active tokens for the user, return an error message.
+        The revocation epoch of the user is moved, so every token issued before it is rejected,
+        and the outstanding tokens are blacklisted with one bulk insert.
         If the token is invalid, return an error message.
         If there is any other error, return an error message with details.
 
         Returns:
             A response with a success message if the operation is successful,
-            or an error message if there are no active tokens for the user,
-            the token is invalid, or there is any other error.
+            or an error message if the token is invalid or there is any other error.
         """
         try:
-            tokens = OutstandingToken.objects.filter(user_id=request.user.id)
-            if not tokens:
-                return Response(
-                    {"message": "No active tokens for this user.", "status": status.HTTP_400_BAD_REQUEST},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            for token in tokens:
-                BlacklistedToken.objects.get_or_create(token=token)
+            revoke_user_tokens(request.user.id)
 
             return Response(
                 {"message": "Successfully logged out all sessions.", "status": status.HTTP_205_RESET_CONTENT},
@@ -223,32 +222,31 @@ class SendOTPView(APIView):
         if not email:
             return Response({'error': 'Email is required!'}, status=status.HTTP_400_BAD_REQUEST)
 
-        user = User.objects.filter(email=email).first()
+        user = User.all_objects.filter(get_email_lookup(email)).first()
         if not user:
             return Response({'error': 'Email is not registered!'}, status=status.HTTP_404_NOT_FOUND)
 
         if user.is_active is False:
             return Response({'error': 'User is not active'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Generate OTP
-        verification_code = secrets.randbelow(900000) + 100000
-
-        # Save OTP
-        otp = OTP.objects.create(user=user, code=verification_code, created_at=timezone.now())
-
-        context = {
-            "first_name": user.first_name,
-            "otp_code_1": str(otp.code)[0],
-            "otp_code_2": str(otp.code)[1],
-            "otp_code_3": str(otp.code)[2],
-            "otp_code_4": str(otp.code)[3],
-            "otp_code_5": str(otp.code)[4],
-            "otp_code_6": str(otp.code)[5],
-            "otp_validity_duration": str(otp.validity_duration),
-        }
-        html_content = render_to_string("otp.html", context)
-        to_send_email = [{"email": user.email, "name": user.first_name}]
-        send_email(f"Your OTP code for APP_NAME login is {str(otp.code)}", html_content, to_send_email)
+        with transaction.atomic():
+            code, validity_duration = get_otp_store().issue(user)
+
+            context = {
+                "first_name": user.first_name,
+                "otp_code_1": code[0],
+                "otp_code_2": code[1],
+                "otp_code_3": code[2],
+                "otp_code_4": code[3],
+                "otp_code_5": code[4],
+                "otp_code_6": code[5],
+                "otp_validity_duration": str(validity_duration),
+            }
+            message = render_email("otp.html", context)
+            to_send_email = [{"email": user.email, "name": user.first_name}]
+            enqueue_email(
+                f"Your OTP code for APP_NAME login is {code}", message.html, to_send_email, text_content=message.text
+            )
 
         return Response({'success': True, 'message': 'Code sent successfully!'})
 
@@ -266,6 +264,13 @@ class LoginOTPView(APIView):
     - _handle_otp_login(): Helper method to handle OTP login process.
     """
 
+    OTP_ERRORS = {
+        OTP_INVALID: 'Invalid OTP',
+        OTP_EXPIRED: 'OTP is expired',
+        OTP_INACTIVE: 'OTP is not active, please request a new one.',
+        OTP_TOO_MANY_ATTEMPTS: 'Too many attempts, please request a new OTP.',
+    }
+
     def post(self, request):
         """
         Handles the POST request for user authentication using OTP.
@@ -316,6 +321,8 @@ class LoginOTPView(APIView):
         """
         Helper method to handle OTP login process.
 
+        The OTP is checked and consumed by the OTP store defined in the OTP_STORE setting.
+
         Args:
         - email: The email provided by the user.
         - otp: The OTP code provided by the user.
@@ -324,7 +331,7 @@ class LoginOTPView(APIView):
         - response: The JSON response containing the user's details and tokens.
         - status_code: The HTTP status code of the response.
         """
-        user = User.objects.filter(email=email).first()
+        user = User.all_objects.filter(get_email_lookup(email)).first()
         if not user:
             response = {'error': 'Email not registered'}
             status_code = status.HTTP_404_NOT_FOUND
@@ -332,39 +339,26 @@ class LoginOTPView(APIView):
             response = {'error': 'User is not active'}
             status_code = status.HTTP_400_BAD_REQUEST
         else:
-            # Check OTP
-            otp = OTP.objects.filter(user=user, code=otp).first()
-            if not otp:
-                response = {'error': 'Invalid OTP'}
-                status_code = status.HTTP_400_BAD_REQUEST
-            elif otp.is_expired():
-                response = {'error': 'OTP is expired'}
-                status_code = status.HTTP_400_BAD_REQUEST
+            result = get_otp_store().consume(user, otp)
+            if result == OTP_VALID:
+                refresh_token = RefreshToken.for_user(user)
+
+                response = {
+                    "message": "User logged in successfully",
+                    "user_detail": {
+                        "user_id": user.id,
+                        "email": user.email,
+                        "name": user.first_name + " " + user.last_name,
+                    },
+                    "token": {
+                        "refresh_token": str(refresh_token),
+                        "access_token": str(refresh_token.access_token),
+                    },
+                    "status": 200,
+                }
+                status_code = status.HTTP_200_OK
             else:
-                if otp.is_active:
-                    access_token = str(AccessToken.for_user(user))
-                    refresh_token = str(RefreshToken.for_user(user))
-
-                    otp.is_active = False
-                    otp.save()
-
-                    response = {
-                        "message": "User logged in successfully",
-                        "user_detail": {
-                            "user_id": user.id,
-                            "email": user.email,
-                            "name": user.first_name + " " + user.last_name,
-                        },
-                        "token": {
-                            "refresh_token": refresh_token,
-                            "access_token": access_token,
-                        },
-                        "status": 200,
-                    }
-
-                    status_code = status.HTTP_200_OK
-                else:
-                    response = {'error': 'OTP is not active, please request a new one.'}
-                    status_code = status.HTTP_400_BAD_REQUEST
+                response = {'error': self.OTP_ERRORS[result]}
+                status_code = status.HTTP_400_BAD_REQUEST
 
         return response, status_code
@@ -115,7 +115,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-    'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework_simplejwt.authentication.JWTAuthentication'],
+    'DEFAULT_AUTHENTICATION_CLASSES': ['authentication.authentication.CachedJWTAuthentication'],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
 }
@@ -166,7 +166,7 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
     "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "authentication.serializers.RevocableTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
@@ -174,6 +174,91 @@ SIMPLE_JWT = {
 }
 
 
+# Per-process cache of the users authenticated with JWT. The invalidations are shared by the processes through
+# the cache CACHE_ALIAS, which must be shared too (see CACHES of dev.py and prod.py), checked by authentication.W001
+AUTH_USER_CACHE = {
+    "MAX_SIZE": 10000,
+    "TTL": 30,
+    "CACHE_ALIAS": "default",
+}
+
+
+# Cache of the user details read by UserDetailView, see user.cache
+USER_DETAIL_CACHE = {
+    "CACHE_ALIAS": "default",
+    "TIMEOUT": 300,
+    "LOCK_TIMEOUT": 5,
+    "LOCK_WAIT": 0.5,
+    "LOCK_POLL_INTERVAL": 0.02,
+}
+
+
+# Bulk import of users, see user.imports. WORKERS defaults to the number of CPUs
+USER_IMPORT = {
+    "BATCH_SIZE": 1000,
+    "WORKERS": None,
+    "REPORT_DIR": BASE_DIR / "imports",
+}
+
+
+# Store of the OTP codes, use authentication.otp_store.CacheOTPStore to keep them in the cache CACHE_ALIAS
+OTP_STORE = {
+    "BACKEND": "authentication.otp_store.DatabaseOTPStore",
+    "CACHE_ALIAS": "default",
+    "VALIDITY_DURATION": 10,
+    "MAX_ATTEMPTS": 5,
+}
+
+
+# Retention of the tables that only grow, purged by the purge_expired_data command
+RETENTION = {
+    "POLICIES": [
+        "authentication.retention.OTPRetentionPolicy",
+        "authentication.retention.BlacklistedTokenRetentionPolicy",
+        "authentication.retention.OutstandingTokenRetentionPolicy",
+        "user.retention.HistoricalUserRetentionPolicy",
+        "user.retention.CompactHistoricalUserRetentionPolicy",
+        "core.retention.EmailOutboxRetentionPolicy",
+    ],
+    "BATCH_SIZE": 1000,
+    "SLEEP": 0.1,
+    "OTP_DAYS": 1,
+    "OUTBOX_DAYS": 7,
+    "HISTORY_DAYS": 365,
+}
+
+
+# Keyset pagination of the lists, see core.pagination
+KEYSET_PAGINATION = {
+    "PAGE_SIZE": 50,
+    "MAX_PAGE_SIZE": 500,
+}
+
+
+# Write the historical records of core.history.DeferredHistoricalRecords with one bulk insert on commit
+SIMPLE_HISTORY_DEFERRED = True
+
+
+# Change feed of the users, see user.changes. The changes inserted in the history in the last SETTLE_SECONDS seconds
+# are not returned yet, and the long polls wait at most MAX_WAIT seconds
+USER_CHANGE_FEED = {
+    "SETTLE_SECONDS": 5,
+    "MAX_WAIT": 30,
+    "POLL_INTERVAL": 1,
+}
+
+
+# Compact history, see core.history. The historical records older than AFTER_DAYS days are converted into diffs
+# by the compact_history command, with a full snapshot every SNAPSHOT_INTERVAL versions
+COMPACT_HISTORY = {
+    "STORES": ["user.history.UserCompactHistory"],
+    "AFTER_DAYS": 30,
+    "SNAPSHOT_INTERVAL": 20,
+    "CHUNK_SIZE": 500,
+    "SLEEP": 0.1,
+}
+
+
 # Email with sendgrid and anymail
 EMAIL_BACKEND = "anymail.backends.sendgrid.EmailBackend"
 
@@ -191,3 +276,43 @@ ANYMAIL = {
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
+
+
+# Email outbox, the emails are sent by the process_email_outbox command
+EMAIL_OUTBOX = {
+    "SENDER": "core.utils.deliver_email",
+    "BATCH_SIZE": 50,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF_SECONDS": 30,
+    "MAX_BACKOFF_SECONDS": 3600,
+    "LEASE_SECONDS": 300,
+    "BULK": False,
+}
+
+
+# Transport of the email and SMS providers, the clients are created once per process and reused
+PROVIDER_TRANSPORT = {
+    "BACKEND": "core.transport.ProviderBackend",
+    "EMAIL_POOL_SIZE": 4,
+    "EMAIL_MAX_CONNECTIONS": 10,
+    "SMS_MAX_CONNECTIONS": 10,
+    "POOL_TIMEOUT": 5,
+    "CONNECT_TIMEOUT": 5,
+    "READ_TIMEOUT": 30,
+}
+
+
+# Bulk emails, see core.utils.EmailCoalescer. With BULK in EMAIL_OUTBOX, the emails of the same template and subject
+# are sent with one request of up to MAX_RECIPIENTS recipients, after waiting at most WINDOW_SECONDS for others
+BULK_EMAIL = {
+    "MAX_RECIPIENTS": 100,
+    "WINDOW_SECONDS": 2.0,
+}
+
+
+# Email templates, see core.emails. They are compiled once per process with their CSS inlined,
+# disable CACHE to see the changes of the templates without restarting the server
+EMAIL_TEMPLATES = {
+    "CACHE": True,
+    "INLINE_CSS": True,
+}
@@ -20,6 +20,14 @@ DATABASES = {
     }
 }
 
+# Cache shared by the processes (see AUTH_USER_CACHE), its table is created by "python manage.py createcachetable"
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    }
+}
+
 hostname, _, ips = socket.gethostbyname_ex(socket.gethostname())
 INTERNAL_IPS = [ip[: ip.rfind(".")] + ".1" for ip in ips] + ["127.0.0.1", "10.0.2.2"]
 
@@ -21,6 +21,14 @@ DATABASES = {
     }
 }
 
+# Cache shared by the processes (see AUTH_USER_CACHE), its table is created by "python manage.py createcachetable"
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    }
+}
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
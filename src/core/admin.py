@@ -0,0 +1,40 @@
+"""
+File contains admin configuration for core app.
+"""
+from django.contrib import admin, messages
+
+from core.models import EmailOutbox
+
+
+class SoftDeleteAdmin(admin.ModelAdmin):
+    """
+    Admin of the models of BaseModel, which lists the deleted rows too, with a filter on is_active.
+
+    The actions deactivate and reactivate the selected rows with the bulk operations of SoftDeleteQuerySet.
+    """
+
+    list_filter = ("is_active",)
+    actions = ["soft_delete_selected", "restore_selected"]
+
+    @admin.action(description="Deactivate the selected rows")
+    def soft_delete_selected(self, request, queryset):
+        """Deactivate the selected rows."""
+        rows = queryset.soft_delete()
+        self.message_user(request, f"{rows} rows deactivated.", messages.SUCCESS)
+
+    @admin.action(description="Reactivate the selected rows")
+    def restore_selected(self, request, queryset):
+        """Reactivate the selected rows."""
+        rows = queryset.restore()
+        self.message_user(request, f"{rows} rows reactivated.", messages.SUCCESS)
+
+    def get_queryset(self, request):
+        """Get every row, including the deleted ones, in the ordering of the admin."""
+        queryset = self.model.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+
+admin.site.register(EmailOutbox, SoftDeleteAdmin)
@@ -0,0 +1,99 @@
+"""
+File that contains the helpers of the benchmarks of the project.
+
+A benchmark suite is a generator named after the suite in the benchmarks module of an app. It receives the options
+of the benchmark command and yields (name, result) tuples, where result is built with measure. The suites run inside
+a transaction that is rolled back, so they can create the rows they need.
+"""
+import json
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+MEASURE_KEYS = {"iterations", "mean_ms", "p50_ms", "p95_ms", "per_second", "queries"}
+
+
+@contextmanager
+def rollback():
+    """
+    Run a block inside a transaction that is always rolled back.
+    """
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def measure(func, iterations=100, warmup=1):
+    """
+    Measure the latency and the number of queries of a function.
+
+    Args:
+        func (callable): The function to measure, called without arguments.
+        iterations (int, optional): The number of measured calls. Defaults to 100.
+        warmup (int, optional): The number of calls made before measuring. Defaults to 1.
+
+    Returns:
+        dict: The number of iterations, the mean, median and 95th percentile latency in milliseconds,
+              the number of calls per second and the number of queries per call.
+    """
+    for _ in range(warmup):
+        func()
+    timings = []
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(iterations):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[min(int(len(timings) * 0.95), len(timings) - 1)],
+        "per_second": 1000 * iterations / sum(timings) if sum(timings) else float("inf"),
+        "queries": len(queries.captured_queries) / iterations,
+    }
+
+
+def get_table_size(model):
+    """
+    Get the storage used by the table of a model.
+
+    On PostgreSQL it is the size of the table with its indexes and TOAST data, on the other databases it is
+    estimated as the size of the rows serialized as JSON.
+
+    Args:
+        model: The model of the table.
+
+    Returns:
+        int: The size of the table in bytes.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_total_relation_size(%s)", [model._meta.db_table])
+            return cursor.fetchone()[0]
+    return sum(len(json.dumps(row, default=str)) for row in model.objects.values_list().iterator())
+
+
+def format_result(name, result):
+    """
+    Format the result of measure as a line of the benchmark report.
+
+    Args:
+        name (str): The name of the measured case.
+        result (dict): The result of measure, it can have extra keys that are added at the end of the line.
+
+    Returns:
+        str: The formatted line.
+    """
+    line = (
+        f"{name:<40} mean {result['mean_ms']:9.3f} ms  p50 {result['p50_ms']:9.3f} ms  "
+        f"p95 {result['p95_ms']:9.3f} ms  {result['per_second']:11.1f}/s  {result['queries']:6.1f} queries"
+    )
+    extra = {key: value for key, value in result.items() if key not in MEASURE_KEYS}
+    if extra:
+        line += "  " + "  ".join(f"{key} {value}" for key, value in extra.items())
+    return line
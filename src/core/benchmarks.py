@@ -0,0 +1,98 @@
+"""
+File with the benchmark suites of the core app (see core.benchmark).
+"""
+from django.template import Context
+from django.template.loader import get_template, render_to_string
+
+from core.benchmark import measure
+from core.emails import render_email
+from core.outbox import enqueue_template_email, process_batch
+from core.transport import InMemoryBackend
+from core.utils import EmailCoalescer
+
+EMAIL_CONTEXTS = {
+    "otp.html": {
+        "first_name": "Bench",
+        "otp_validity_duration": "5",
+        **{f"otp_code_{index}": str(index) for index in range(1, 7)},
+    },
+    "welcome.html": {"first_name": "Bench", "url_frontend": "https://example.com"},
+}
+
+
+def emails(iterations=1000, **options):
+    """
+    Compare the renders per second of the email templates with render_to_string and with render_email.
+
+    The parsed render parses the template on every call, as render_to_string does without the cached template
+    loader, the cached render is render_to_string with the cached loader, and render_email renders the HTML and
+    the plain-text versions of the compiled email template.
+
+    Args:
+        iterations (int, optional): The number of measured renders of each case. Defaults to 1000.
+
+    Yields:
+        tuple: The name of the case and its measure, with the size in bytes of the HTML sent to the provider.
+    """
+    for name, context in EMAIL_CONTEXTS.items():
+        template = get_template(name).template
+
+        def parsed():
+            return template.engine.from_string(template.source).render(Context(context))
+
+        def cached():
+            return render_to_string(name, context)
+
+        def compiled():
+            return render_email(name, context).html
+
+        for case, func in (("parsed", parsed), ("cached", cached), ("render_email", compiled)):
+            result = measure(func, iterations)
+            result["html_bytes"] = len(func().encode())
+            yield f"{case} {name}", result
+
+
+def bulk_emails(rows=(1000,), latency=0.005, **options):
+    """
+    Compare the individual and the bulk sending of the welcome emails by the outbox worker.
+
+    The emails are sent to the in-memory backend, with the given latency per request. The bulk cases group them
+    by BULK_EMAIL MAX_RECIPIENTS without waiting, and the last one rejects 5% of the recipients of each request,
+    which are sent again one by one. Each case drains the outbox once.
+
+    Args:
+        rows (list, optional): The numbers of emails. Defaults to 1000.
+        latency (float, optional): The seconds each request of the fake provider takes. Defaults to 0.005.
+
+    Yields:
+        tuple: The name of the case and its measure, with the emails per second, the provider requests
+               and the metrics of the batches.
+    """
+    for count in sorted(rows):
+        cases = (
+            ("individual", InMemoryBackend(latency=latency), False),
+            ("bulk", InMemoryBackend(latency=latency), True),
+            ("bulk 5% rejected", InMemoryBackend(latency=latency, version_failure_rate=0.05), True),
+        )
+        for case, backend, bulk in cases:
+            for index in range(count):
+                enqueue_template_email(
+                    "welcome.html",
+                    {"first_name": f"Bench {index}", "url_frontend": "https://example.com"},
+                    "Welcome to Name_APP",
+                    [{"email": f"bench{index}@example.com", "name": f"Bench {index}"}],
+                )
+            coalescer = EmailCoalescer(window=0, backend=backend) if bulk else None
+
+            def drain():
+                while process_batch(sender=backend.send_email, batch_size=count, coalescer=coalescer) != (0, 0):
+                    pass
+
+            result = measure(drain, 1, warmup=0)
+            result["emails_per_second"] = round(count * result["per_second"])
+            result["requests"] = backend.requests
+            if coalescer is not None:
+                metrics = coalescer.metrics.as_dict()
+                for key in ("mean_batch_size", "p95_batch_ms", "fallbacks", "failed"):
+                    result[key] = metrics[key]
+            yield f"{case} {count} emails", result
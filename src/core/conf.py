@@ -0,0 +1,25 @@
+"""
+File that contains the helper to read the grouped settings of the project.
+"""
+from django.conf import settings
+
+
+def get_app_setting(group, name, defaults):
+    """
+    Get a setting of a group of settings, such as EMAIL_OUTBOX.
+
+    Each group is a dictionary of the Django settings, whose values override the default values of the module
+    that reads it. The modules bind their group with functools.partial, as get_outbox_setting in core.outbox.
+
+    Args:
+        group (str): The name of the group in the Django settings.
+        name (str): The name of the setting.
+        defaults (dict): The default values of the group.
+
+    Returns:
+        The value of the setting.
+
+    Raises:
+        KeyError: If the setting has no default value.
+    """
+    return getattr(settings, group, {}).get(name, defaults[name])
@@ -0,0 +1,413 @@
+"""
+File that contains the email templates of the project.
+
+An email template is loaded and compiled once per process: its CSS is inlined in the style attributes of the
+elements, the HTML is minified, and a plain-text alternative is derived from it. Rendering a message only resolves
+the variables of the template, so the views do not parse the template nor send its style block on every call.
+"""
+import html
+import re
+import threading
+from collections import namedtuple
+from functools import cached_property, partial
+
+from django.core.signals import setting_changed
+from django.template import Context
+from django.template.base import TextNode, Variable, VariableNode, render_value_in_context
+from django.template.loader import get_template
+
+from core.conf import get_app_setting
+
+DEFAULT_EMAIL_TEMPLATE_SETTINGS = {
+    "CACHE": True,
+    "INLINE_CSS": True,
+}
+
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+CSS_AT_RULE_RE = re.compile(r"@[^{};]+\{(?:[^{}]*\{[^{}]*\})*[^{}]*\}")
+CSS_RULE_RE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+SIMPLE_SELECTOR_RE = re.compile(r"^([a-zA-Z][a-zA-Z0-9]*)?((?:\.[\w-]+)*)$")
+STYLE_BLOCK_RE = re.compile(r"<style[^>]*>(.*?)</style>", re.S | re.I)
+HTML_COMMENT_RE = re.compile(r"<!--(?!\[if).*?-->", re.S)
+OPEN_TAG_RE = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)((?:\s[^<>]*?)?)(/?)>")
+CLASS_ATTR_RE = re.compile(r'\sclass="([^"]*)"', re.I)
+STYLE_ATTR_RE = re.compile(r'\sstyle="([^"]*)"', re.I)
+BODY_RE = re.compile(r"<body[^>]*>(.*)</body>", re.S | re.I)
+LINK_RE = re.compile(r'<a\s[^>]*?href="([^"]*)"[^>]*>(.*?)</a>', re.S | re.I)
+PARAGRAPH_TAG_RE = re.compile(r"</?(?:p|h[1-6]|table|ul|ol|blockquote)(?:\s[^>]*)?>", re.I)
+LINE_TAG_RE = re.compile(r"(?:\s*(?:<br\s*/?>|</?(?:div|li|tr)(?:\s[^>]*)?>))+\s*", re.I)
+TAG_RE = re.compile(r"<[^<>]+>")
+
+HTML_PLACEHOLDER = "{{ params.%s }}"
+TEXT_PLACEHOLDER = "{{ params.text_%s }}"
+
+RenderedEmail = namedtuple("RenderedEmail", ["html", "text"])
+
+
+get_email_template_setting = partial(get_app_setting, "EMAIL_TEMPLATES", defaults=DEFAULT_EMAIL_TEMPLATE_SETTINGS)
+
+
+def minify_css(css):
+    """
+    Remove the comments and the whitespace that is not needed from a style sheet or a list of declarations.
+
+    Args:
+        css (str): The CSS.
+
+    Returns:
+        str: The minified CSS.
+    """
+    css = CSS_COMMENT_RE.sub("", css)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};:,>])\s*", r"\1", css)
+    return css.replace(";}", "}").strip().rstrip(";")
+
+
+def parse_declarations(declarations):
+    """
+    Parse the declarations of a CSS rule or of a style attribute.
+
+    Args:
+        declarations (str): The declarations, as "color: #333; margin: 0".
+
+    Returns:
+        dict: The minified values by property, in the order of the declarations.
+    """
+    parsed = {}
+    for declaration in CSS_COMMENT_RE.sub("", declarations).split(";"):
+        prop, _, value = declaration.partition(":")
+        if prop.strip() and value.strip():
+            parsed[prop.strip().lower()] = minify_css(value)
+    return parsed
+
+
+def parse_css(css):
+    """
+    Split a style sheet into the rules that can be inlined and the rules that must stay in a style block.
+
+    Only the rules with a tag and/or class selector, such as "p", ".btn" or "a.btn", can be inlined. The at-rules
+    (@media...) and the rules with other selectors (":hover", descendants...) are kept.
+
+    Args:
+        css (str): The style sheet.
+
+    Returns:
+        tuple: The inline rules, as (specificity, tag, classes, declarations) tuples in the order of the style sheet,
+               and the minified CSS of the rules that are kept.
+    """
+    css = CSS_COMMENT_RE.sub("", css)
+    kept = CSS_AT_RULE_RE.findall(css)
+    rules = []
+    for selectors, declarations in CSS_RULE_RE.findall(CSS_AT_RULE_RE.sub("", css)):
+        declarations = parse_declarations(declarations)
+        other = []
+        for selector in selectors.split(","):
+            match = SIMPLE_SELECTOR_RE.match(selector.strip())
+            if match and selector.strip():
+                tag = (match.group(1) or "").lower()
+                classes = frozenset(filter(None, match.group(2).split(".")))
+                rules.append(((len(classes), bool(tag)), tag, classes, declarations))
+            else:
+                other.append(selector.strip())
+        if other:
+            kept.append(f"{','.join(other)}{{{';'.join(f'{p}:{v}' for p, v in declarations.items())}}}")
+    return rules, minify_css("".join(kept))
+
+
+def inline_css(source):
+    """
+    Move the rules of the style blocks of an HTML document to the style attributes of the elements they match.
+
+    The declarations are applied by specificity and then in the order of the style sheet, and the style attribute
+    of an element has priority over the rules. The rules that can not be inlined are kept in a single style block.
+
+    Args:
+        source (str): The HTML document.
+
+    Returns:
+        str: The HTML document with the CSS inlined.
+    """
+    blocks = STYLE_BLOCK_RE.findall(source)
+    if not blocks:
+        return source
+    rules, kept = parse_css("\n".join(blocks))
+    rules.sort(key=lambda rule: rule[0])
+    parts = STYLE_BLOCK_RE.split(source)
+    source = parts[0] + (f"<style>{kept}</style>" if kept else "") + "".join(parts[2::2])
+
+    def apply(match):
+        tag, attributes, closing = match.group(1).lower(), match.group(2), match.group(3)
+        class_match = CLASS_ATTR_RE.search(attributes)
+        classes = set(class_match.group(1).split()) if class_match else set()
+        style = {}
+        for _, rule_tag, rule_classes, declarations in rules:
+            if (not rule_tag or rule_tag == tag) and rule_classes <= classes:
+                style.update(declarations)
+        if not style:
+            return match.group(0)
+        style_match = STYLE_ATTR_RE.search(attributes)
+        if style_match:
+            style.update(parse_declarations(html.unescape(style_match.group(1))))
+            attributes = STYLE_ATTR_RE.sub("", attributes)
+        style = html.escape(";".join(f"{prop}:{value}" for prop, value in style.items()))
+        return f'<{match.group(1)}{attributes} style="{style}"{closing}>'
+
+    return OPEN_TAG_RE.sub(apply, source)
+
+
+def minify_html(source):
+    """
+    Remove the comments and collapse the whitespace of an HTML document.
+
+    The conditional comments of Outlook are kept. The document must not have pre or textarea elements.
+
+    Args:
+        source (str): The HTML document.
+
+    Returns:
+        str: The minified HTML document.
+    """
+    source = HTML_COMMENT_RE.sub("", source)
+    source = re.sub(r">\s+<", "><", source)
+    return re.sub(r"\s+", " ", source).strip()
+
+
+def html_to_text(source):
+    """
+    Build the plain-text alternative of an HTML document.
+
+    The links are written as "text (url)", the paragraphs are separated by a blank line and the other blocks
+    by a single line break, even when several blocks start or end at the same place.
+
+    Args:
+        source (str): The HTML document, it can contain template variables.
+
+    Returns:
+        str: The text of the body of the document.
+    """
+    body = BODY_RE.search(source)
+    text = body.group(1) if body else source
+    text = STYLE_BLOCK_RE.sub("", HTML_COMMENT_RE.sub("", text))
+    text = LINK_RE.sub(lambda match: f"{match.group(2)} ({match.group(1)})", text)
+    text = re.sub(r"\s+", " ", text)
+    text = LINE_TAG_RE.sub("\n", text)
+    text = PARAGRAPH_TAG_RE.sub("\n\n", text)
+    text = html.unescape(TAG_RE.sub("", text))
+    lines = [re.sub(r" +", " ", line).strip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip() + "\n"
+
+
+class CompiledTemplate:
+    """
+    Template compiled by the template engine, rendered without the overhead of Template.render when possible.
+
+    When the template only has text and variables, it is stored as a list of strings and filter expressions,
+    and a render only resolves the variables. The other templates are rendered with the engine.
+    """
+
+    def __init__(self, template, autoescape=True):
+        """
+        Initialize the compiled template.
+
+        Args:
+            template: The Template of the Django engine.
+            autoescape (bool, optional): Whether the variables are escaped. Defaults to True.
+        """
+        self.template = template
+        self.autoescape = autoescape
+        self.parts = []
+        for node in template.nodelist:
+            if isinstance(node, TextNode):
+                if self.parts and isinstance(self.parts[-1], str):
+                    self.parts[-1] += node.s
+                else:
+                    self.parts.append(node.s)
+            elif isinstance(node, VariableNode):
+                self.parts.append(node.filter_expression)
+            else:
+                self.parts = None
+                break
+
+    def render(self, context):
+        """
+        Render the template.
+
+        Args:
+            context (dict): The variables of the template.
+
+        Returns:
+            str: The rendered template.
+        """
+        context = Context(context, autoescape=self.autoescape)
+        if self.parts is None:
+            return self.template.render(context)
+        return "".join(
+            part if isinstance(part, str) else render_value_in_context(part.resolve(context), context)
+            for part in self.parts
+        )
+
+    @cached_property
+    def variables(self):
+        """
+        The names of the variables of the template, if each of them can be replaced by a parameter.
+
+        It is None when the template has tags, or variables with filters, attribute lookups or literal values.
+        """
+        if self.parts is None:
+            return None
+        names = []
+        for part in self.parts:
+            if isinstance(part, str):
+                continue
+            if part.filters or not isinstance(part.var, Variable) or not part.var.lookups or len(part.var.lookups) != 1:
+                return None
+            names.append(part.var.lookups[0])
+        return names
+
+    def render_placeholders(self, placeholder):
+        """
+        Render the template with each variable replaced by a placeholder.
+
+        Args:
+            placeholder (str): The placeholder, formatted with the name of the variable, as "{{ params.%s }}".
+
+        Returns:
+            str: The rendered template, or None if its variables can not be replaced.
+        """
+        if self.variables is None:
+            return None
+        return "".join(part if isinstance(part, str) else placeholder % part.var.lookups[0] for part in self.parts)
+
+    def render_params(self, context):
+        """
+        Render the values of the variables of the template, escaped as in render.
+
+        Args:
+            context (dict): The variables of the template.
+
+        Returns:
+            dict: The rendered values by variable name.
+        """
+        context = Context(context, autoescape=self.autoescape)
+        return {
+            part.var.lookups[0]: render_value_in_context(part.resolve(context), context)
+            for part in self.parts
+            if not isinstance(part, str)
+        }
+
+
+class EmailTemplate:
+    """
+    Email template, with its HTML and plain-text versions compiled once.
+
+    Args:
+        name (str): The name of the template, found by the template loaders as with render_to_string.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        template = get_template(name).template
+        source = template.source
+        if get_email_template_setting("INLINE_CSS"):
+            source = inline_css(source)
+        source = minify_html(source)
+        self.html = CompiledTemplate(template.engine.from_string(source))
+        self.text = CompiledTemplate(template.engine.from_string(html_to_text(source)), autoescape=False)
+
+    def render(self, context):
+        """
+        Render the HTML and the plain-text versions of the email.
+
+        Args:
+            context (dict): The variables of the template.
+
+        Returns:
+            RenderedEmail: The HTML and the text of the email.
+        """
+        return RenderedEmail(self.html.render(context), self.text.render(context))
+
+    @cached_property
+    def shared_content(self):
+        """
+        The HTML and the text of the email with the variables replaced by the parameters of the email provider.
+
+        The provider renders them with the parameters of each recipient given by render_params, so a single request
+        sends the email to many recipients. It is None when the variables of the template can not be replaced.
+        """
+        html_content = self.html.render_placeholders(HTML_PLACEHOLDER)
+        text_content = self.text.render_placeholders(TEXT_PLACEHOLDER)
+        if html_content is None or text_content is None:
+            return None
+        return RenderedEmail(html_content, text_content)
+
+    def render_params(self, context):
+        """
+        Render the parameters of a recipient for the shared_content of the email.
+
+        The values of the HTML version are already escaped, so the provider must insert them as they are.
+
+        Args:
+            context (dict): The variables of the template.
+
+        Returns:
+            dict: The parameters of the HTML version, and those of the text version prefixed by text_.
+        """
+        params = self.html.render_params(context)
+        params.update({f"text_{name}": value for name, value in self.text.render_params(context).items()})
+        return params
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_email_template(name):
+    """
+    Get an email template, compiled on the first call of the process and reused afterwards.
+
+    With the CACHE setting disabled, the template is compiled on every call, so the changes of the file
+    are visible without restarting the server.
+
+    Args:
+        name (str): The name of the template.
+
+    Returns:
+        EmailTemplate: The email template.
+    """
+    if not get_email_template_setting("CACHE"):
+        return EmailTemplate(name)
+    template = _templates.get(name)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(name)
+            if template is None:
+                template = _templates[name] = EmailTemplate(name)
+    return template
+
+
+def render_email(name, context):
+    """
+    Render the HTML and the plain-text versions of an email template.
+
+    Args:
+        name (str): The name of the template.
+        context (dict): The variables of the template.
+
+    Returns:
+        RenderedEmail: The HTML and the text of the email.
+    """
+    return get_email_template(name).render(context)
+
+
+def reset_email_templates(**kwargs):
+    """
+    Discard the compiled email templates, so they are compiled again on the next use.
+
+    It is connected to the setting_changed signal, so override_settings(TEMPLATES=...) takes effect.
+    """
+    if kwargs.get("setting", "TEMPLATES") in ("TEMPLATES", "EMAIL_TEMPLATES"):
+        with _templates_lock:
+            _templates.clear()
+
+
+setting_changed.connect(reset_email_templates)
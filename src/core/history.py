@@ -0,0 +1,512 @@
+"""
+File that contains the deferred historical records, a HistoricalRecords that writes the history in bulk,
+and the compact history, which stores the old historical records as diffs.
+
+The historical rows of the saves and deletes of a transaction are kept in memory and inserted with a single
+bulk_create when the transaction is committed. The rows of a rolled back savepoint or transaction are discarded,
+like the rows they describe. Outside of a transaction, the row is inserted right away, as with HistoricalRecords.
+So the history_id of the rows follows the order of the commits, and their history_inserted_at is the time of
+their insert, while history_date keeps the time of the change.
+
+The compact history converts the historical records older than AFTER_DAYS days into rows of a
+CompactHistoricalModel, with only the fields changed since the previous version and a full snapshot every
+SNAPSHOT_INTERVAL versions. The recent history stays in the historical table, the compact histories are listed
+in the STORES of the COMPACT_HISTORY setting.
+"""
+import datetime
+import decimal
+import threading
+import time
+import uuid
+import weakref
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.db.models import Max, OuterRef, Subquery
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from simple_history.models import HistoricalRecords
+from simple_history.signals import post_create_historical_record, pre_create_historical_record
+
+from core.conf import get_app_setting
+from core.models import DeletionMark
+
+
+class PendingRecord:
+    """
+    A historical row waiting for the commit of its transaction.
+
+    It is registered with transaction.on_commit, so Django drops it when its savepoint or transaction is rolled back.
+    """
+
+    def __init__(self, buffer, history_instance, instance, using):
+        self.buffer = buffer
+        self.history_instance = history_instance
+        self.instance = instance
+        self.using = using
+
+    def __call__(self):
+        """Mark the row as committed, called by Django when the transaction is committed."""
+        self.buffer.commit(self)
+
+
+class HistoryBuffer:
+    """
+    Buffer of the historical rows of the current thread and database.
+
+    The buffer only keeps weak references to the pending rows, the strong references are kept by the commit hooks
+    of Django, so a row whose hook is dropped by a rollback disappears from the buffer. When the hook of the last
+    pending row runs, every committed row is inserted with a bulk_create per historical model.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.committed = []
+
+    def add(self, history_instance, instance, alias, using=None):
+        """
+        Add a historical row, which is written when its transaction is committed.
+
+        Args:
+            history_instance: The historical row, not saved.
+            instance: The instance described by the row.
+            alias (str): The database of the transaction.
+            using (str, optional): The database where the row is written, None to let the routers choose it.
+        """
+        record = PendingRecord(self, history_instance, instance, using)
+        self.pending.append(weakref.ref(record))
+        transaction.on_commit(record, using=alias)
+
+    def commit(self, record):
+        """
+        Mark a row as committed, and write the committed rows if no other row is pending.
+
+        Args:
+            record (PendingRecord): The committed row.
+        """
+        self.committed.append(record)
+        self.pending = [ref for ref in self.pending if ref() is not None and ref() is not record]
+        if not self.pending:
+            self.flush()
+
+    def flush(self):
+        """Insert the committed rows with a bulk_create per historical model and database."""
+        records, self.committed = self.committed, []
+        inserted_at = timezone.now()
+        groups = defaultdict(list)
+        for record in records:
+            record.history_instance.history_inserted_at = inserted_at
+            groups[(type(record.history_instance), record.using)].append(record)
+        for (model, using), group in groups.items():
+            manager = model._default_manager if using is None else model._default_manager.using(using)
+            manager.bulk_create([record.history_instance for record in group])
+            for record in group:
+                history_instance = record.history_instance
+                post_create_historical_record.send(
+                    sender=model,
+                    instance=record.instance,
+                    history_instance=history_instance,
+                    history_date=history_instance.history_date,
+                    history_user=history_instance.history_user,
+                    history_change_reason=history_instance.history_change_reason,
+                    using=using,
+                )
+
+
+_buffers = threading.local()
+
+
+def get_history_buffer(using):
+    """
+    Get the history buffer of the current thread for a database.
+
+    Args:
+        using (str): The alias of the database.
+
+    Returns:
+        HistoryBuffer: The buffer.
+    """
+    if not hasattr(_buffers, "by_alias"):
+        _buffers.by_alias = {}
+    return _buffers.by_alias.setdefault(using, HistoryBuffer())
+
+
+class DeferredHistoricalRecords(HistoricalRecords):
+    """
+    HistoricalRecords that writes the historical rows of a transaction with a single bulk insert on commit.
+
+    Args:
+        deferred (bool, optional): Defer the historical rows of the model. Defaults to True. The deferral can be
+                                   disabled for every model with the SIMPLE_HISTORY_DEFERRED setting.
+        ignored_fields (iterable, optional): Fields whose changes alone do not create a historical record,
+                                             when they are saved with update_fields, for example updated_at.
+        **kwargs: The arguments of HistoricalRecords.
+
+    The models with history of many to many fields are not deferred.
+    """
+
+    def __init__(self, *args, deferred=True, ignored_fields=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deferred = deferred
+        self.ignored_fields = frozenset(ignored_fields)
+
+    def is_deferred(self):
+        """Return True if the historical rows of the model are deferred."""
+        return self.deferred and not self.m2m_fields and getattr(settings, "SIMPLE_HISTORY_DEFERRED", True)
+
+    def get_extra_fields(self, model, fields):
+        """Add history_inserted_at, the time when the row is inserted, to the fields of the historical model."""
+        extra_fields = super().get_extra_fields(model, fields)
+        extra_fields["history_inserted_at"] = models.DateTimeField(default=timezone.now, db_index=True, editable=False)
+        return extra_fields
+
+    def post_save(self, instance, created, using=None, **kwargs):
+        """Create the historical record of a save, unless the save only updates ignored fields."""
+        update_fields = kwargs.get("update_fields")
+        if not created and update_fields and self.ignored_fields.issuperset(update_fields):
+            return
+        super().post_save(instance, created, using=using, **kwargs)
+
+    def create_historical_record(self, instance, history_type, using=None):
+        """
+        Create the historical record of a change, deferred to the commit of the transaction.
+
+        It builds the same row and sends the same signals as HistoricalRecords.create_historical_record,
+        post_create_historical_record is sent when the row is inserted.
+        """
+        if not self.is_deferred():
+            return super().create_historical_record(instance, history_type, using=using)
+        alias = using or DEFAULT_DB_ALIAS
+        using = using if self.use_base_model_db else None
+        history_date = getattr(instance, "_history_date", timezone.now())
+        history_user = self.get_history_user(instance)
+        history_change_reason = self.get_change_reason_for_object(instance, history_type, using)
+        manager = getattr(instance, self.manager_name)
+
+        attrs = {}
+        for field in self.fields_included(instance):
+            attrs[field.attname] = getattr(instance, field.attname)
+
+        relation_field = getattr(manager.model, "history_relation", None)
+        if relation_field is not None:
+            attrs["history_relation"] = instance
+
+        history_instance = manager.model(
+            history_date=history_date,
+            history_type=history_type,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            **attrs,
+        )
+
+        pre_create_historical_record.send(
+            sender=manager.model,
+            instance=instance,
+            history_date=history_date,
+            history_user=history_user,
+            history_change_reason=history_change_reason,
+            history_instance=history_instance,
+            using=using,
+        )
+        get_history_buffer(alias).add(history_instance, instance, alias, using)
+
+
+DEFAULT_COMPACT_HISTORY_SETTINGS = {
+    "STORES": [],
+    "AFTER_DAYS": 30,
+    "SNAPSHOT_INTERVAL": 20,
+    "CHUNK_SIZE": 500,
+    "SLEEP": 0.1,
+}
+
+HISTORY_COLUMNS = ("history_id", "history_date", "history_type", "history_user_id", "history_change_reason")
+
+
+get_compact_history_setting = partial(get_app_setting, "COMPACT_HISTORY", defaults=DEFAULT_COMPACT_HISTORY_SETTINGS)
+
+
+def encode_value(value):
+    """Encode the value of a field for the JSON data of a compact row, keeping the microseconds of the dates."""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+class CompactHistory:
+    """
+    Base class for the compact histories.
+
+    A compact history has a name, used to select it in the compact_history command, the historical model of
+    a HistoricalRecords and the CompactHistoricalModel of its compact rows. The excluded fields, such as the
+    password, are not kept in the compact rows.
+    """
+
+    name = None
+    excluded_fields = ()
+
+    def get_history_model(self):
+        """Get the historical model, whose old records are converted."""
+        raise NotImplementedError("Subclasses of CompactHistory must implement get_history_model")
+
+    def get_compact_model(self):
+        """Get the CompactHistoricalModel of the compact rows."""
+        raise NotImplementedError("Subclasses of CompactHistory must implement get_compact_model")
+
+    def __init__(self):
+        self.history_model = self.get_history_model()
+        self.compact_model = self.get_compact_model()
+        self.object_field = self.history_model.instance_type._meta.pk.attname
+        self.fields = {
+            field.attname: field
+            for field in self.history_model.tracked_fields
+            if field.attname != self.object_field
+            and field.name not in self.excluded_fields
+            and field.attname not in self.excluded_fields
+        }
+
+    def decode(self, data):
+        """Decode the JSON data of a compact row into the values of its fields."""
+        return {
+            name: value if value is None else self.fields[name].to_python(value)
+            for name, value in data.items()
+            if name in self.fields
+        }
+
+    def apply(self, state, row):
+        """
+        Apply a compact row to the values of the previous version.
+
+        Args:
+            state (dict): The values of the previous version, or None.
+            row (dict): The values of the compact row.
+
+        Returns:
+            dict: The values of the version of the row, with its history columns.
+        """
+        values = {} if row["is_snapshot"] or state is None else dict(state)
+        values.update(self.decode(row["data"]))
+        values[self.object_field] = row["object_id"]
+        values.update({name: row[name] for name in HISTORY_COLUMNS})
+        return values
+
+    def get_full_values(self, row):
+        """Get the values of the tracked fields and the history columns of a historical record."""
+        return {name: row[name] for name in (*self.fields, self.object_field, *HISTORY_COLUMNS)}
+
+    def get_boundary(self, before):
+        """
+        Get the id of the last historical record to convert.
+
+        The records are converted up to the greatest id of the records older than the given date, so the compact
+        rows always precede the remaining historical records of an object.
+
+        Args:
+            before (datetime): The date of the oldest history kept in the historical table.
+
+        Returns:
+            int: The greatest id to convert, or None if no record is old enough.
+        """
+        records = self.history_model.objects.filter(history_date__lt=before)
+        return records.aggregate(boundary=Max("history_id"))["boundary"]
+
+    def get_latest_states(self, object_ids):
+        """
+        Rebuild the latest compact version of some objects with a single query.
+
+        Args:
+            object_ids (list): The primary keys of the objects.
+
+        Returns:
+            dict: The values and the number of versions since the snapshot of each object with compact rows.
+        """
+        last_snapshot = (
+            self.compact_model.objects.filter(object_id=OuterRef("object_id"), is_snapshot=True)
+            .order_by("-history_id")
+            .values("history_id")[:1]
+        )
+        rows = (
+            self.compact_model.objects.filter(object_id__in=object_ids, history_id__gte=Subquery(last_snapshot))
+            .order_by("object_id", "history_id")
+            .values()
+        )
+        states = {}
+        for row in rows:
+            values, versions = states.get(row["object_id"], (None, 0))
+            states[row["object_id"]] = (self.apply(values, row), 0 if row["is_snapshot"] else versions + 1)
+        return states
+
+    def build_row(self, record, state, versions, snapshot_interval):
+        """
+        Build the compact row of a historical record.
+
+        Args:
+            record (dict): The values of the historical record.
+            state (dict): The values of the previous version of the object, or None.
+            versions (int): The number of versions since the last snapshot of the object.
+            snapshot_interval (int): The number of versions between two snapshots.
+
+        Returns:
+            CompactHistoricalModel: The compact row, not saved.
+        """
+        is_snapshot = state is None or versions + 1 >= snapshot_interval
+        data = {
+            name: encode_value(record[name])
+            for name in self.fields
+            if is_snapshot or encode_value(record[name]) != encode_value(state.get(name))
+        }
+        return self.compact_model(
+            object_id=record[self.object_field],
+            is_snapshot=is_snapshot,
+            data=data,
+            **{name: record[name] for name in HISTORY_COLUMNS},
+        )
+
+    def convert_chunk(self, object_ids, boundary, snapshot_interval):
+        """
+        Convert the historical records of some objects up to the boundary, in a transaction.
+
+        The greatest id of the converted records is recorded in the DeletionMark of the historical model.
+
+        Args:
+            object_ids (list): The primary keys of the objects.
+            boundary (int): The greatest id of the records to convert.
+            snapshot_interval (int): The number of versions between two snapshots.
+
+        Returns:
+            int: The number of converted records.
+        """
+        with transaction.atomic():
+            records = self.history_model.objects.filter(
+                **{f"{self.object_field}__in": object_ids}, history_id__lte=boundary
+            )
+            states = self.get_latest_states(object_ids)
+            rows = []
+            for record in records.order_by(self.object_field, "history_id").values():
+                values, versions = states.get(record[self.object_field], (None, 0))
+                row = self.build_row(record, values, versions, snapshot_interval)
+                rows.append(row)
+                states[row.object_id] = (self.get_full_values(record), 0 if row.is_snapshot else versions + 1)
+            self.compact_model.objects.bulk_create(rows)
+            records.delete()
+            if rows:
+                DeletionMark.record(self.history_model, max(row.history_id for row in rows))
+        return len(rows)
+
+    def convert(self, before, chunk_size=None, snapshot_interval=None, sleep=None, on_chunk=None):
+        """
+        Convert the historical records older than a date into compact rows, in chunks of objects.
+
+        Each chunk converts the records of at most chunk_size objects in its own transaction, so an interrupted
+        conversion resumes where it stopped when it runs again.
+
+        Args:
+            before (datetime): The date of the oldest history kept in the historical table.
+            chunk_size (int, optional): The number of objects of each chunk. Defaults to the CHUNK_SIZE setting.
+            snapshot_interval (int, optional): The number of versions between two snapshots.
+                                               Defaults to the SNAPSHOT_INTERVAL setting.
+            sleep (float, optional): The seconds to wait between chunks. Defaults to the SLEEP setting.
+            on_chunk (callable, optional): Function called after each chunk with the number of objects and records.
+
+        Returns:
+            dict: The number of objects and records converted, and the seconds spent.
+        """
+        chunk_size = chunk_size or get_compact_history_setting("CHUNK_SIZE")
+        snapshot_interval = snapshot_interval or get_compact_history_setting("SNAPSHOT_INTERVAL")
+        sleep = get_compact_history_setting("SLEEP") if sleep is None else sleep
+        started = time.monotonic()
+        objects = records = 0
+        boundary = self.get_boundary(before)
+        if boundary is not None:
+            pending = self.history_model.objects.filter(history_id__lte=boundary).order_by(self.object_field)
+            while True:
+                object_ids = list(pending.values_list(self.object_field, flat=True).distinct()[:chunk_size])
+                if not object_ids:
+                    break
+                converted = self.convert_chunk(object_ids, boundary, snapshot_interval)
+                objects += len(object_ids)
+                records += converted
+                if on_chunk:
+                    on_chunk(len(object_ids), converted)
+                if sleep:
+                    time.sleep(sleep)
+        return {"objects": objects, "records": records, "seconds": time.monotonic() - started}
+
+    def get_version(self, object_id, history_id=None, at=None):
+        """
+        Rebuild a version of an object, from the historical table or from the compact rows.
+
+        It runs one query when the version is in the historical table, and two otherwise: the last snapshot before
+        the version and the diffs that follow it are read with a single indexed query.
+
+        Args:
+            object_id: The primary key of the object.
+            history_id (int, optional): The id of the version. Defaults to the latest version.
+            at (datetime, optional): Rebuild the latest version at this date.
+
+        Returns:
+            dict: The values of the tracked fields and the history columns of the version, or None.
+        """
+        filters = {}
+        if history_id is not None:
+            filters["history_id__lte"] = history_id
+        if at is not None:
+            filters["history_date__lte"] = at
+        record = (
+            self.history_model.objects.filter(**{self.object_field: object_id}, **filters)
+            .order_by("-history_id")
+            .values()
+            .first()
+        )
+        if record is not None:
+            return self.get_full_values(record)
+
+        rows = self.compact_model.objects.filter(object_id=object_id, **filters)
+        last_snapshot = rows.filter(is_snapshot=True).order_by("-history_id").values("history_id")[:1]
+        state = None
+        for row in rows.filter(history_id__gte=Subquery(last_snapshot)).order_by("history_id").values():
+            state = self.apply(state, row)
+        return state
+
+    def iter_versions(self, object_id):
+        """
+        Rebuild every version of an object, oldest first.
+
+        Args:
+            object_id: The primary key of the object.
+
+        Yields:
+            dict: The values of the tracked fields and the history columns of each version.
+        """
+        state = None
+        for row in self.compact_model.objects.filter(object_id=object_id).order_by("history_id").values().iterator():
+            state = self.apply(state, row)
+            yield state
+        records = self.history_model.objects.filter(**{self.object_field: object_id}).order_by("history_id")
+        for record in records.values().iterator():
+            yield self.get_full_values(record)
+
+
+def get_compact_histories(names=None):
+    """
+    Get the compact histories defined in the STORES setting.
+
+    Args:
+        names (list, optional): The names of the compact histories to return. Defaults to every compact history.
+
+    Returns:
+        list: The compact histories.
+
+    Raises:
+        ValueError: If a name does not match any compact history.
+    """
+    stores = [import_string(path)() for path in get_compact_history_setting("STORES")]
+    if not names:
+        return stores
+    unknown = set(names) - {store.name for store in stores}
+    if unknown:
+        raise ValueError(f"Unknown compact histories: {', '.join(sorted(unknown))}")
+    return [store for store in stores if store.name in names]
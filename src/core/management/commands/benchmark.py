@@ -0,0 +1,37 @@
+"""
+Django command to run a benchmark suite of the project.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from core.benchmark import format_result, rollback
+
+
+class Command(BaseCommand):
+    """Django command to run a benchmark suite."""
+
+    help = "Run a benchmark suite, given as <app>.<suite>, for example authentication.login."
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument('suite', help='The suite to run, as <app>.<suite>.')
+        parser.add_argument('--iterations', type=int, default=20, help='Measured calls per case.')
+        parser.add_argument(
+            '--rows', type=int, nargs='+', default=[1000], help='Table sizes, for the suites that use them.'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        app_label, _, suite_name = options['suite'].partition('.')
+        if not suite_name:
+            raise CommandError('The suite must be given as <app>.<suite>.')
+        try:
+            suite = import_string(f'{app_label}.benchmarks.{suite_name}')
+        except ImportError as e:
+            raise CommandError(f'Unknown benchmark suite {options["suite"]}.') from e
+
+        self.stdout.write(f'Running {options["suite"]}...')
+        with rollback():
+            for name, result in suite(**options):
+                self.stdout.write(format_result(name, result))
+        self.stdout.write(self.style.SUCCESS('Done, the changes of the benchmark were rolled back.'))
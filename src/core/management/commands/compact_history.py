@@ -0,0 +1,53 @@
+"""
+Django command to convert the old historical records into compact diffs.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.history import get_compact_histories, get_compact_history_setting
+
+
+class Command(BaseCommand):
+    """Django command to convert the historical records older than AFTER_DAYS days of the compact histories."""
+
+    help = "Convert the old historical records into compact diffs with periodic snapshots, in chunks of objects."
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument('--store', action='append', dest='stores', help='Only convert this history (repeatable).')
+        parser.add_argument('--after-days', type=int, default=get_compact_history_setting("AFTER_DAYS"))
+        parser.add_argument('--chunk-size', type=int, default=get_compact_history_setting("CHUNK_SIZE"))
+        parser.add_argument('--snapshot-interval', type=int, default=get_compact_history_setting("SNAPSHOT_INTERVAL"))
+        parser.add_argument(
+            '--sleep', type=float, default=get_compact_history_setting("SLEEP"), help='Seconds per chunk.'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        try:
+            stores = get_compact_histories(options['stores'])
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+
+        before = timezone.now() - timedelta(days=options['after_days'])
+        for store in stores:
+            self.stdout.write(f'Converting {store.name}...')
+
+            def report_chunk(objects, records, name=store.name):
+                self.stdout.write(f'  {name}: {records} records of {objects} objects')
+
+            result = store.convert(
+                before,
+                chunk_size=options['chunk_size'],
+                snapshot_interval=options['snapshot_interval'],
+                sleep=options['sleep'],
+                on_chunk=report_chunk if options['verbosity'] > 1 else None,
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Converted {result["records"]} records of {result["objects"]} objects of {store.name} '
+                    f'in {result["seconds"]:.3f}s.'
+                )
+            )
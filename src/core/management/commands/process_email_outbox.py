@@ -0,0 +1,81 @@
+"""
+Django command to send the emails stored in the outbox.
+"""
+import argparse
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.outbox import flush_coalescer, get_outbox_setting, process_batch
+from core.transport import InMemoryBackend
+from core.utils import EmailCoalescer
+
+
+class Command(BaseCommand):
+    """Django command to send the emails stored in the outbox."""
+
+    help = "Claim pending emails from the outbox in batches and send them."
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument('--batch-size', type=int, default=get_outbox_setting("BATCH_SIZE"))
+        parser.add_argument('--idle-sleep', type=float, default=1.0, help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true', help='Stop when the outbox is empty.')
+        parser.add_argument(
+            '--bulk',
+            action=argparse.BooleanOptionalAction,
+            default=get_outbox_setting("BULK"),
+            help='Send the emails of the same template and subject together, see the BULK_EMAIL setting. '
+            'Defaults to the BULK setting of EMAIL_OUTBOX, --no-bulk sends them one by one.',
+        )
+        parser.add_argument('--fake', action='store_true', help='Use the in-memory backend instead of the providers.')
+        parser.add_argument('--fake-latency', type=float, default=0.0, help='Seconds per request of the fake provider.')
+        parser.add_argument('--fake-failure-rate', type=float, default=0.0, help='Error rate of the fake provider.')
+        parser.add_argument(
+            '--fake-version-failure-rate',
+            type=float,
+            default=0.0,
+            help='Rate of the recipients of a bulk email rejected by the fake provider.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        sender = backend = coalescer = None
+        if options['fake']:
+            backend = InMemoryBackend(
+                latency=options['fake_latency'],
+                failure_rate=options['fake_failure_rate'],
+                version_failure_rate=options['fake_version_failure_rate'],
+            )
+            sender = backend.send_email
+        if options['bulk']:
+            coalescer = EmailCoalescer(backend=backend)
+
+        total_sent = total_failed = 0
+        started = time.monotonic()
+        self.stdout.write('Processing email outbox...')
+        try:
+            while True:
+                batch_started = time.monotonic()
+                sent, failed = process_batch(sender=sender, batch_size=options['batch_size'], coalescer=coalescer)
+                if sent or failed:
+                    elapsed = time.monotonic() - batch_started
+                    total_sent += sent
+                    total_failed += failed
+                    rate = (sent + failed) / elapsed
+                    self.stdout.write(f'Batch: {sent} sent, {failed} failed in {elapsed:.3f}s ({rate:.1f} emails/s)')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['idle_sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('Interrupted.')
+
+        if coalescer is not None:
+            sent, failed = flush_coalescer(coalescer)
+            total_sent += sent
+            total_failed += failed
+            metrics = coalescer.metrics.as_dict()
+            self.stdout.write('Bulk: ' + ', '.join(f'{key} {value}' for key, value in metrics.items()))
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Done: {total_sent} sent, {total_failed} failed in {elapsed:.3f}s.'))
@@ -0,0 +1,51 @@
+"""
+Django command to delete the expired or aged rows of the tables that only grow.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.retention import get_policies, get_retention_setting, purge
+
+
+class Command(BaseCommand):
+    """Django command to delete the expired rows of the retention policies."""
+
+    help = "Delete the expired rows of the retention policies in chunks of consecutive primary keys."
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument('--policy', action='append', dest='policies', help='Only run this policy (repeatable).')
+        parser.add_argument('--batch-size', type=int, default=get_retention_setting("BATCH_SIZE"))
+        parser.add_argument('--sleep', type=float, default=get_retention_setting("SLEEP"), help='Seconds per chunk.')
+        parser.add_argument('--dry-run', action='store_true', help='Count the expired rows without deleting them.')
+        parser.add_argument('--start-pk', type=int, help='Resume the policy from this primary key.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        try:
+            policies = get_policies(options['policies'])
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+        if options['start_pk'] is not None and len(policies) != 1:
+            raise CommandError('--start-pk needs a single --policy.')
+
+        now = timezone.now()
+        action = 'Found' if options['dry_run'] else 'Deleted'
+        for policy in policies:
+            self.stdout.write(f'Purging {policy.name}...')
+
+            def report_chunk(rows, last_pk, name=policy.name):
+                self.stdout.write(f'  {name}: {rows} rows up to pk {last_pk}')
+
+            result = purge(
+                policy,
+                now,
+                batch_size=options['batch_size'],
+                sleep=options['sleep'],
+                dry_run=options['dry_run'],
+                start_pk=options['start_pk'],
+                on_chunk=report_chunk if options['verbosity'] > 1 else None,
+            )
+            self.stdout.write(
+                self.style.SUCCESS(f'{action} {result["rows"]} rows of {policy.name} in {result["seconds"]:.3f}s.')
+            )
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emailoutbox",
+            name="text_content",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
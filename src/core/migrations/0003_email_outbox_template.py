@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("core", "0002_email_outbox_text_content"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emailoutbox",
+            name="context",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="emailoutbox",
+            name="template",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+    ]
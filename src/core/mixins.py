@@ -0,0 +1,115 @@
+"""
+File that contains the mixins of the views of the project.
+"""
+import calendar
+import hashlib
+
+from django.db.models import Count, Max, Min, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import ValidationError
+
+
+class SparseFieldsMixin:
+    """
+    Mixin for the views that let the client choose the fields of the response with ?fields=a,b.
+
+    Only the fields of sparse_fields can be requested, so the sensitive columns are never returned.
+    Without the parameter the view returns the default_fields.
+    """
+
+    sparse_fields = ()
+    default_fields = ()
+    fields_query_param = "fields"
+
+    def get_sparse_fields(self):
+        """
+        Get the fields requested by the client.
+
+        Returns:
+            tuple: The requested fields, in the given order and without duplicates, or the default fields.
+
+        Raises:
+            ValidationError: If the parameter is empty or it has a field that can not be requested.
+        """
+        value = self.request.query_params.get(self.fields_query_param)
+        if value is None:
+            return tuple(self.default_fields)
+        fields = tuple(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+        if not fields:
+            raise ValidationError({self.fields_query_param: "At least one field is required."})
+        unknown = [name for name in fields if name not in self.sparse_fields]
+        if unknown:
+            raise ValidationError({self.fields_query_param: f"Unknown fields: {', '.join(unknown)}."})
+        return fields
+
+
+class ConditionalGetMixin:
+    """
+    Mixin for the views that answer the conditional GET requests (If-None-Match and If-Modified-Since) with a 304.
+
+    The validators are computed with a single aggregate query over the rows of the response, the greatest updated_at,
+    the number of rows and their ids, so a not modified response is returned without reading nor serializing the rows.
+    The ids are needed because a row can leave the response without changing the others, for example when it is
+    soft deleted, and be replaced by an older row: the greatest updated_at and the number of rows stay the same.
+    The strong ETag also depends on the full path of the request and on the key given by the view, because they
+    select the rows and the fields of the representation.
+    """
+
+    last_modified_field = "updated_at"
+
+    def get_not_modified_response(self, request, queryset, *key):
+        """
+        Compute the validators of a response and check the conditional headers of the request.
+
+        The validators are stored in the view and added to the response by finalize_response.
+
+        Args:
+            request: The HTTP request object.
+            queryset (QuerySet): The rows of the response.
+            *key: Other values that change the representation, such as the id of the authenticated user.
+
+        Returns:
+            HttpResponse: A 304 (or 412) response if the client has the current representation, or None.
+        """
+        state = queryset.aggregate(
+            last_modified=Max(self.last_modified_field),
+            count=Count("pk"),
+            min_pk=Min("pk"),
+            max_pk=Max("pk"),
+            sum_pk=Sum("pk"),
+        )
+        ids = (state["min_pk"], state["max_pk"], state["sum_pk"])
+        return self.check_validators(request, state["last_modified"], state["count"], *key, *ids)
+
+    def check_validators(self, request, last_modified, count, *key):
+        """
+        Check the conditional headers of the request against validators already known by the view.
+
+        It is used by the views that know the greatest updated_at and the number of rows without the aggregate
+        query, for example from a cache, and whose key identifies the rows, such as the id of a single row.
+
+        Args:
+            request: The HTTP request object.
+            last_modified (datetime): The greatest updated_at of the rows of the response.
+            count (int): The number of rows of the response.
+            *key: Other values that change the representation, such as the id of the authenticated user.
+
+        Returns:
+            HttpResponse: A 304 (or 412) response if the client has the current representation, or None.
+        """
+        self.etag = self.last_modified = None
+        if not count:
+            return None
+        validators = [request.get_full_path(), *key, count, last_modified.isoformat()]
+        self.etag = quote_etag(hashlib.sha256(repr(validators).encode()).hexdigest())
+        self.last_modified = calendar.timegm(last_modified.utctimetuple())
+        return get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """Add the ETag and Last-Modified headers to the successful responses."""
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, "etag", None) and 200 <= response.status_code < 300:
+            response.headers.setdefault("ETag", self.etag)
+            response.headers.setdefault("Last-Modified", http_date(self.last_modified))
+        return response
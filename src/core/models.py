@@ -1,9 +1,152 @@
 """
 File for models of the app core.
 """
-from django.db import models
+import copy
+
+from django.db import models, transaction
 from django.utils import timezone
 
+from core.signals import bulk_updated
+
+BULK_CHUNK_SIZE = 1000
+
+
+class SoftDeleteQuerySet(models.QuerySet):
+    """
+    QuerySet of the models of BaseModel, which can select the rows by their deletion.
+
+    A row is deleted when its 'deleted_at' field is set, which BaseModel.save does when the row is not active.
+    """
+
+    def alive(self):
+        """Select the rows that are not deleted."""
+        return self.filter(deleted_at__isnull=True)
+
+    def dead(self):
+        """Select the deleted rows."""
+        return self.filter(deleted_at__isnull=False)
+
+    def soft_delete(self, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Deactivate the rows that are not deleted, with an UPDATE per chunk.
+
+        Args:
+            chunk_size (int, optional): The number of rows of each UPDATE. Defaults to 1000.
+
+        Returns:
+            int: The number of deactivated rows.
+        """
+        now = timezone.now()
+        return self.alive().update_in_chunks(
+            {"is_active": False, "deleted_at": now, "updated_at": now}, {"deleted_at__isnull": True}, chunk_size
+        )
+
+    def restore(self, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Reactivate the deleted rows, with an UPDATE per chunk.
+
+        Args:
+            chunk_size (int, optional): The number of rows of each UPDATE. Defaults to 1000.
+
+        Returns:
+            int: The number of reactivated rows.
+        """
+        values = {"is_active": True, "deleted_at": None, "updated_at": timezone.now()}
+        return self.dead().update_in_chunks(values, {"deleted_at__isnull": False}, chunk_size)
+
+    def update_in_chunks(self, values, condition, chunk_size):
+        """
+        Update the rows of the queryset with an UPDATE per chunk of primary keys.
+
+        Each chunk is updated in its own transaction, with the bulk_updated signal, so the caches are invalidated
+        and the historical records are written once per chunk instead of once per row.
+
+        Args:
+            values (dict): The values of the updated fields.
+            condition (dict): The filter that the rows must still match when they are updated.
+            chunk_size (int): The number of rows of each UPDATE.
+
+        Returns:
+            int: The number of updated rows.
+        """
+        pks = list(self.order_by("pk").values_list("pk", flat=True))
+        rows = 0
+        for start in range(0, len(pks), chunk_size):
+            end = start + chunk_size
+            chunk = pks[start:end]
+            with transaction.atomic(using=self.db):
+                rows += self.model._base_manager.using(self.db).filter(pk__in=chunk, **condition).update(**values)
+                bulk_updated.send(sender=self.model, pks=chunk, fields=list(values), using=self.db)
+        return rows
+
+    def bulk_update_in_chunks(self, objs, fields, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Update some fields of model instances with a bulk_update per chunk.
+
+        'updated_at' is always updated, and 'deleted_at' follows 'is_active' as in BaseModel.save. Each chunk is
+        updated in its own transaction, with the bulk_updated signal.
+
+        Args:
+            objs (list): The instances to update.
+            fields (list): The names of the fields to update.
+            chunk_size (int, optional): The number of instances of each UPDATE. Defaults to 1000.
+
+        Returns:
+            int: The number of updated rows.
+        """
+        objs = list(objs)
+        fields = list(dict.fromkeys([*fields, "updated_at"]))
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+            if "is_active" in fields:
+                if obj.is_active:
+                    obj.deleted_at = None
+                elif obj.deleted_at is None:
+                    obj.deleted_at = now
+        if "is_active" in fields and "deleted_at" not in fields:
+            fields.append("deleted_at")
+
+        rows = 0
+        manager = self.model._base_manager.using(self.db)
+        for start in range(0, len(objs), chunk_size):
+            end = start + chunk_size
+            chunk = objs[start:end]
+            with transaction.atomic(using=self.db):
+                rows += manager.bulk_update(chunk, fields)
+                bulk_updated.send(sender=self.model, pks=[obj.pk for obj in chunk], fields=fields, using=self.db)
+        attnames = [self.model._meta.get_field(name).attname for name in fields]
+        for obj in objs:
+            if hasattr(obj, "_loaded_values"):
+                obj.snapshot_fields(attnames)
+        return rows
+
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """
+    Manager of the models of BaseModel.
+
+    By default the manager only returns the rows that are not deleted, with_deleted() returns every row.
+    With alive_only=False, it returns every row, as the all_objects manager of BaseModel.
+    """
+
+    def __init__(self, *args, alive_only=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.alive_only = alive_only
+
+    def get_queryset(self):
+        """Get the rows of the manager, without the deleted rows if alive_only is True."""
+        queryset = super().get_queryset()
+        return queryset.alive() if self.alive_only else queryset
+
+    def with_deleted(self):
+        """Get every row, including the deleted ones."""
+        return super().get_queryset()
+
+    def dead(self):
+        """Get the deleted rows."""
+        return self.with_deleted().dead()
+
 
 class BaseModel(models.Model):
     """
@@ -23,9 +166,15 @@ class BaseModel(models.Model):
     - is_active: A BooleanField that indicates whether an instance is active or not.
                     If an instance is not active, it is considered deleted and the 'deleted_at' field is set.
 
+    Managers:
+    - objects: The default manager, which excludes the deleted rows.
+    - all_objects: The manager of every row, including the deleted ones.
+
     Methods:
-    - save(): Overrides the default save method to set the 'deleted_at' field if the instance is not active.
+    - save(): Overrides the default save method to set the 'deleted_at' field if the instance is not active,
+              and to only write the fields changed since the instance was loaded.
     - update(): A custom method that calls the save method to update an instance of the model.
+    - get_dirty_fields(): Returns the fields changed since the instance was loaded or saved.
     """
 
     created_at = models.DateTimeField(auto_now_add=True)
@@ -33,6 +182,9 @@ class BaseModel(models.Model):
     deleted_at = models.DateTimeField(null=True, blank=True, default=None)
     is_active = models.BooleanField(default=True)
 
+    objects = SoftDeleteManager()
+    all_objects = SoftDeleteManager(alive_only=False)
+
     class Meta:
         """
         Meta class for BaseModel
@@ -42,30 +194,238 @@ class BaseModel(models.Model):
 
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Build an instance loaded from the database and keep the loaded values, to find the changed fields."""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {}
+        instance.snapshot_fields()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        """Reload fields from the database, which are no longer changed, as when a deferred field is loaded."""
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if hasattr(self, "_loaded_values"):
+            self.snapshot_fields(None if fields is None else [self._meta.get_field(name).attname for name in fields])
+
+    def snapshot_fields(self, attnames=None):
+        """
+        Keep the current values of the fields as the values stored in the database.
+
+        Args:
+            attnames (iterable, optional): The attribute names of the fields. Defaults to every loaded field.
+        """
+        if attnames is None:
+            attnames = [field.attname for field in self._meta.concrete_fields if field.attname in self.__dict__]
+        for attname in attnames:
+            value = self.__dict__[attname]
+            self._loaded_values[attname] = copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+    def get_dirty_fields(self):
+        """
+        Get the fields changed since the instance was loaded or saved.
+
+        The deferred fields that were not loaded nor assigned are never changed.
+
+        Returns:
+            list: The names of the changed fields, or None if the instance was not loaded from the database.
+        """
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None:
+            return None
+        return [
+            field.name
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in self.__dict__
+            and (field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname])
+        ]
+
     def save(self, *args, **kwargs):
         """
         Overrides the default save method.
 
         If the instance is active, sets the 'deleted_at' field to None and saves the instance.
-        If the instance is not active, sets the 'deleted_at' field to the current date and time and saves the instance.
+        If the instance is not active, sets the 'deleted_at' field to the current date and time, unless it is
+        already deleted, and saves the instance.
+        An instance loaded from the database is updated with update_fields set to its changed fields and
+        'updated_at', so only those columns are written, and it is not written at all when no field changed.
         """
         if self.is_active:
             self.deleted_at = None
-            super().save(*args, **kwargs)
-        else:
+        elif self.deleted_at is None:
             self.deleted_at = timezone.now()
-            super().save(*args, **kwargs)
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None and not args and not kwargs.get("force_insert") and not self._state.adding:
+            dirty_fields = self.get_dirty_fields()
+            if dirty_fields is not None:
+                if not dirty_fields:
+                    return
+                kwargs["update_fields"] = update_fields = {*dirty_fields, "updated_at"}
+        super().save(*args, **kwargs)
+
+        if not hasattr(self, "_loaded_values"):
+            self._loaded_values = {}
+        if update_fields is None:
+            self.snapshot_fields()
+        else:
+            self.snapshot_fields(self._meta.get_field(name).attname for name in update_fields)
 
     def update(self, *args, **kwargs):
         """
         Updates an instance of the model.
 
-        If the instance is active, sets the 'deleted_at' field to None and calls the save method.
-        If the instance is not active, sets the 'deleted_at' field to the current date and time and calls save method.
+        It calls the save method, which sets the 'deleted_at' field from the 'is_active' field
+        and only writes the changed fields.
         """
-        if self.is_active:
-            self.deleted_at = None
-            self.save(*args, **kwargs)
-        else:
-            self.deleted_at = timezone.now()
-            self.save(*args, **kwargs)
+        self.save(*args, **kwargs)
+
+
+class CompactHistoricalModel(models.Model):
+    """
+    Base model for the compact history of a model, written by core.history.CompactHistory.
+
+    Each row is a version of an object, with the id, date, type, user and reason of the historical record it replaces.
+    A snapshot row has the values of every tracked field, the other rows only have the fields changed since the
+    previous version, so a version is rebuilt from the last snapshot before it and the diffs that follow.
+
+    Fields:
+    - history_id: The id of the historical record, so the versions keep their order.
+    - object_id: The primary key of the object.
+    - history_date: The date and time of the change.
+    - history_type: The type of the change, + for created, ~ for updated and - for deleted.
+    - history_user_id: The id of the user who made the change.
+    - history_change_reason: The reason of the change.
+    - is_snapshot: Whether the row has the values of every tracked field.
+    - data: The values of the tracked fields, or of the changed fields, by attribute name.
+    """
+
+    history_id = models.BigIntegerField(primary_key=True)
+    object_id = models.BigIntegerField()
+    history_date = models.DateTimeField()
+    history_type = models.CharField(max_length=1)
+    history_user_id = models.BigIntegerField(null=True, blank=True)
+    history_change_reason = models.CharField(max_length=100, null=True, blank=True)
+    is_snapshot = models.BooleanField(default=False)
+    data = models.JSONField()
+
+    class Meta:
+        """
+        Meta class for CompactHistoricalModel
+
+        Abstract is True because each model with a compact history has its own table.
+        """
+
+        abstract = True
+
+
+class DeletionMark(models.Model):
+    """
+    Model for storing the greatest primary key deleted from a table by the retention or the compaction.
+
+    The readers that follow a table in primary key order, such as the change feed of the users, compare their
+    position with the mark to know if rows after it were deleted, without assuming that the keys are contiguous.
+
+    Fields:
+    - name: The label of the model of the table, for example user.HistoricalUser.
+    - last_pk: The greatest primary key deleted.
+    - updated_at: The date and time of the last deletion.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    last_pk = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        """Return string representation of the mark."""
+        return f"{self.name} ({self.last_pk})"
+
+    @classmethod
+    def record(cls, model, pk, using=None):
+        """
+        Record the deletion of a row, if its primary key is greater than the mark of its table.
+
+        Args:
+            model: The model of the deleted row.
+            pk (int): The primary key of the deleted row.
+            using (str, optional): The database of the mark. Defaults to the default database.
+        """
+        manager = cls.objects.db_manager(using)
+        mark, created = manager.get_or_create(name=model._meta.label, defaults={"last_pk": pk})
+        if not created:
+            manager.filter(pk=mark.pk, last_pk__lt=pk).update(last_pk=pk, updated_at=timezone.now())
+
+    @classmethod
+    def get_last_pk(cls, model):
+        """Get the greatest primary key deleted from the table of a model, or None."""
+        return cls.objects.filter(name=model._meta.label).values_list("last_pk", flat=True).first()
+
+
+class EmailOutbox(BaseModel):
+    """
+    Model for storing outgoing emails until a worker delivers them.
+
+    Request handlers insert one row inside their transaction instead of calling the email provider inline.
+    The 'process_email_outbox' command claims pending rows in batches, sends them and records the result.
+
+    Fields:
+    - subject: The subject of the email.
+    - html_content: The HTML content of the email.
+    - text_content: The plain-text alternative of the email, empty if it has none.
+    - to: The recipients of the email, in the format expected by the email provider.
+    - cc: The CC recipients of the email.
+    - bcc: The BCC recipients of the email.
+    - reply_to: The reply-to address of the email.
+    - headers: The extra headers of the email.
+    - status: The delivery status of the email (pending, sending, sent or failed).
+    - attempts: The number of delivery attempts made so far.
+    - max_attempts: The number of attempts after which the email is marked as failed.
+    - next_attempt_at: The date and time from which the email can be claimed again.
+                       While the email is being sent, it is the end of the lease of the worker.
+    - sent_at: The date and time when the email was delivered.
+    - last_error: The error returned by the last failed attempt.
+    - template: The name of the email template the content was rendered from, empty if it has none.
+    - context: The variables of the email template, so the worker can send it in bulk with other emails.
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_SENDING = "sending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENDING, "Sending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    subject = models.CharField(max_length=255)
+    html_content = models.TextField()
+    text_content = models.TextField(blank=True, default="")
+    to = models.JSONField()
+    cc = models.JSONField(null=True, blank=True)
+    bcc = models.JSONField(null=True, blank=True)
+    reply_to = models.JSONField(null=True, blank=True)
+    headers = models.JSONField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    template = models.CharField(max_length=100, blank=True, default="")
+    context = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        """
+        Meta class for EmailOutbox
+
+        The index covers the query used by the worker to claim the emails ready to be sent.
+        """
+
+        indexes = [models.Index(fields=["status", "next_attempt_at"], name="core_outbox_status_next_idx")]
+
+    def __str__(self):
+        """Return string representation of the email."""
+        return f"{self.subject} ({self.status})"
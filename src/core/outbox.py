@@ -0,0 +1,240 @@
+"""
+File that contains the email outbox used to send emails outside the request handlers.
+"""
+import random
+from datetime import timedelta
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.conf import get_app_setting
+from core.emails import render_email
+from core.models import EmailOutbox
+
+DEFAULT_OUTBOX_SETTINGS = {
+    "SENDER": "core.utils.deliver_email",
+    "BATCH_SIZE": 50,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF_SECONDS": 30,
+    "MAX_BACKOFF_SECONDS": 3600,
+    "LEASE_SECONDS": 300,
+    "BULK": False,
+}
+
+
+get_outbox_setting = partial(get_app_setting, "EMAIL_OUTBOX", defaults=DEFAULT_OUTBOX_SETTINGS)
+
+
+def enqueue_email(
+    subject,
+    html_content,
+    to_send_email,
+    cc_send_email=None,
+    bcc_send_email=None,
+    reply_to_email=None,
+    headers=None,
+    text_content=None,
+):  # pylint: disable=too-many-arguments
+    """
+    Stores an email in the outbox so the worker sends it later.
+
+    It takes the same arguments as core.utils.send_email. When it is called inside a transaction,
+    the email is only visible to the worker once the transaction is committed.
+
+    Returns:
+        EmailOutbox: The stored email.
+    """
+    return EmailOutbox.objects.create(
+        subject=subject,
+        html_content=html_content,
+        text_content=text_content or "",
+        to=to_send_email,
+        cc=cc_send_email,
+        bcc=bcc_send_email,
+        reply_to=reply_to_email,
+        headers=headers,
+        max_attempts=get_outbox_setting("MAX_ATTEMPTS"),
+    )
+
+
+def enqueue_template_email(template_name, context, subject, to_send_email):
+    """
+    Renders an email template and stores the email in the outbox.
+
+    The template and its variables are stored with the content, so a worker in bulk mode can send the emails
+    of the same template and subject with a single provider request (see core.utils.EmailCoalescer).
+
+    Args:
+        template_name (str): The name of the email template.
+        context (dict): The variables of the template, they must be serializable as JSON.
+        subject (str): The subject of the email.
+        to_send_email (list): The recipients of the email.
+
+    Returns:
+        EmailOutbox: The stored email.
+    """
+    message = render_email(template_name, context)
+    return EmailOutbox.objects.create(
+        subject=subject,
+        html_content=message.html,
+        text_content=message.text,
+        to=to_send_email,
+        template=template_name,
+        context=context,
+        max_attempts=get_outbox_setting("MAX_ATTEMPTS"),
+    )
+
+
+def get_backoff(attempts):
+    """
+    Get the delay before retrying an email that failed.
+
+    The delay grows exponentially with the number of attempts, is capped by MAX_BACKOFF_SECONDS,
+    and has a random jitter of up to 10% so failed emails are not retried all at once.
+
+    Args:
+        attempts (int): The number of attempts made so far.
+
+    Returns:
+        timedelta: The delay before the next attempt.
+    """
+    seconds = get_outbox_setting("BACKOFF_SECONDS") * 2 ** max(attempts - 1, 0)
+    seconds = min(seconds, get_outbox_setting("MAX_BACKOFF_SECONDS"))
+    return timedelta(seconds=seconds + random.uniform(0, seconds / 10))
+
+
+def claim_batch(batch_size=None):
+    """
+    Claim a batch of emails ready to be sent.
+
+    The rows are locked with SELECT ... FOR UPDATE SKIP LOCKED, so several workers can run at the same time
+    without claiming the same emails. The claimed emails are marked as sending with a lease; if the worker dies,
+    they can be claimed again once the lease expires, unless they reached their maximum attempts: those are marked
+    as failed, so an email that makes the worker crash is not retried forever.
+
+    Args:
+        batch_size (int, optional): The maximum number of emails to claim. Defaults to the BATCH_SIZE setting.
+
+    Returns:
+        list: The claimed EmailOutbox instances.
+    """
+    batch_size = batch_size or get_outbox_setting("BATCH_SIZE")
+    now = timezone.now()
+    with transaction.atomic():
+        EmailOutbox.objects.filter(
+            status=EmailOutbox.STATUS_SENDING, next_attempt_at__lte=now, attempts__gte=F("max_attempts")
+        ).update(status=EmailOutbox.STATUS_FAILED, last_error="The lease of the last attempt expired", updated_at=now)
+        emails = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=EmailOutbox.STATUS_PENDING)
+                | Q(status=EmailOutbox.STATUS_SENDING, attempts__lt=F("max_attempts")),
+                next_attempt_at__lte=now,
+            )
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        if emails:
+            EmailOutbox.objects.filter(pk__in=[email.pk for email in emails]).update(
+                status=EmailOutbox.STATUS_SENDING,
+                attempts=F("attempts") + 1,
+                next_attempt_at=now + timedelta(seconds=get_outbox_setting("LEASE_SECONDS")),
+                updated_at=now,
+            )
+    for email in emails:
+        email.attempts += 1
+    return emails
+
+
+def process_batch(sender=None, batch_size=None, coalescer=None):
+    """
+    Claim a batch of emails and send them.
+
+    With a coalescer, the emails of a template without cc, bcc, reply-to nor headers are added to it instead,
+    and are sent in bulk once their group is full or has waited its window, in this call or in a later one.
+
+    Args:
+        sender (callable, optional): The function used to deliver each email. It takes the same arguments
+                                     as core.utils.send_email, text_content as a keyword argument, and raises
+                                     an exception when the email is not sent. Defaults to the SENDER setting.
+        batch_size (int, optional): The maximum number of emails to claim. Defaults to the BATCH_SIZE setting.
+        coalescer (EmailCoalescer, optional): The collector of the bulk emails (see core.utils). Defaults to None.
+
+    Returns:
+        tuple: The number of emails sent and the number of emails that failed.
+    """
+    sender = sender or import_string(get_outbox_setting("SENDER"))
+    emails = claim_batch(batch_size)
+    results = []
+    for email in emails:
+        if coalescer is not None and email.template and not (email.cc or email.bcc or email.reply_to or email.headers):
+            results.extend(coalescer.add(email.template, email.subject, email.to, email.context or {}, payload=email))
+            continue
+        try:
+            sender(
+                email.subject,
+                email.html_content,
+                email.to,
+                email.cc,
+                email.bcc,
+                email.reply_to,
+                email.headers,
+                text_content=email.text_content or None,
+            )
+            results.append((email, None))
+        except Exception as e:  # pylint: disable=broad-except
+            results.append((email, e))
+    if coalescer is not None:
+        results.extend(coalescer.flush_due())
+    return record_results(results)
+
+
+def flush_coalescer(coalescer):
+    """
+    Send the emails waiting in a coalescer and record their results, for example before the worker stops.
+
+    Args:
+        coalescer (EmailCoalescer): The collector of the bulk emails.
+
+    Returns:
+        tuple: The number of emails sent and the number of emails that failed.
+    """
+    return record_results(coalescer.flush())
+
+
+def record_results(results):
+    """
+    Record the results of the emails sent.
+
+    The emails sent successfully are marked as sent with one UPDATE. The emails that failed are scheduled
+    for a new attempt with an exponential backoff, or marked as failed when they reach their maximum attempts.
+
+    Args:
+        results (list): The EmailOutbox instances and their errors, None for the emails sent.
+
+    Returns:
+        tuple: The number of emails sent and the number of emails that failed.
+    """
+    sent_ids = []
+    failed = 0
+    for email, error in results:
+        if error is None:
+            sent_ids.append(email.pk)
+        else:
+            failed += 1
+            now = timezone.now()
+            if email.attempts >= email.max_attempts:
+                status, next_attempt_at = EmailOutbox.STATUS_FAILED, now
+            else:
+                status, next_attempt_at = EmailOutbox.STATUS_PENDING, now + get_backoff(email.attempts)
+            EmailOutbox.objects.filter(pk=email.pk).update(
+                status=status, next_attempt_at=next_attempt_at, last_error=str(error), updated_at=now
+            )
+    if sent_ids:
+        now = timezone.now()
+        EmailOutbox.objects.filter(pk__in=sent_ids).update(
+            status=EmailOutbox.STATUS_SENT, sent_at=now, last_error="", updated_at=now
+        )
+    return len(sent_ids), failed
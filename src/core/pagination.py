@@ -0,0 +1,359 @@
+"""
+File that contains the keyset pagination of the lists of the project.
+
+The keyset pagination filters the rows after the last row of the previous page instead of skipping them with an
+offset, so with an index on the ordering fields every page costs the same query, whatever its position in the list.
+The change feeds use a forward only variant with signed cursors, which the consumers store to resume the feed.
+"""
+import base64
+import binascii
+import json
+from functools import partial
+
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core.conf import get_app_setting
+
+DEFAULT_PAGINATION_SETTINGS = {
+    "PAGE_SIZE": 50,
+    "MAX_PAGE_SIZE": 500,
+}
+
+
+get_pagination_setting = partial(get_app_setting, "KEYSET_PAGINATION", defaults=DEFAULT_PAGINATION_SETTINGS)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pagination over the ordering fields of a queryset, with opaque next and previous cursors.
+
+    The cursor stores the ordering values of the first or last row of a page and the direction of the pagination.
+    The ordering fields must identify a row, so the last one must be unique, and they must share the same direction.
+    The page size is given with the page_size query parameter and limited to the MAX_PAGE_SIZE setting.
+    """
+
+    ordering = ("-created_at", "-id")
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = _("Invalid cursor")
+
+    def get_page_size(self, request):
+        """
+        Get the page size of the request.
+
+        Args:
+            request: The HTTP request object.
+
+        Returns:
+            int: The page size, between 1 and the MAX_PAGE_SIZE setting.
+        """
+        max_page_size = get_pagination_setting("MAX_PAGE_SIZE")
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            page_size = get_pagination_setting("PAGE_SIZE")
+        return min(max(page_size, 1), max_page_size)
+
+    def encode_cursor(self, row, reverse):
+        """
+        Build the cursor that starts after a row.
+
+        Args:
+            row: The row where the page starts, a model instance or a dictionary of values().
+            reverse (bool): True if the cursor goes to the previous page.
+
+        Returns:
+            str: The cursor.
+        """
+        payload = json.dumps({"p": self.get_position(row), "r": reverse}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def get_position(self, row):
+        """
+        Get the ordering values of a row, serializable as JSON.
+
+        Args:
+            row: A model instance or a dictionary of values().
+
+        Returns:
+            list: The ordering values, with the dates in ISO format.
+        """
+        position = []
+        for name in self.field_names:
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            position.append(value.isoformat() if hasattr(value, "isoformat") else value)
+        return position
+
+    def decode_position(self, position):
+        """
+        Convert the ordering values of a cursor to the values of the fields.
+
+        Args:
+            position (list): The ordering values of the cursor.
+
+        Returns:
+            list: The values of the ordering fields.
+
+        Raises:
+            ValueError: If the number of values does not match the ordering.
+            ValidationError: If a value is not valid for its field.
+        """
+        if len(position) != len(self.field_names):
+            raise ValueError(position)
+        return [self.fields[name].to_python(value) for name, value in zip(self.field_names, position)]
+
+    def decode_cursor(self, request):
+        """
+        Read the cursor of the request.
+
+        Args:
+            request: The HTTP request object.
+
+        Returns:
+            tuple: The ordering values of the cursor, or None in the first page, and True if it goes backwards.
+
+        Raises:
+            NotFound: If the cursor is not valid.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            return self.decode_position(payload["p"]), bool(payload["r"])
+        except (binascii.Error, UnicodeDecodeError, TypeError, KeyError, ValueError, ValidationError) as e:
+            raise NotFound(self.invalid_cursor_message) from e
+
+    def get_position_filter(self, position, descending):
+        """
+        Build the filter of the rows after a position, in the order of the query.
+
+        Args:
+            position (list): The ordering values of the position.
+            descending (bool): True if the query is in descending order.
+
+        Returns:
+            Q: The filter, (a, b) < (x, y) is written as a < x OR (a = x AND b < y).
+        """
+        lookup = "lt" if descending else "gt"
+        condition = Q()
+        equal = {}
+        for name, value in zip(self.field_names, position):
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return condition
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Get the queryset of the page of the request, without evaluating it.
+
+        It has one row more than the page size, to know if there is another page, in the order of the query,
+        which is reversed when the cursor goes to the previous page.
+
+        Args:
+            queryset (QuerySet): The rows to paginate.
+            request: The HTTP request object.
+
+        Returns:
+            QuerySet: The sliced queryset of the page.
+        """
+        self.request = request
+        self.field_names = [name.lstrip("-") for name in self.ordering]
+        self.fields = {name: queryset.model._meta.get_field(name) for name in self.field_names}
+        self.page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request)
+        self.has_cursor = self.position is not None
+
+        descending = self.ordering[0].startswith("-") != self.reverse
+        prefix = "-" if descending else ""
+        queryset = queryset.order_by(*[prefix + name for name in self.field_names])
+        if self.has_cursor:
+            queryset = queryset.filter(self.get_position_filter(self.position, descending))
+        return queryset[: self.page_size + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Get the rows of the page of the request.
+
+        It runs a single query, which reads one row more than the page size to know if there is another page.
+
+        Args:
+            queryset (QuerySet): The rows to paginate.
+            request: The HTTP request object.
+            view (optional): The view that paginates the rows.
+
+        Returns:
+            list: The rows of the page.
+        """
+        rows = list(self.get_page_queryset(queryset, request))
+        self.has_more = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        if self.reverse:
+            self.page.reverse()
+        return self.page
+
+    def get_link(self, row, reverse):
+        """
+        Build the url of the page that starts after a row.
+
+        Args:
+            row: The row where the page starts.
+            reverse (bool): True if the link goes to the previous page.
+
+        Returns:
+            str: The url.
+        """
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(row, reverse))
+
+    def get_next_link(self):
+        """Get the url of the next page, or None in the last page."""
+        if not self.page or not (self.has_cursor if self.reverse else self.has_more):
+            return None
+        return self.get_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        """Get the url of the previous page, or None in the first page."""
+        if not (self.has_more if self.reverse else self.has_cursor):
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.get_link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        """
+        Build the response of a page.
+
+        Args:
+            data (list): The serialized rows of the page.
+
+        Returns:
+            Response: The next and previous urls and the results of the page.
+        """
+        return Response({"next": self.get_next_link(), "previous": self.get_previous_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        """Get the schema of the paginated response."""
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        """Get the query parameters of the pagination for the schema."""
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
+
+
+class ChangeFeedPagination(KeysetPagination):
+    """
+    Forward only keyset pagination of a change feed, in the order of the ids of the historical records.
+
+    The cursor is signed, so the consumers can only resume the feed from a position that it returned. Every response
+    has the cursor of its last change, or the cursor of the request when there is no new change, so a consumer
+    stores it and polls with it until has_more is false.
+    """
+
+    ordering = ("history_id",)
+    cursor_salt = "core.pagination.ChangeFeedPagination"
+
+    def encode_cursor(self, row, reverse=False):
+        """
+        Build the signed cursor that starts after a change.
+
+        Args:
+            row: The last change read by the consumer.
+            reverse (bool, optional): Not supported, the feed only goes forward.
+
+        Returns:
+            str: The cursor.
+        """
+        return signing.dumps(self.get_position(row), salt=self.cursor_salt, compress=True)
+
+    def decode_cursor(self, request):
+        """
+        Read the signed cursor of the request.
+
+        Args:
+            request: The HTTP request object.
+
+        Returns:
+            tuple: The ordering values of the cursor, or None at the start of the feed, and False.
+
+        Raises:
+            NotFound: If the cursor is not valid.
+        """
+        self.cursor = request.query_params.get(self.cursor_query_param) or None
+        if not self.cursor:
+            return None, False
+        try:
+            return self.decode_position(signing.loads(self.cursor, salt=self.cursor_salt)), False
+        except (signing.BadSignature, TypeError, ValueError, ValidationError) as e:
+            raise NotFound(self.invalid_cursor_message) from e
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Get the changes after the cursor of the request, and the cursor of the last one."""
+        page = super().paginate_queryset(queryset, request, view=view)
+        if page:
+            self.cursor = self.encode_cursor(page[-1])
+        return page
+
+    def get_next_link(self):
+        """Get the url of the changes after this page, to poll even when the page is empty."""
+        if not self.cursor:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.cursor)
+
+    def get_paginated_response(self, data):
+        """
+        Build the response of a page of changes.
+
+        Args:
+            data (list): The serialized changes of the page.
+
+        Returns:
+            Response: The cursor and url of the changes after this page, whether more changes are already
+                      available, and the changes.
+        """
+        return Response(
+            {"cursor": self.cursor, "next": self.get_next_link(), "has_more": self.has_more, "results": data}
+        )
+
+    def get_paginated_response_schema(self, schema):
+        """Get the schema of the paginated response."""
+        return {
+            "type": "object",
+            "required": ["cursor", "has_more", "results"],
+            "properties": {
+                "cursor": {"type": "string", "nullable": True},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "has_more": {"type": "boolean"},
+                "results": schema,
+            },
+        }
@@ -0,0 +1,151 @@
+"""
+File that contains the retention engine, which deletes the expired or aged rows of the tables that only grow.
+
+Each table has a retention policy that selects its expired rows. The rows are deleted in chunks of consecutive
+primary keys with a pause between chunks, so a purge never holds long locks nor generates a burst of WAL.
+The policies are listed in the POLICIES of the RETENTION setting.
+"""
+import time
+from datetime import timedelta
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils.module_loading import import_string
+
+from core.conf import get_app_setting
+from core.models import DeletionMark, EmailOutbox
+
+DEFAULT_RETENTION_SETTINGS = {
+    "POLICIES": [],
+    "BATCH_SIZE": 1000,
+    "SLEEP": 0.1,
+    "OTP_DAYS": 1,
+    "OUTBOX_DAYS": 7,
+    "HISTORY_DAYS": 365,
+}
+
+
+get_retention_setting = partial(get_app_setting, "RETENTION", defaults=DEFAULT_RETENTION_SETTINGS)
+
+
+class RetentionPolicy:
+    """
+    Base class for the retention policies.
+
+    A policy has a name, used to select it in the purge_expired_data command, and returns the queryset
+    of the rows that can be deleted. The queryset must only select rows that stay expired, so an interrupted
+    purge resumes where it stopped when it runs again. With track_deletions, the greatest primary key deleted
+    is recorded in a DeletionMark, for the readers that follow the table in primary key order.
+    """
+
+    name = None
+    track_deletions = False
+
+    def get_queryset(self, now):
+        """
+        Get the rows that can be deleted.
+
+        Args:
+            now (datetime): The date and time when the purge started.
+
+        Returns:
+            QuerySet: The expired rows.
+        """
+        raise NotImplementedError("Subclasses of RetentionPolicy must implement get_queryset")
+
+
+def get_policies(names=None):
+    """
+    Get the retention policies defined in the POLICIES setting.
+
+    Args:
+        names (list, optional): The names of the policies to return. Defaults to every policy.
+
+    Returns:
+        list: The retention policies.
+
+    Raises:
+        ValueError: If a name does not match any policy.
+    """
+    policies = [import_string(path)() for path in get_retention_setting("POLICIES")]
+    if not names:
+        return policies
+    unknown = set(names) - {policy.name for policy in policies}
+    if unknown:
+        raise ValueError(f"Unknown retention policies: {', '.join(sorted(unknown))}")
+    return [policy for policy in policies if policy.name in names]
+
+
+def purge(policy, now, batch_size=None, sleep=None, dry_run=False, start_pk=None, on_chunk=None):
+    """
+    Delete the expired rows of a policy in chunks of consecutive primary keys.
+
+    Each chunk covers at most batch_size expired rows, it is deleted in its own transaction, and the purge
+    sleeps between chunks. The rows are processed in primary key order, so the last primary key of each chunk
+    is a checkpoint that can be passed as start_pk to resume an interrupted purge.
+
+    Args:
+        policy (RetentionPolicy): The policy of the rows to delete.
+        now (datetime): The date and time when the purge started.
+        batch_size (int, optional): The maximum number of rows of each chunk. Defaults to the BATCH_SIZE setting.
+        sleep (float, optional): The seconds to wait between chunks. Defaults to the SLEEP setting.
+        dry_run (bool, optional): Count the rows instead of deleting them. Defaults to False.
+        start_pk (optional): The primary key to start from. Defaults to the first expired row.
+        on_chunk (callable, optional): Function called after each chunk with the number of rows
+                                       and the last primary key of the chunk.
+
+    Returns:
+        dict: The number of rows deleted (or found in a dry run), the seconds spent and the last primary key.
+    """
+    batch_size = batch_size or get_retention_setting("BATCH_SIZE")
+    sleep = get_retention_setting("SLEEP") if sleep is None else sleep
+    queryset = policy.get_queryset(now).order_by()
+    started = time.monotonic()
+    rows = 0
+    last_pk = None
+
+    last_offset = batch_size - 1
+    bounds = queryset.aggregate(first_pk=Min("pk"), last_pk=Max("pk"))
+    if bounds["first_pk"] is not None:
+        lower_pk = bounds["first_pk"] if start_pk is None else max(bounds["first_pk"], start_pk)
+        while lower_pk is not None and lower_pk <= bounds["last_pk"]:
+            upper_pks = list(
+                queryset.filter(pk__gte=lower_pk).order_by("pk").values_list("pk", flat=True)[last_offset:batch_size]
+            )
+            upper_pk = upper_pks[0] if upper_pks else bounds["last_pk"]
+            chunk = queryset.filter(pk__gte=lower_pk, pk__lte=upper_pk)
+            if dry_run:
+                deleted = chunk.count()
+            else:
+                with transaction.atomic():
+                    deleted = chunk.delete()[1].get(queryset.model._meta.label, 0)
+                    if deleted and policy.track_deletions:
+                        DeletionMark.record(queryset.model, upper_pk)
+            rows += deleted
+            last_pk = upper_pk
+            if on_chunk:
+                on_chunk(deleted, last_pk)
+            lower_pk = queryset.filter(pk__gt=upper_pk).aggregate(next_pk=Min("pk"))["next_pk"]
+            if lower_pk is not None and sleep:
+                time.sleep(sleep)
+
+    return {"rows": rows, "seconds": time.monotonic() - started, "last_pk": last_pk}
+
+
+class EmailOutboxRetentionPolicy(RetentionPolicy):
+    """
+    Policy that deletes the emails of the outbox sent or failed more than OUTBOX_DAYS days ago.
+
+    The rows keep the rendered emails, such as the OTP codes in the subject and content of the OTP emails,
+    so they are not kept longer than needed to inspect the deliveries.
+    """
+
+    name = "email_outbox"
+
+    def get_queryset(self, now):
+        """Get the emails that reached their final status before the retention period."""
+        return EmailOutbox.all_objects.filter(
+            status__in=[EmailOutbox.STATUS_SENT, EmailOutbox.STATUS_FAILED],
+            updated_at__lt=now - timedelta(days=get_retention_setting("OUTBOX_DAYS")),
+        )
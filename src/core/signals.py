@@ -0,0 +1,25 @@
+"""
+File with the signals of the core app and their receivers.
+"""
+from django.dispatch import Signal, receiver
+
+# Sent once per chunk by the bulk operations of SoftDeleteQuerySet, which update the rows without calling save,
+# with the arguments pks (the primary keys of the updated rows), fields (the updated fields) and using
+bulk_updated = Signal()
+
+
+@receiver(bulk_updated)
+def write_bulk_history(sender, pks, using, **kwargs):
+    """
+    Write the historical records of the rows updated in bulk, with a single insert, for the models with history.
+
+    Args:
+        sender: The model of the rows.
+        pks (list): The primary keys of the updated rows.
+        using (str): The database of the rows.
+    """
+    manager_name = getattr(sender._meta, "simple_history_manager_attribute", None)
+    if not manager_name or not pks:
+        return
+    instances = list(sender._base_manager.using(using).filter(pk__in=pks))
+    getattr(sender, manager_name).bulk_history_create(instances, update=True)
@@ -0,0 +1,503 @@
+"""
+Tests for the core app.
+"""
+import threading
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.emails import inline_css, render_email
+from core.models import EmailOutbox
+from core.outbox import (
+    claim_batch,
+    enqueue_email,
+    enqueue_template_email,
+    flush_coalescer,
+    get_backoff,
+    process_batch,
+    record_results,
+)
+from core.retention import EmailOutboxRetentionPolicy, purge
+from core.transport import ClientPool, InMemoryBackend, ProviderBackend
+from core.utils import EmailCoalescer
+
+
+class BaseModelDirtyFieldsTests(TestCase):
+    """Tests for the updates of BaseModel.save, which only write the changed fields."""
+
+    def setUp(self):
+        """Create an email and load it again from the database."""
+        email = EmailOutbox.objects.create(subject="Subject", html_content="<p>Content</p>", to=["a@example.com"])
+        self.email = EmailOutbox.objects.get(pk=email.pk)
+
+    def get_update(self):
+        """Save the email and return the SQL of its UPDATE."""
+        with CaptureQueriesContext(connection) as queries:
+            self.email.save()
+        updates = [query["sql"] for query in queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        return updates[0]
+
+    def test_save_writes_only_the_changed_fields(self):
+        self.email.subject = "Other subject"
+        sql = self.get_update()
+        self.assertIn('"subject"', sql)
+        self.assertIn('"updated_at"', sql)
+        self.assertNotIn('"html_content"', sql)
+        self.assertNotIn('"to"', sql)
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.subject, "Other subject")
+
+    def test_save_without_changes_does_not_query(self):
+        self.email.subject = "Subject"
+        with self.assertNumQueries(0):
+            self.email.save()
+
+    def test_second_save_only_writes_the_new_changes(self):
+        self.email.subject = "Other subject"
+        self.email.save()
+        self.email.attempts = 1
+        sql = self.get_update()
+        self.assertIn('"attempts"', sql)
+        self.assertNotIn('"subject"', sql)
+
+    def test_json_field_changed_in_place(self):
+        self.email.to.append("b@example.com")
+        self.assertIn('"to"', self.get_update())
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.to, ["a@example.com", "b@example.com"])
+
+    def test_deactivation_writes_deleted_at_once(self):
+        self.email.is_active = False
+        sql = self.get_update()
+        self.assertIn('"deleted_at"', sql)
+        deleted_at = self.email.deleted_at
+        with self.assertNumQueries(0):
+            self.email.save()
+        self.assertEqual(self.email.deleted_at, deleted_at)
+        self.email.is_active = True
+        self.assertIn('"deleted_at"', self.get_update())
+        self.assertIsNone(EmailOutbox.objects.get(pk=self.email.pk).deleted_at)
+
+    def test_assigned_deferred_field_is_saved(self):
+        self.email = EmailOutbox.objects.only("subject").get(pk=self.email.pk)
+        self.email.html_content = "<p>Other content</p>"
+        self.email.save()
+        self.assertEqual(EmailOutbox.objects.get(pk=self.email.pk).html_content, "<p>Other content</p>")
+
+    def test_explicit_update_fields_are_kept(self):
+        self.email.subject = "Other subject"
+        self.email.attempts = 1
+        self.email.save(update_fields=["attempts"])
+        email = EmailOutbox.objects.get(pk=self.email.pk)
+        self.assertEqual((email.subject, email.attempts), ("Subject", 1))
+        self.assertIn('"subject"', self.get_update())
+
+
+class SoftDeleteManagerTests(TestCase):
+    """Tests for the managers of BaseModel, which hide or show the deleted rows."""
+
+    def setUp(self):
+        """Create an active email and a deleted one."""
+        self.alive = EmailOutbox.objects.create(subject="Alive", html_content="", to=["a@example.com"])
+        self.deleted = EmailOutbox.objects.create(
+            subject="Deleted", html_content="", to=["b@example.com"], is_active=False
+        )
+
+    def test_objects_hides_the_deleted_rows(self):
+        self.assertIsNotNone(self.deleted.deleted_at)
+        self.assertEqual(list(EmailOutbox.objects.all()), [self.alive])
+        self.assertFalse(EmailOutbox.objects.filter(pk=self.deleted.pk).exists())
+        self.assertEqual(list(EmailOutbox.objects.dead()), [self.deleted])
+
+    def test_all_objects_shows_the_deleted_rows(self):
+        self.assertEqual(set(EmailOutbox.all_objects.all()), {self.alive, self.deleted})
+        self.assertEqual(set(EmailOutbox.objects.with_deleted()), {self.alive, self.deleted})
+        self.assertEqual(list(EmailOutbox.all_objects.alive()), [self.alive])
+        self.assertEqual(list(EmailOutbox.all_objects.dead()), [self.deleted])
+
+    def test_saving_an_active_row_clears_deleted_at(self):
+        deleted = EmailOutbox.all_objects.get(pk=self.deleted.pk)
+        deleted.is_active = True
+        deleted.save()
+        self.assertIsNone(EmailOutbox.objects.get(pk=self.deleted.pk).deleted_at)
+
+
+class SoftDeleteAdminTests(TestCase):
+    """Tests for the admin of the models of BaseModel, with the deleted rows and the bulk actions."""
+
+    def setUp(self):
+        """Log in as a superuser and create an active email and a deleted one."""
+        admin = get_user_model().objects.create_superuser(email="admin@example.com", password="password")
+        self.client.force_login(admin)
+        self.url = "/admin/core/emailoutbox/"
+        self.alive = EmailOutbox.objects.create(subject="Alive", html_content="", to=["a@example.com"])
+        self.deleted = EmailOutbox.objects.create(
+            subject="Deleted", html_content="", to=["b@example.com"], is_active=False
+        )
+
+    def run_action(self, action, emails):
+        """Run an action of the admin on some emails and return the messages of the response."""
+        data = {"action": action, "_selected_action": [email.pk for email in emails]}
+        response = self.client.post(self.url, data, follow=True)
+        self.assertEqual(response.status_code, 200)
+        return [str(message) for message in response.context["messages"]]
+
+    def test_list_shows_the_deleted_rows(self):
+        response = self.client.get(self.url)
+        self.assertEqual(set(response.context["cl"].result_list), {self.alive, self.deleted})
+
+    def test_soft_delete_selected(self):
+        messages = self.run_action("soft_delete_selected", [self.alive, self.deleted])
+        self.assertEqual(messages, ["1 rows deactivated."])
+        self.assertFalse(EmailOutbox.objects.exists())
+        alive = EmailOutbox.all_objects.get(pk=self.alive.pk)
+        self.assertFalse(alive.is_active)
+        self.assertIsNotNone(alive.deleted_at)
+        self.assertEqual(EmailOutbox.all_objects.get(pk=self.deleted.pk).deleted_at, self.deleted.deleted_at)
+
+    def test_restore_selected(self):
+        messages = self.run_action("restore_selected", [self.alive, self.deleted])
+        self.assertEqual(messages, ["1 rows reactivated."])
+        deleted = EmailOutbox.objects.get(pk=self.deleted.pk)
+        self.assertTrue(deleted.is_active)
+        self.assertIsNone(deleted.deleted_at)
+        self.assertEqual(EmailOutbox.objects.count(), 2)
+
+
+class EmailTemplateTests(TestCase):
+    """Tests for the compiled email templates of core.emails."""
+
+    def test_css_is_inlined_by_specificity(self):
+        html = inline_css(
+            '<style>p { color: #666; } .note { color: #999; } a:hover { color: red; }</style>'
+            '<p class="note" style="margin: 0">Text</p><p>Other</p>'
+        )
+        self.assertEqual(
+            html,
+            '<style>a:hover{color:red}</style><p class="note" style="color:#999;margin:0">Text</p>'
+            '<p style="color:#666">Other</p>',
+        )
+
+    def test_render_html_and_text(self):
+        message = render_email("welcome.html", {"first_name": "<Ana>", "url_frontend": "https://example.com/?a=1&b=2"})
+        self.assertNotIn("<style>.container", message.html)
+        self.assertIn('<p style="color:#666">¡Hola &lt;Ana&gt;!</p>', message.html)
+        self.assertIn('href="https://example.com/?a=1&amp;b=2"', message.html)
+        self.assertIn("¡Hola <Ana>!\n\n", message.text)
+        self.assertIn("Ir al sitio web (https://example.com/?a=1&b=2)", message.text)
+        self.assertNotIn("<", message.text.replace("<Ana>", ""))
+
+
+class BulkEmailTests(TestCase):
+    """Tests for the bulk sending of the outbox emails with EmailCoalescer."""
+
+    def enqueue(self, count):
+        for index in range(count):
+            enqueue_template_email(
+                "welcome.html",
+                {"first_name": f"<User {index}>", "url_frontend": "https://example.com"},
+                "Welcome",
+                [{"email": f"user{index}@example.com"}],
+            )
+
+    def test_full_groups_are_sent_with_one_request(self):
+        self.enqueue(5)
+        backend = InMemoryBackend()
+        coalescer = EmailCoalescer(max_recipients=2, window=60, backend=backend)
+        self.assertEqual(process_batch(sender=backend.send_email, coalescer=coalescer), (4, 0))
+        self.assertEqual(len(coalescer), 1)
+        self.assertEqual(flush_coalescer(coalescer), (1, 0))
+        self.assertEqual(backend.requests, 3)
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailOutbox.STATUS_SENT).count(), 5)
+        email = next(email for email in backend.emails if email["to"] == [{"email": "user0@example.com"}])
+        message = render_email("welcome.html", {"first_name": "<User 0>", "url_frontend": "https://example.com"})
+        self.assertEqual(email["html_content"], message.html)
+        self.assertEqual(email["text_content"], message.text)
+        self.assertEqual(coalescer.metrics.as_dict()["max_batch_size"], 2)
+
+    def test_rejected_versions_are_sent_individually(self):
+        self.enqueue(3)
+        backend = InMemoryBackend(version_failure_rate=1)
+        coalescer = EmailCoalescer(max_recipients=10, window=0, backend=backend)
+        self.assertEqual(process_batch(sender=backend.send_email, coalescer=coalescer), (3, 0))
+        self.assertEqual(backend.requests, 4)
+        metrics = coalescer.metrics.as_dict()
+        self.assertEqual((metrics["batches"], metrics["fallbacks"], metrics["failed"]), (1, 3, 0))
+
+    def test_failed_request_records_errors(self):
+        self.enqueue(2)
+        backend = InMemoryBackend(failure_rate=1)
+        coalescer = EmailCoalescer(max_recipients=10, window=0, backend=backend)
+        self.assertEqual(process_batch(sender=backend.send_email, coalescer=coalescer), (0, 2))
+        failed = EmailOutbox.objects.filter(status=EmailOutbox.STATUS_PENDING).exclude(last_error="")
+        self.assertEqual(failed.count(), 2)
+        self.assertEqual(coalescer.metrics.as_dict()["request_failures"], 1)
+
+    def send_provider_bulk_email(self, response, versions=3):
+        """Send a bulk email with the Brevo backend and a fake client that returns a response."""
+        backend = ProviderBackend()
+        api_instance = MagicMock()
+        api_instance.send_transac_email.return_value = response
+        backend.email_pool = MagicMock()
+        backend.email_pool.acquire.return_value.__enter__.return_value = api_instance
+        versions = [{"to": [{"email": f"user{index}@example.com"}], "params": {}} for index in range(versions)]
+        return backend.send_bulk_email("Welcome", "<p>Welcome</p>", versions)
+
+    def test_provider_message_ids_are_matched_with_the_versions(self):
+        response = SimpleNamespace(message_ids=["<1>", None, "<3>"], message_id=None)
+        self.assertEqual(self.send_provider_bulk_email(response), ["<1>", None, "<3>"])
+
+    def test_provider_message_ids_that_do_not_match_the_versions_send_every_version(self):
+        for response in (
+            SimpleNamespace(message_ids=["<1>", "<2>"], message_id=None),
+            SimpleNamespace(message_ids=None, message_id="<1>"),
+        ):
+            with self.assertLogs("core.transport", "WARNING"):
+                message_ids = self.send_provider_bulk_email(response)
+            self.assertEqual(len(message_ids), 3)
+            self.assertEqual(len(set(message_ids)), 1)
+            self.assertIsNotNone(message_ids[0])
+
+    @override_settings(EMAIL_OUTBOX={"BULK": True})
+    def test_command_can_disable_the_bulk_setting(self):
+        for args, bulk in (((), True), (("--no-bulk",), False), (("--bulk",), True)):
+            self.enqueue(2)
+            stdout = StringIO()
+            call_command("process_email_outbox", "--once", "--fake", *args, stdout=stdout)
+            self.assertEqual("Bulk:" in stdout.getvalue(), bulk)
+            self.assertFalse(EmailOutbox.objects.filter(status=EmailOutbox.STATUS_PENDING).exists())
+
+
+@override_settings(EMAIL_OUTBOX={"MAX_ATTEMPTS": 2, "BACKOFF_SECONDS": 10, "MAX_BACKOFF_SECONDS": 30})
+class EmailOutboxTests(TestCase):
+    """Tests for the enqueue, claim and retries of the email outbox."""
+
+    def setUp(self):
+        """Enqueue an email."""
+        self.email = enqueue_email("Subject", "<p>Content</p>", [{"email": "a@example.com"}], text_content="Content")
+
+    def expire_lease(self):
+        EmailOutbox.objects.filter(pk=self.email.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+    def test_enqueue_stores_a_pending_email(self):
+        email = EmailOutbox.objects.get(pk=self.email.pk)
+        self.assertEqual((email.status, email.attempts, email.max_attempts), (EmailOutbox.STATUS_PENDING, 0, 2))
+        self.assertEqual(email.text_content, "Content")
+
+    def test_claim_leases_the_email(self):
+        [email] = claim_batch()
+        self.assertEqual(email.attempts, 1)
+        stored = EmailOutbox.objects.get(pk=self.email.pk)
+        self.assertEqual((stored.status, stored.attempts), (EmailOutbox.STATUS_SENDING, 1))
+        self.assertGreater(stored.next_attempt_at, timezone.now())
+        self.assertEqual(claim_batch(), [])
+
+    def test_expired_lease_is_claimed_again(self):
+        claim_batch()
+        self.expire_lease()
+        [email] = claim_batch()
+        self.assertEqual(email.attempts, 2)
+
+    def test_expired_lease_of_the_last_attempt_fails_the_email(self):
+        claim_batch()
+        self.expire_lease()
+        claim_batch()
+        self.expire_lease()
+        self.assertEqual(claim_batch(), [])
+        email = EmailOutbox.objects.get(pk=self.email.pk)
+        self.assertEqual((email.status, email.attempts), (EmailOutbox.STATUS_FAILED, 2))
+        self.assertEqual(email.last_error, "The lease of the last attempt expired")
+
+    def test_backoff_grows_and_is_capped(self):
+        for attempts, seconds in ((1, 10), (2, 20), (3, 30), (10, 30)):
+            delay = get_backoff(attempts).total_seconds()
+            self.assertGreaterEqual(delay, seconds)
+            self.assertLessEqual(delay, seconds * 1.1)
+
+    def test_record_results_of_a_sent_email(self):
+        [email] = claim_batch()
+        self.assertEqual(record_results([(email, None)]), (1, 0))
+        email = EmailOutbox.objects.get(pk=self.email.pk)
+        self.assertEqual(email.status, EmailOutbox.STATUS_SENT)
+        self.assertIsNotNone(email.sent_at)
+
+    def test_record_results_retries_then_fails(self):
+        [email] = claim_batch()
+        self.assertEqual(record_results([(email, ConnectionError("down"))]), (0, 1))
+        stored = EmailOutbox.objects.get(pk=self.email.pk)
+        self.assertEqual((stored.status, stored.last_error), (EmailOutbox.STATUS_PENDING, "down"))
+        self.assertGreaterEqual(stored.next_attempt_at, timezone.now() + timedelta(seconds=9))
+
+        self.expire_lease()
+        [email] = claim_batch()
+        record_results([(email, ConnectionError("down"))])
+        self.assertEqual(EmailOutbox.objects.get(pk=self.email.pk).status, EmailOutbox.STATUS_FAILED)
+
+    def test_process_batch_sends_with_the_text_alternative(self):
+        backend = InMemoryBackend()
+        self.assertEqual(process_batch(sender=backend.send_email), (1, 0))
+        self.assertEqual(backend.emails[0]["text_content"], "Content")
+
+
+class EmailOutboxRetentionTests(TestCase):
+    """Tests for the retention of the emails of the outbox."""
+
+    def create_email(self, status, days):
+        """Create an email with a status, updated some days ago."""
+        email = EmailOutbox.objects.create(subject=status, html_content="", to=["a@example.com"], status=status)
+        EmailOutbox.objects.filter(pk=email.pk).update(updated_at=timezone.now() - timedelta(days=days))
+        return email
+
+    def test_sent_and_failed_emails_are_deleted_after_the_retention_period(self):
+        self.create_email(EmailOutbox.STATUS_SENT, 8)
+        self.create_email(EmailOutbox.STATUS_FAILED, 8)
+        kept = [
+            self.create_email(EmailOutbox.STATUS_SENT, 6),
+            self.create_email(EmailOutbox.STATUS_PENDING, 8),
+            self.create_email(EmailOutbox.STATUS_SENDING, 8),
+        ]
+        result = purge(EmailOutboxRetentionPolicy(), timezone.now(), sleep=0)
+        self.assertEqual(result["rows"], 2)
+        self.assertEqual(set(EmailOutbox.all_objects.all()), set(kept))
+
+
+class PurgeTests(TestCase):
+    """Tests for the chunked deletes of the retention engine and the purge_expired_data command."""
+
+    def setUp(self):
+        """Create seven expired emails, with a recent email after each of the first three."""
+        self.expired = []
+        self.recent = []
+        old = timezone.now() - timedelta(days=30)
+        for index in range(7):
+            email = EmailOutbox.objects.create(
+                subject="Expired", html_content="", to=[], status=EmailOutbox.STATUS_SENT
+            )
+            EmailOutbox.objects.filter(pk=email.pk).update(updated_at=old)
+            self.expired.append(email.pk)
+            if index < 3:
+                email = EmailOutbox.objects.create(
+                    subject="Recent", html_content="", to=[], status=EmailOutbox.STATUS_SENT
+                )
+                self.recent.append(email.pk)
+        self.policy = EmailOutboxRetentionPolicy()
+
+    def purge(self, **kwargs):
+        """Purge the expired emails, and return the result and the chunks."""
+        chunks = []
+        result = purge(
+            self.policy, timezone.now(), sleep=0, on_chunk=lambda rows, pk: chunks.append((rows, pk)), **kwargs
+        )
+        return result, chunks
+
+    def get_remaining(self):
+        """Get the primary keys of the remaining emails."""
+        return set(EmailOutbox.all_objects.values_list("pk", flat=True))
+
+    def test_expired_rows_are_deleted_in_chunks(self):
+        result, chunks = self.purge(batch_size=3)
+        self.assertEqual(result["rows"], 7)
+        self.assertEqual(chunks, [(3, self.expired[2]), (3, self.expired[5]), (1, self.expired[6])])
+        self.assertEqual(result["last_pk"], self.expired[6])
+        self.assertEqual(self.get_remaining(), set(self.recent))
+
+    @override_settings(RETENTION={"BATCH_SIZE": 4})
+    def test_chunks_default_to_the_batch_size_setting(self):
+        result, chunks = self.purge()
+        self.assertEqual([rows for rows, _ in chunks], [4, 3])
+
+    def test_dry_run_deletes_nothing(self):
+        result, chunks = self.purge(batch_size=3, dry_run=True)
+        self.assertEqual(result["rows"], 7)
+        self.assertEqual([rows for rows, _ in chunks], [3, 3, 1])
+        self.assertEqual(self.get_remaining(), set(self.expired + self.recent))
+
+    def test_purge_resumes_from_the_start_pk(self):
+        result, _ = self.purge(batch_size=3, start_pk=self.expired[4])
+        self.assertEqual(result["rows"], 3)
+        self.assertEqual(self.get_remaining(), set(self.expired[:4] + self.recent))
+
+    def test_command_runs_the_selected_policy(self):
+        stdout = StringIO()
+        call_command("purge_expired_data", "--policy", "email_outbox", "--dry-run", "--sleep", "0", stdout=stdout)
+        self.assertIn("Found 7 rows of email_outbox", stdout.getvalue())
+        self.assertEqual(len(self.get_remaining()), 10)
+        call_command(
+            "purge_expired_data", "--policy", "email_outbox", "--batch-size", "2", "--sleep", "0", stdout=stdout
+        )
+        self.assertIn("Deleted 7 rows of email_outbox", stdout.getvalue())
+        self.assertEqual(self.get_remaining(), set(self.recent))
+
+    def test_command_rejects_unknown_policies_and_ambiguous_start_pk(self):
+        with self.assertRaisesMessage(CommandError, "Unknown retention policies: unknown"):
+            call_command("purge_expired_data", "--policy", "unknown", stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "--start-pk needs a single --policy."):
+            call_command("purge_expired_data", "--start-pk", "1", stdout=StringIO())
+
+
+class ClientPoolTests(SimpleTestCase):
+    """Tests for the pool of the provider clients."""
+
+    def setUp(self):
+        self.created = []
+
+    def factory(self):
+        """Create a new client."""
+        client = object()
+        self.created.append(client)
+        return client
+
+    def test_released_clients_are_reused(self):
+        pool = ClientPool(self.factory, 2)
+        with pool.acquire() as first:
+            pass
+        with pool.acquire() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(len(self.created), 1)
+
+    def test_clients_in_use_are_never_shared_up_to_the_limit(self):
+        pool = ClientPool(self.factory, 2, timeout=0.01)
+        with pool.acquire() as first, pool.acquire() as second:
+            self.assertIsNot(first, second)
+            with self.assertRaises(TimeoutError):
+                with pool.acquire():
+                    pass
+        self.assertEqual(len(self.created), 2)
+
+    def test_acquire_waits_for_a_released_client(self):
+        pool = ClientPool(self.factory, 1, timeout=5)
+        acquired, release = threading.Event(), threading.Event()
+
+        def hold():
+            with pool.acquire():
+                acquired.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        acquired.wait(5)
+        threading.Timer(0.05, release.set).start()
+        with pool.acquire() as client:
+            self.assertIs(client, self.created[0])
+        thread.join()
+        self.assertEqual(len(self.created), 1)
+
+    def test_factory_errors_free_their_slot(self):
+        failing = MagicMock(side_effect=[ConnectionError("provider down"), "client"])
+        pool = ClientPool(failing, 1, timeout=0.01)
+        with self.assertRaises(ConnectionError):
+            with pool.acquire():
+                pass
+        with pool.acquire() as client:
+            self.assertEqual(client, "client")
+        self.assertEqual(pool.created, 1)
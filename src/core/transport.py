@@ -0,0 +1,445 @@
+"""
+File that contains the transport layer used to talk to the email and SMS providers.
+
+The provider clients are created once per process and reused between calls. The backend is chosen with the
+PROVIDER_TRANSPORT setting, so an in-memory backend can replace the real providers in tests and benchmarks.
+"""
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import partial
+
+import boto3
+import sib_api_v3_sdk
+from botocore.config import Config
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from core.conf import get_app_setting
+
+DEFAULT_TRANSPORT_SETTINGS = {
+    "BACKEND": "core.transport.ProviderBackend",
+    "EMAIL_POOL_SIZE": 4,
+    "EMAIL_MAX_CONNECTIONS": 10,
+    "SMS_MAX_CONNECTIONS": 10,
+    "POOL_TIMEOUT": 5,
+    "CONNECT_TIMEOUT": 5,
+    "READ_TIMEOUT": 30,
+}
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*params\.(\w+)\s*\}\}")
+
+
+get_transport_setting = partial(get_app_setting, "PROVIDER_TRANSPORT", defaults=DEFAULT_TRANSPORT_SETTINGS)
+
+logger = logging.getLogger(__name__)
+
+
+class ClientPool:
+    """
+    Thread-safe pool of reusable clients.
+
+    The clients are created lazily by the factory, up to max_size clients. When all of them are in use,
+    acquire waits up to timeout seconds for one to be released.
+    """
+
+    def __init__(self, factory, max_size, timeout=None):
+        """
+        Initialize the pool.
+
+        Args:
+            factory (callable): The function that creates a new client.
+            max_size (int): The maximum number of clients of the pool.
+            timeout (float, optional): The seconds to wait for a free client. Defaults to waiting forever.
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.created = 0
+        self.clients = queue.LifoQueue()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Borrow a client from the pool and give it back when the block ends.
+
+        Raises:
+            TimeoutError: If no client is released before the timeout.
+        """
+        client = self._get()
+        try:
+            yield client
+        finally:
+            self.clients.put(client)
+
+    def _get(self):
+        """Get a free client, creating a new one if the pool is not full."""
+        try:
+            return self.clients.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.max_size:
+                self.created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+        try:
+            return self.clients.get(timeout=self.timeout)
+        except queue.Empty as e:
+            raise TimeoutError(f"No client released after {self.timeout} seconds") from e
+
+
+def render_placeholders(content, params):
+    """
+    Replace the placeholders of a bulk email, such as {{ params.first_name }}, by the parameters of a version.
+
+    Args:
+        content (str): The content with placeholders, or None.
+        params (dict): The parameters of the version.
+
+    Returns:
+        str: The content of the version, or None.
+    """
+    if content is None:
+        return None
+    return PLACEHOLDER_RE.sub(lambda match: str(params.get(match.group(1), "")), content)
+
+
+class BaseTransportBackend:
+    """
+    Base class for the transport backends.
+
+    A backend sends the emails and SMS of the project. The methods raise an exception when the provider
+    does not accept the message.
+    """
+
+    def send_email(
+        self,
+        subject,
+        html_content,
+        to_send_email,
+        cc_send_email=None,
+        bcc_send_email=None,
+        reply_to_email=None,
+        headers=None,
+        text_content=None,
+    ):  # pylint: disable=too-many-arguments
+        """
+        Send a transactional email.
+
+        It takes the same arguments as core.utils.send_email.
+
+        Returns:
+            The response of the provider.
+        """
+        raise NotImplementedError("Subclasses of BaseTransportBackend must implement send_email")
+
+    def send_bulk_email(self, subject, html_content, versions, text_content=None):
+        """
+        Send a transactional email to many recipients with a single request.
+
+        The content has placeholders, such as {{ params.first_name }}, replaced by the provider with the parameters
+        of each version.
+
+        Args:
+            subject (str): The subject of the email.
+            html_content (str): The HTML content of the email, with placeholders.
+            versions (list): The versions of the email, as dictionaries with the "to" recipients and the "params".
+            text_content (str, optional): The plain-text alternative of the email, with placeholders. Defaults to None.
+
+        Returns:
+            list: The message id of each version, None for the versions rejected by the provider. When the ids
+                  returned by the provider can't be matched with the versions, every version has the same id.
+
+        Raises:
+            Exception: If the provider rejects the whole request.
+        """
+        raise NotImplementedError("Subclasses of BaseTransportBackend must implement send_bulk_email")
+
+    def send_sms(self, phone_number, message):
+        """
+        Send an SMS message.
+
+        Args:
+            phone_number (str): The phone number to which the SMS message will be sent.
+            message (str): The message to be sent in the SMS.
+
+        Returns:
+            dict: The response of the provider, with the status code in ResponseMetadata.HTTPStatusCode.
+        """
+        raise NotImplementedError("Subclasses of BaseTransportBackend must implement send_sms")
+
+
+class ProviderBackend(BaseTransportBackend):
+    """
+    Backend that sends the emails with Sendinblue/Brevo and the SMS with Amazon SNS.
+
+    The Brevo clients are kept in a pool, each one with its own keep-alive connection pool. The SNS client
+    is thread-safe, so a single client with a connection pool of SMS_MAX_CONNECTIONS is shared by all threads.
+    """
+
+    def __init__(self):
+        """Initialize the backend, the clients are created on the first use."""
+        self.timeout = (get_transport_setting("CONNECT_TIMEOUT"), get_transport_setting("READ_TIMEOUT"))
+        self.email_pool = ClientPool(
+            self._create_email_client, get_transport_setting("EMAIL_POOL_SIZE"), get_transport_setting("POOL_TIMEOUT")
+        )
+        self.sender = {"name": os.environ.get("SENDER_NAME"), "email": os.environ.get("SENDER_EMAIL")}
+        self.sms_client = None
+        self.sms_lock = threading.Lock()
+
+    @staticmethod
+    def _create_email_client():
+        """Create a Brevo client."""
+        configuration = sib_api_v3_sdk.Configuration()
+        configuration.api_key['api-key'] = os.environ.get('BREVO_API_KEY')
+        configuration.connection_pool_maxsize = get_transport_setting("EMAIL_MAX_CONNECTIONS")
+        return sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
+
+    def _get_sms_client(self):
+        """Get the SNS client, creating it on the first call."""
+        if self.sms_client is None:
+            with self.sms_lock:
+                if self.sms_client is None:
+                    self.sms_client = boto3.session.Session().client(
+                        "sns",
+                        region_name=os.environ.get("AWS_REGION_NAME"),
+                        aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
+                        aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
+                        config=Config(
+                            max_pool_connections=get_transport_setting("SMS_MAX_CONNECTIONS"),
+                            connect_timeout=self.timeout[0],
+                            read_timeout=self.timeout[1],
+                            tcp_keepalive=True,
+                        ),
+                    )
+        return self.sms_client
+
+    def send_email(
+        self,
+        subject,
+        html_content,
+        to_send_email,
+        cc_send_email=None,
+        bcc_send_email=None,
+        reply_to_email=None,
+        headers=None,
+        text_content=None,
+    ):  # pylint: disable=too-many-arguments
+        """
+        Send a transactional email with the Brevo API.
+
+        Raises:
+            ApiException: If the Brevo API rejects the email.
+        """
+        send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
+            to=to_send_email,
+            bcc=bcc_send_email,
+            cc=cc_send_email,
+            reply_to=reply_to_email,
+            headers=headers,
+            html_content=html_content,
+            text_content=text_content,
+            sender=self.sender,
+            subject=subject,
+        )
+        with self.email_pool.acquire() as api_instance:
+            return api_instance.send_transac_email(send_smtp_email, _request_timeout=self.timeout)
+
+    def send_bulk_email(self, subject, html_content, versions, text_content=None):
+        """
+        Send a transactional email to many recipients with a single request of the Brevo API, with messageVersions.
+
+        Brevo returns one message id per version when it accepts the request. If it returns another number of ids,
+        they can't be matched with the versions, so the request is considered sent for every version, with the ids
+        of the response as the id of each version, rather than resending emails that may have been delivered.
+
+        Raises:
+            ApiException: If the Brevo API rejects the request.
+        """
+        send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
+            html_content=html_content,
+            text_content=text_content,
+            sender=self.sender,
+            subject=subject,
+            message_versions=[
+                sib_api_v3_sdk.SendSmtpEmailMessageVersions(to=version["to"], params=version["params"])
+                for version in versions
+            ],
+        )
+        with self.email_pool.acquire() as api_instance:
+            response = api_instance.send_transac_email(send_smtp_email, _request_timeout=self.timeout)
+        message_ids = list(response.message_ids or [response.message_id])
+        if len(message_ids) == len(versions):
+            return message_ids
+        logger.warning("Brevo returned %s message ids for %s versions of a bulk email", len(message_ids), len(versions))
+        return [",".join(str(message_id) for message_id in message_ids if message_id)] * len(versions)
+
+    def send_sms(self, phone_number, message):
+        """
+        Send an SMS message with Amazon SNS.
+
+        Raises:
+            Exception: If the SNS API rejects the message.
+        """
+        return self._get_sms_client().publish(PhoneNumber=phone_number, Message=message)
+
+
+class InMemoryBackend(BaseTransportBackend):
+    """
+    Backend that keeps the messages in memory instead of sending them.
+
+    It can simulate the latency and the errors of a real provider, so the code that sends emails and SMS
+    can be tested and benchmarked offline. The bulk emails are stored once per version, with the placeholders
+    replaced by its parameters.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, version_failure_rate=0.0):
+        """
+        Initialize the backend.
+
+        Args:
+            latency (float, optional): The seconds each request takes. Defaults to 0.
+            failure_rate (float, optional): The probability, between 0 and 1, of a request failing. Defaults to 0.
+            version_failure_rate (float, optional): The probability, between 0 and 1, of a version of a bulk email
+                                                    being rejected when the request succeeds. Defaults to 0.
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.version_failure_rate = version_failure_rate
+        self.emails = []
+        self.sms = []
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _simulate_provider(self):
+        """
+        Wait the latency of the provider and fail randomly.
+
+        Raises:
+            ConnectionError: If the request is selected to fail.
+        """
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise ConnectionError("In-memory provider error")
+
+    def send_email(
+        self,
+        subject,
+        html_content,
+        to_send_email,
+        cc_send_email=None,
+        bcc_send_email=None,
+        reply_to_email=None,
+        headers=None,
+        text_content=None,
+    ):  # pylint: disable=too-many-arguments
+        """Store the email in the emails list."""
+        self._simulate_provider()
+        return {
+            "message_id": self._store_email(
+                {
+                    "subject": subject,
+                    "html_content": html_content,
+                    "text_content": text_content,
+                    "to": to_send_email,
+                    "cc": cc_send_email,
+                    "bcc": bcc_send_email,
+                    "reply_to": reply_to_email,
+                    "headers": headers,
+                }
+            )
+        }
+
+    def send_bulk_email(self, subject, html_content, versions, text_content=None):
+        """Store an email in the emails list for each version that is not selected to fail."""
+        self._simulate_provider()
+        message_ids = []
+        for version in versions:
+            if self.version_failure_rate and random.random() < self.version_failure_rate:
+                message_ids.append(None)
+                continue
+            message_ids.append(
+                self._store_email(
+                    {
+                        "subject": subject,
+                        "html_content": render_placeholders(html_content, version["params"]),
+                        "text_content": render_placeholders(text_content, version["params"]),
+                        "to": version["to"],
+                        "cc": None,
+                        "bcc": None,
+                        "reply_to": None,
+                        "headers": None,
+                    }
+                )
+            )
+        return message_ids
+
+    def _store_email(self, email):
+        """Store an email in the emails list with a new message id, and return the id."""
+        message_id = str(uuid.uuid4())
+        with self.lock:
+            self.emails.append({"message_id": message_id, **email})
+        return message_id
+
+    def send_sms(self, phone_number, message):
+        """Store the SMS in the sms list."""
+        self._simulate_provider()
+        message_id = str(uuid.uuid4())
+        with self.lock:
+            self.sms.append({"message_id": message_id, "phone_number": phone_number, "message": message})
+        return {"MessageId": message_id, "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Get the transport backend of the process.
+
+    The backend defined in the BACKEND setting is created on the first call and reused afterwards.
+
+    Returns:
+        BaseTransportBackend: The transport backend.
+    """
+    global _backend  # pylint: disable=global-statement
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(get_transport_setting("BACKEND"))()
+    return _backend
+
+
+def reset_backend(**kwargs):
+    """
+    Discard the transport backend of the process, so the next call to get_backend creates a new one.
+
+    It is connected to the setting_changed signal, so override_settings(PROVIDER_TRANSPORT=...) takes effect.
+    """
+    global _backend  # pylint: disable=global-statement
+    if kwargs.get("setting", "PROVIDER_TRANSPORT") == "PROVIDER_TRANSPORT":
+        with _backend_lock:
+            _backend = None
+
+
+setting_changed.connect(reset_backend)
@@ -1,15 +1,72 @@
 """
 File that contains utility functions for the project.
 """
-import os
+import threading
+import time
+from functools import partial
 
-import boto3
-import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
 
+from core.conf import get_app_setting
+from core.emails import get_email_template
+from core.transport import get_backend
+
+DEFAULT_BULK_EMAIL_SETTINGS = {
+    "MAX_RECIPIENTS": 100,
+    "WINDOW_SECONDS": 2.0,
+}
+
+
+get_bulk_email_setting = partial(get_app_setting, "BULK_EMAIL", defaults=DEFAULT_BULK_EMAIL_SETTINGS)
+
+
+def deliver_email(
+    subject,
+    html_content,
+    to_send_email,
+    cc_send_email=None,
+    bcc_send_email=None,
+    reply_to_email=None,
+    headers=None,
+    text_content=None,
+):  # pylint: disable=too-many-arguments
+    """
+    Delivers a transactional email using the backend of core.transport (Sendinblue/Brevo by default).
+
+    Unlike send_email, errors are not converted to a message, so callers such as the email outbox worker
+    can retry the delivery.
+
+    Args:
+        subject (str): The subject of the email.
+        html_content (str): The HTML content of the email.
+        to_send_email (str or list): The recipient email address(es).
+        cc_send_email (str or list, optional): The CC email address(es). Defaults to None.
+        bcc_send_email (str or list, optional): The BCC email address(es). Defaults to None.
+        reply_to_email (str, optional): The reply-to address. Defaults to None.
+        headers (dict, optional): The email headers. Defaults to None.
+        text_content (str, optional): The plain-text alternative of the email. Defaults to None.
+
+    Returns:
+        The response of the provider.
+
+    Raises:
+        ApiException: If the Brevo API rejects the email.
+        Exception: If the provider of another backend rejects the email.
+    """
+    return get_backend().send_email(
+        subject, html_content, to_send_email, cc_send_email, bcc_send_email, reply_to_email, headers, text_content
+    )
+
 
 def send_email(
-    subject, html_content, to_send_email, cc_send_email=None, bcc_send_email=None, reply_to_email=None, headers=None
+    subject,
+    html_content,
+    to_send_email,
+    cc_send_email=None,
+    bcc_send_email=None,
+    reply_to_email=None,
+    headers=None,
+    text_content=None,
 ):  # pylint: disable=too-many-arguments
     """
     Sends a transactional email using the Sendinblue/Brevo API.
@@ -22,39 +79,225 @@ def send_email(
         bcc_send_email (str or list, optional): The BCC email address(es). Defaults to None.
         reply_to_email (str, optional): The reply-to email address. Defaults to None.
         headers (dict, optional): The email headers. Defaults to None.
+        text_content (str, optional): The plain-text alternative of the email. Defaults to None.
 
     Returns:
         str: Message if the email is sent successfully.
         str: Error message if an exception occurs.
     """
-    configuration = sib_api_v3_sdk.Configuration()
-    configuration.api_key['api-key'] = os.environ.get('BREVO_API_KEY')
-
-    api_instance = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
-    sender = {"name": os.environ.get("SENDER_NAME"), "email": os.environ.get("SENDER_EMAIL")}
-
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=to_send_email,
-        bcc=bcc_send_email,
-        cc=cc_send_email,
-        reply_to=reply_to_email,
-        headers=headers,
-        html_content=html_content,
-        sender=sender,
-        subject=subject,
-    )
-
     try:
-        api_response = api_instance.send_transac_email(send_smtp_email)
+        api_response = deliver_email(
+            subject, html_content, to_send_email, cc_send_email, bcc_send_email, reply_to_email, headers, text_content
+        )
         print(api_response)
         return "Email sent successfully."
     except ApiException as e:
         return f"Exception when calling SMTPApi->send_transac_email: {e}\n"
 
 
+class BulkEmailMetrics:
+    """
+    Thread-safe metrics of the emails sent by send_bulk_email.
+
+    Each call records a batch, with its size, its latency (including the individual sends of the fallback),
+    the number of provider requests, the emails sent again one by one and the emails that could not be sent.
+    """
+
+    def __init__(self):
+        """Initialize the metrics."""
+        self.lock = threading.Lock()
+        self.batch_sizes = []
+        self.latencies = []
+        self.requests = self.request_failures = self.fallbacks = self.failed = 0
+
+    def record(self, size, seconds, requests, request_failed, fallbacks, failed):
+        """
+        Record a batch.
+
+        Args:
+            size (int): The number of emails of the batch.
+            seconds (float): The seconds taken to send the batch.
+            requests (int): The number of provider requests made.
+            request_failed (bool): Whether the bulk request was rejected as a whole.
+            fallbacks (int): The number of emails sent individually after the bulk request.
+            failed (int): The number of emails that could not be sent.
+        """
+        with self.lock:
+            self.batch_sizes.append(size)
+            self.latencies.append(seconds)
+            self.requests += requests
+            self.request_failures += int(request_failed)
+            self.fallbacks += fallbacks
+            self.failed += failed
+
+    def as_dict(self):
+        """
+        Get a summary of the metrics.
+
+        Returns:
+            dict: The number of batches, emails, requests, request failures, fallbacks and failed emails,
+                  the mean and maximum batch size, and the median and 95th percentile latency of the batches.
+        """
+        with self.lock:
+            sizes = list(self.batch_sizes)
+            latencies = sorted(self.latencies)
+            summary = {
+                "batches": len(sizes),
+                "emails": sum(sizes),
+                "requests": self.requests,
+                "request_failures": self.request_failures,
+                "fallbacks": self.fallbacks,
+                "failed": self.failed,
+            }
+        summary["mean_batch_size"] = round(sum(sizes) / len(sizes), 1) if sizes else 0
+        summary["max_batch_size"] = max(sizes, default=0)
+        summary["p50_batch_ms"] = round(1000 * latencies[len(latencies) // 2], 3) if latencies else 0
+        summary["p95_batch_ms"] = (
+            round(1000 * latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 3) if latencies else 0
+        )
+        return summary
+
+
+def send_bulk_email(template_name, subject, messages, backend=None, metrics=None):
+    """
+    Sends an email template to many recipients with a single provider request.
+
+    The email is sent with the shared content of the template and the parameters of each recipient (messageVersions
+    of Brevo). If the request is rejected, or the provider rejects some versions, those emails are rendered and sent
+    one by one. The templates whose variables can not be replaced by parameters are always sent one by one.
+
+    Args:
+        template_name (str): The name of the email template.
+        subject (str): The subject of the email.
+        messages (list): The recipients of each email, in the format expected by the email provider,
+                         and the variables of its template, as (to_send_email, context) tuples.
+        backend (BaseTransportBackend, optional): The transport backend. Defaults to the backend of core.transport.
+        metrics (BulkEmailMetrics, optional): The metrics where the batch is recorded. Defaults to None.
+
+    Returns:
+        list: The error of each email, None for the emails sent.
+    """
+    backend = backend or get_backend()
+    template = get_email_template(template_name)
+    started = time.perf_counter()
+    pending = list(range(len(messages)))
+    requests = fallbacks = 0
+    request_failed = False
+    content = template.shared_content
+    if len(messages) > 1 and content is not None:
+        versions = [{"to": to, "params": template.render_params(context)} for to, context in messages]
+        requests += 1
+        try:
+            message_ids = backend.send_bulk_email(subject, content.html, versions, text_content=content.text)
+            pending = [index for index, message_id in enumerate(message_ids) if message_id is None]
+        except Exception:  # pylint: disable=broad-except
+            request_failed = True
+        fallbacks = len(pending)
+
+    errors = [None] * len(messages)
+    for index in pending:
+        to_send_email, context = messages[index]
+        rendered = template.render(context)
+        requests += 1
+        try:
+            backend.send_email(subject, rendered.html, to_send_email, text_content=rendered.text)
+        except Exception as e:  # pylint: disable=broad-except
+            errors[index] = e
+    if metrics is not None:
+        failed = sum(error is not None for error in errors)
+        metrics.record(len(messages), time.perf_counter() - started, requests, request_failed, fallbacks, failed)
+    return errors
+
+
+class EmailCoalescer:
+    """
+    Collector of the emails with the same template and subject, sent together with send_bulk_email.
+
+    A group of emails is sent as soon as it has max_recipients emails, or by flush_due once its first email
+    has waited window seconds. Each email has a payload, given back with its result, so the caller can record
+    the result of each email. The collector is thread-safe, the emails are sent outside of its lock.
+
+    Args:
+        max_recipients (int, optional): The maximum number of emails of a request. Defaults to the MAX_RECIPIENTS
+                                        setting.
+        window (float, optional): The maximum seconds an email waits for others. Defaults to the WINDOW_SECONDS
+                                  setting.
+        backend (BaseTransportBackend, optional): The transport backend. Defaults to the backend of core.transport.
+        metrics (BulkEmailMetrics, optional): The metrics of the batches. Defaults to new metrics.
+    """
+
+    def __init__(self, max_recipients=None, window=None, backend=None, metrics=None):
+        self.max_recipients = max_recipients or get_bulk_email_setting("MAX_RECIPIENTS")
+        self.window = get_bulk_email_setting("WINDOW_SECONDS") if window is None else window
+        self.backend = backend
+        self.metrics = metrics or BulkEmailMetrics()
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        """Get the number of emails waiting to be sent."""
+        with self.lock:
+            return sum(len(messages) for _, messages in self.groups.values())
+
+    def add(self, template_name, subject, to_send_email, context, payload=None):
+        """
+        Add an email, and send its group if it is full.
+
+        Args:
+            template_name (str): The name of the email template.
+            subject (str): The subject of the email.
+            to_send_email (list): The recipients of the email.
+            context (dict): The variables of the template.
+            payload (optional): The value given back with the result of the email. Defaults to None.
+
+        Returns:
+            list: The payload and the error (None if it was sent) of each email sent by this call.
+        """
+        key = (template_name, subject)
+        with self.lock:
+            _, messages = self.groups.setdefault(key, (time.monotonic(), []))
+            messages.append((to_send_email, context, payload))
+            full = len(messages) >= self.max_recipients
+            if full:
+                del self.groups[key]
+        return self._send(key, messages) if full else []
+
+    def flush_due(self):
+        """
+        Send the groups whose first email has waited the window.
+
+        Returns:
+            list: The payload and the error (None if it was sent) of each email sent.
+        """
+        deadline = time.monotonic() - self.window
+        with self.lock:
+            due = [(key, messages) for key, (started, messages) in self.groups.items() if started <= deadline]
+            for key, _ in due:
+                del self.groups[key]
+        return [result for key, messages in due for result in self._send(key, messages)]
+
+    def flush(self):
+        """
+        Send all the groups.
+
+        Returns:
+            list: The payload and the error (None if it was sent) of each email sent.
+        """
+        with self.lock:
+            groups, self.groups = self.groups, {}
+        return [result for key, (_, messages) in groups.items() for result in self._send(key, messages)]
+
+    def _send(self, key, messages):
+        """Send a group of emails and return the payload and the error of each one."""
+        errors = send_bulk_email(
+            key[0], key[1], [(to, context) for to, context, _ in messages], backend=self.backend, metrics=self.metrics
+        )
+        return [(payload, error) for (_, _, payload), error in zip(messages, errors)]
+
+
 def send_sms(phone_number, message):
     """
-    Sends an SMS message to the specified phone number using Amazon SNS and AWS credentials.
+    Sends an SMS message to the specified phone number using the backend of core.transport (Amazon SNS by default).
 
     Args:
         phone_number (str): The phone number to which the SMS message will be sent.
@@ -67,13 +310,7 @@ def send_sms(phone_number, message):
         Exception: If an error occurs during the execution of the function.
     """
     try:
-        sns_client = boto3.client(
-            "sns",
-            region_name=os.environ.get("AWS_REGION_NAME"),
-            aws_access_key_id=os.environ.get("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.environ.get("AWS_SECRET_ACCESS_KEY"),
-        )
-        response = sns_client.publish(PhoneNumber=phone_number, Message=message)
+        response = get_backend().send_sms(phone_number, message)
 
         if response["ResponseMetadata"]["HTTPStatusCode"] == 200:
             print("SMS sent successfully.")
@@ -3,6 +3,7 @@ File contains admin configuration for user app.
 """
 from django.contrib import admin
 
+from core.admin import SoftDeleteAdmin
 from user.models import User
 
-admin.site.register(User)
+admin.site.register(User, SoftDeleteAdmin)
@@ -11,3 +11,9 @@ class UserConfig(AppConfig):
 
     default_auto_field = "django.db.models.BigAutoField"
     name = "user"
+
+    def ready(self):
+        """
+        Connect the signal receivers of the app.
+        """
+        from user import signals  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
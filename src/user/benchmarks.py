@@ -0,0 +1,174 @@
+"""
+File with the benchmark suites of the user app (see core.benchmark).
+"""
+import random
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.benchmark import get_table_size, measure
+from user.history import UserCompactHistory
+from user.models import User
+from user.serializers import UserReadSerializer, UserSerializer
+
+CREATE_BATCH_SIZE = 5000
+
+
+def create_users(count):
+    """
+    Create active users until the table has the given number of active users.
+
+    The users are created with bulk_create and an unusable password, so the hasher does not slow down the setup.
+
+    Args:
+        count (int): The number of active users of the table.
+    """
+    existing = User.objects.filter(is_active=True).count()
+    for start in range(existing, count, CREATE_BATCH_SIZE):
+        User.objects.bulk_create(
+            [
+                User(
+                    email=f"benchmark{index}@example.com",
+                    first_name="Bench",
+                    last_name=str(index),
+                    password="!",
+                    is_active=True,
+                )
+                for index in range(start, min(start + CREATE_BATCH_SIZE, count))
+            ],
+            batch_size=CREATE_BATCH_SIZE,
+        )
+
+
+def serializers(iterations=20, rows=(1000,), **options):
+    """
+    Compare UserSerializer with UserReadSerializer serializing tables of users.
+
+    Run it with the sizes to compare, for example:
+    python manage.py benchmark user.serializers --iterations 3 --rows 1000 100000 1000000
+
+    Args:
+        iterations (int, optional): The number of measured serializations of each table. Defaults to 20.
+        rows (list, optional): The numbers of users of the tables. Defaults to 1000.
+
+    Yields:
+        tuple: The name of the serializer and the number of users, and its measure with the users per second.
+    """
+    for count in sorted(rows):
+        create_users(count)
+
+        def serialize_model():
+            return UserSerializer(User.objects.filter(is_active=True).order_by("id")[:count], many=True).data
+
+        def serialize_read():
+            return UserReadSerializer(
+                UserReadSerializer.get_queryset(User.objects.filter(is_active=True).order_by("id"))[:count], many=True
+            ).data
+
+        for name, func in (("UserSerializer", serialize_model), ("UserReadSerializer", serialize_read)):
+            result = measure(func, iterations, warmup=0)
+            result["rows_per_second"] = round(count * result["per_second"])
+            yield f"{name} {count} rows", result
+
+
+def create_history(count, versions):
+    """
+    Create users with a history of the given number of versions, each one changing the first name.
+
+    Args:
+        count (int): The number of users.
+        versions (int): The number of historical records of each user.
+
+    Returns:
+        list: The ids of the users.
+    """
+    create_users(count)
+    history_model = User.historical.model
+    users = list(User.objects.filter(is_active=True).order_by("id")[:count])
+    history_date = timezone.now() - timedelta(days=365)
+    for version in range(versions):
+        records = []
+        for user in users:
+            record = history_model(
+                history_date=history_date + timedelta(minutes=version),
+                history_type="+" if version == 0 else "~",
+                **{field.attname: getattr(user, field.attname) for field in history_model.tracked_fields},
+            )
+            record.first_name = f"Bench {version}"
+            records.append(record)
+        history_model.objects.bulk_create(records, batch_size=CREATE_BATCH_SIZE)
+    return [user.id for user in users]
+
+
+def history(iterations=20, rows=(1000,), versions=50, **options):
+    """
+    Measure the storage of the compact history of the users and the latency of the rebuild of their versions.
+
+    The history of the users is converted with the compact_history conversion, and versions picked at random
+    are rebuilt from the historical table before the conversion and from the compact rows after it.
+
+    Args:
+        iterations (int, optional): The number of measured rebuilds. Defaults to 20.
+        rows (list, optional): The numbers of users. Defaults to 1000.
+        versions (int, optional): The number of historical records of each user. Defaults to 50.
+
+    Yields:
+        tuple: The name of the case and its measure, with the sizes of the history before and after the conversion.
+    """
+    store = UserCompactHistory()
+    for count in sorted(rows):
+        store.history_model.objects.all().delete()
+        store.compact_model.objects.all().delete()
+        user_ids = create_history(count, versions)
+        history_ids = list(store.history_model.objects.values_list("history_id", flat=True))
+
+        def rebuild():
+            store.get_version(random.choice(user_ids), history_id=random.choice(history_ids))
+
+        full_size = get_table_size(store.history_model)
+        result = measure(rebuild, iterations)
+        result["history_bytes"] = full_size
+        yield f"full history {count} users", result
+
+        store.convert(timezone.now(), sleep=0)
+        compact_size = get_table_size(store.compact_model)
+        result = measure(rebuild, iterations)
+        result["history_bytes"] = compact_size
+        result["reduction"] = f"{100 * (1 - compact_size / full_size):.1f}%"
+        yield f"compact history {count} users", result
+
+
+def updates(iterations=200, **options):
+    """
+    Compare the UPDATE of every column with the UPDATE of the changed columns of BaseModel.save.
+
+    Each save changes the first name of a user. The full update writes every column, as save did before
+    the dirty field tracking, the dirty update only writes the first name and updated_at.
+
+    Args:
+        iterations (int, optional): The number of measured saves of each kind. Defaults to 200.
+
+    Yields:
+        tuple: The name of the update and its measure, with the size in bytes of its UPDATE statement.
+    """
+    create_users(1)
+    user = User.objects.filter(is_active=True).order_by("id").first()
+    all_fields = [field.name for field in User._meta.concrete_fields if not field.primary_key]
+    counter = iter(range(2 * iterations + 10))
+
+    def full_update():
+        user.first_name = f"Bench {next(counter)}"
+        user.save(update_fields=all_fields)
+
+    def dirty_update():
+        user.first_name = f"Bench {next(counter)}"
+        user.save()
+
+    for name, func in (("full update", full_update), ("dirty update", dirty_update)):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        result = measure(func, iterations)
+        result["update_bytes"] = sum(len(query["sql"]) for query in queries if query["sql"].startswith("UPDATE"))
+        yield name, result
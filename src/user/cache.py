@@ -0,0 +1,146 @@
+"""
+File that contains the cache of the user details, read by UserDetailView.
+
+Each user has a cache entry with the values of its USER_SPARSE_FIELDS, and a generation, a random token that
+changes every time the user is written. An entry is only valid for the generation it was built for, so a write
+invalidates the entry even if a slower reader stores the previous values after the write. The keys have a schema
+version, which must be increased when the cached values change.
+Only one worker rebuilds a missing entry, the others wait for it for a moment instead of querying the database.
+"""
+import time
+import uuid
+from functools import partial
+
+from django.core.cache import caches
+from django.db import transaction
+
+from core.conf import get_app_setting
+from user.models import User
+from user.serializers import USER_SPARSE_FIELDS, UserReadSerializer
+
+SCHEMA_VERSION = 1
+
+DEFAULT_USER_DETAIL_CACHE_SETTINGS = {
+    "CACHE_ALIAS": "default",
+    "TIMEOUT": 300,
+    "LOCK_TIMEOUT": 5,
+    "LOCK_WAIT": 0.5,
+    "LOCK_POLL_INTERVAL": 0.02,
+}
+
+
+get_user_detail_cache_setting = partial(
+    get_app_setting, "USER_DETAIL_CACHE", defaults=DEFAULT_USER_DETAIL_CACHE_SETTINGS
+)
+
+
+def get_cache():
+    """Get the cache of the user details."""
+    return caches[get_user_detail_cache_setting("CACHE_ALIAS")]
+
+
+def get_cache_keys(user_id):
+    """
+    Get the cache keys of a user.
+
+    The id is converted to an integer, so an id given as "05" has the keys of the user 5, which its writes invalidate.
+
+    Args:
+        user_id (int or str): The id of the user.
+
+    Returns:
+        tuple: The keys of the generation, the entry and the rebuild lock of the user.
+    """
+    prefix = f"user:detail:v{SCHEMA_VERSION}:{int(user_id)}"
+    return f"{prefix}:generation", f"{prefix}:entry", f"{prefix}:lock"
+
+
+def get_or_build(user_id, build):
+    """
+    Get the cached value of a user, or build it and store it when the entry is missing or stale.
+
+    When another worker is already building the entry, it waits up to LOCK_WAIT seconds for it,
+    and then builds the value without storing it.
+
+    Args:
+        user_id (int): The id of the user.
+        build (callable): Function without arguments that returns the value, or None if the user does not exist.
+
+    Returns:
+        The value of the user, or None if the user does not exist.
+    """
+    cache = get_cache()
+    generation_key, entry_key, lock_key = get_cache_keys(user_id)
+    values = cache.get_many([generation_key, entry_key])
+    generation = values.get(generation_key)
+    if generation is None:
+        cache.add(generation_key, uuid.uuid4().hex, None)
+        generation = cache.get(generation_key)
+    entry = values.get(entry_key)
+    if entry is not None and entry[0] == generation:
+        return entry[1]
+
+    if cache.add(lock_key, generation, get_user_detail_cache_setting("LOCK_TIMEOUT")):
+        try:
+            value = build()
+            if value is not None:
+                cache.set(entry_key, (generation, value), get_user_detail_cache_setting("TIMEOUT"))
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + get_user_detail_cache_setting("LOCK_WAIT")
+    while time.monotonic() < deadline:
+        time.sleep(get_user_detail_cache_setting("LOCK_POLL_INTERVAL"))
+        entry = cache.get(entry_key)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+    return build()
+
+
+def get_user_detail(user_id):
+    """
+    Get the values of the USER_SPARSE_FIELDS of a user, from the cache or from the database.
+
+    Args:
+        user_id (int): The id of the user.
+
+    Returns:
+        dict: The values of the user, or None if the user does not exist.
+    """
+    return get_or_build(
+        user_id, lambda: UserReadSerializer.get_queryset(User.objects.filter(id=user_id), USER_SPARSE_FIELDS).first()
+    )
+
+
+def invalidate_user_detail(user_id):
+    """
+    Invalidate the cache entry of a user.
+
+    The generation of the user is changed now and again when the transaction is committed, in case another
+    request cached the user before the change was visible.
+
+    Args:
+        user_id (int): The id of the user.
+    """
+    invalidate_user_details([user_id])
+
+
+def invalidate_user_details(user_ids):
+    """
+    Invalidate the cache entries of some users, with a single set_many and delete_many.
+
+    As invalidate_user_detail, the generations are changed now and again when the transaction is committed.
+
+    Args:
+        user_ids (list): The ids of the users.
+    """
+
+    def invalidate():
+        cache = get_cache()
+        keys = [get_cache_keys(user_id) for user_id in user_ids]
+        cache.set_many({generation_key: uuid.uuid4().hex for generation_key, _, _ in keys}, None)
+        cache.delete_many([entry_key for _, entry_key, _ in keys])
+
+    invalidate()
+    transaction.on_commit(invalidate)
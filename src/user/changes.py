@@ -0,0 +1,86 @@
+"""
+File that contains the change feed of the users, read from their historical records.
+
+The feed returns the created, updated and deleted events of the users in the order of their historical records,
+history_id, so the downstream services only read the changes since their last cursor instead of the whole list.
+The historical records are inserted when their transaction is committed, so history_id follows the order of the
+commits, but the insert of a record can still be committed after the insert of a later one. So the feed stops
+before the first record inserted in the last SETTLE_SECONDS seconds, whatever the duration of its transaction.
+
+The old records are deleted by the compaction and the retention of the history, which record the greatest id
+deleted in a DeletionMark. A cursor before that id can't resume the feed without losing changes, so the consumer
+must copy the users again.
+"""
+from datetime import timedelta
+from functools import partial
+
+from django.db.models import Min
+from django.utils import timezone
+
+from core.conf import get_app_setting
+from core.models import DeletionMark
+from user.models import User
+from user.serializers import USER_SPARSE_FIELDS
+
+CHANGE_EVENTS = {"+": "created", "~": "updated", "-": "deleted"}
+
+DEFAULT_USER_CHANGE_FEED_SETTINGS = {
+    "SETTLE_SECONDS": 5,
+    "MAX_WAIT": 30,
+    "POLL_INTERVAL": 1,
+}
+
+
+get_user_change_feed_setting = partial(get_app_setting, "USER_CHANGE_FEED", defaults=DEFAULT_USER_CHANGE_FEED_SETTINGS)
+
+
+def get_changes_queryset():
+    """
+    Get the settled historical records of the users, with the columns of the events.
+
+    Returns:
+        QuerySet: The values of the records before the first record inserted in the last SETTLE_SECONDS seconds.
+    """
+    settled = timezone.now() - timedelta(seconds=get_user_change_feed_setting("SETTLE_SECONDS"))
+    records = User.historical.all()
+    first_unsettled = records.filter(history_inserted_at__gt=settled).aggregate(first=Min("history_id"))["first"]
+    if first_unsettled is not None:
+        records = records.filter(history_id__lt=first_unsettled)
+    return records.values("history_id", "history_date", "history_type", *USER_SPARSE_FIELDS)
+
+
+def has_deleted_changes(history_id):
+    """
+    Check if historical records after a position of the feed were deleted by the compaction or the retention.
+
+    The position is compared with the greatest id deleted, recorded by the compaction and the retention, so the
+    gaps of the ids, such as the ids of rolled back inserts, are not taken for deleted records.
+
+    Args:
+        history_id (int): The id of the last record read by the consumer.
+
+    Returns:
+        bool: True if the feed can't be resumed from the position without losing changes.
+    """
+    last_deleted = DeletionMark.get_last_pk(User.historical.model)
+    return last_deleted is not None and history_id < last_deleted
+
+
+def serialize_change(record):
+    """
+    Build the event of a historical record.
+
+    Args:
+        record (dict): The values of the historical record.
+
+    Returns:
+        dict: The type of event, the id of the user, the date of the change and the fields of the user,
+              which are None for a deleted user.
+    """
+    event = CHANGE_EVENTS[record["history_type"]]
+    return {
+        "event": event,
+        "id": record["id"],
+        "changed_at": record["history_date"],
+        "user": None if event == "deleted" else {name: record[name] for name in USER_SPARSE_FIELDS},
+    }
@@ -0,0 +1,172 @@
+"""
+File that contains the bulk export of the users as NDJSON or CSV.
+
+The rows are read with values_list and a server side cursor, and written in chunks, so the memory used by an export
+does not depend on the size of the table.
+"""
+import csv
+import json
+import logging
+import time
+
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+from user.models import User
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = (
+    "id",
+    "email",
+    "first_name",
+    "last_name",
+    "document",
+    "code_phone",
+    "phone_number",
+    "is_active",
+    "created_at",
+    "updated_at",
+    "deleted_at",
+)
+EXPORT_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """
+    File-like object that returns the written value instead of storing it, used to build the CSV lines.
+    """
+
+    def write(self, value):
+        """Return the written value."""
+        return value
+
+
+def parse_export_filters(is_active=None, created_after=None, created_before=None, include_deleted=None):
+    """
+    Parse the filters of an export given as strings.
+
+    Args:
+        is_active (str, optional): "true" or "false" to export only the active or inactive users.
+        include_deleted (str, optional): "true" to export the soft-deleted users too.
+        created_after (str, optional): ISO date or datetime, the users created from it are exported.
+        created_before (str, optional): ISO date or datetime, the users created before it are exported.
+
+    Returns:
+        dict: The filters to pass to get_export_queryset.
+
+    Raises:
+        ValueError: If a filter is not valid.
+    """
+    filters = {}
+    for name, value in (("is_active", is_active), ("include_deleted", include_deleted)):
+        if value in (None, ""):
+            continue
+        if value.lower() not in ("true", "false", "1", "0"):
+            raise ValueError(f"{name} must be true or false")
+        filters[name] = value.lower() in ("true", "1")
+    for name, value in (("created_after", created_after), ("created_before", created_before)):
+        if value in (None, ""):
+            continue
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                raise ValueError(f"{name} must be an ISO date or datetime")
+            parsed = parse_datetime(f"{date.isoformat()}T00:00:00")
+        filters[name] = make_aware(parsed) if is_naive(parsed) else parsed
+    return filters
+
+
+def get_export_queryset(is_active=None, created_after=None, created_before=None, include_deleted=False):
+    """
+    Get the rows of the users to export, ordered by id.
+
+    Args:
+        is_active (bool, optional): Export only the active or inactive users. Defaults to every user.
+        include_deleted (bool, optional): Export the soft-deleted users too, whose deleted_at is set.
+            Defaults to False.
+        created_after (datetime, optional): Export only the users created from this date.
+        created_before (datetime, optional): Export only the users created before this date.
+
+    Returns:
+        QuerySet: The tuples of the EXPORT_FIELDS of the users.
+    """
+    queryset = User.all_objects.all() if include_deleted else User.objects.all()
+    if is_active is not None:
+        queryset = queryset.filter(is_active=is_active)
+    if created_after is not None:
+        queryset = queryset.filter(created_at__gte=created_after)
+    if created_before is not None:
+        queryset = queryset.filter(created_at__lt=created_before)
+    return queryset.order_by("id").values_list(*EXPORT_FIELDS)
+
+
+def _to_plain_values(row):
+    """Return the values of a row with the dates and datetimes as ISO strings."""
+    return [value.isoformat() if hasattr(value, "isoformat") else value for value in row]
+
+
+def get_line_formatter(file_format):
+    """
+    Get the header and the function that formats a row of an export.
+
+    Args:
+        file_format (str): "ndjson" or "csv".
+
+    Returns:
+        tuple: The header line, empty for NDJSON, and the function that returns the line of a row.
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    if file_format == "ndjson":
+        encoder = json.JSONEncoder(separators=(",", ":"))
+        return "", lambda row: encoder.encode(dict(zip(EXPORT_FIELDS, _to_plain_values(row)))) + "\n"
+    if file_format == "csv":
+        writer = csv.writer(Echo())
+        return writer.writerow(EXPORT_FIELDS), lambda row: writer.writerow(_to_plain_values(row))
+    raise ValueError(f"Unsupported export format {file_format}")
+
+
+def export_users(queryset, file_format="ndjson", chunk_size=DEFAULT_CHUNK_SIZE, on_finish=None):
+    """
+    Stream the rows of an export.
+
+    The rows are read from the database in chunks of chunk_size rows, and each chunk is yielded as a single string.
+    When the export ends, the number of rows and the rows per second are logged and passed to on_finish.
+
+    Args:
+        queryset (QuerySet): The rows to export, as returned by get_export_queryset.
+        file_format (str, optional): "ndjson" or "csv". Defaults to "ndjson".
+        chunk_size (int, optional): The number of rows of each chunk. Defaults to DEFAULT_CHUNK_SIZE.
+        on_finish (callable, optional): Function called with the number of rows and the seconds spent.
+
+    Yields:
+        str: The lines of a chunk of rows.
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    header, format_row = get_line_formatter(file_format)
+    started = time.monotonic()
+    rows = 0
+    lines = [header] if header else []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        lines.append(format_row(row))
+        rows += 1
+        if rows % chunk_size == 0:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+    seconds = time.monotonic() - started
+    rate = rows / seconds if seconds else 0
+    logger.info("Exported %s users as %s in %.3fs (%.1f rows/s)", rows, file_format, seconds, rate)
+    if on_finish:
+        on_finish(rows, seconds)
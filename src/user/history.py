@@ -0,0 +1,22 @@
+"""
+File with the compact history of the user app (see core.history).
+"""
+from core.history import CompactHistory
+from user.models import CompactHistoricalUser, User
+
+
+class UserCompactHistory(CompactHistory):
+    """
+    Compact history of the users, the password hashes are not kept in the compact rows.
+    """
+
+    name = "user"
+    excluded_fields = ("password",)
+
+    def get_history_model(self):
+        """Get the historical model of the users."""
+        return User.historical.model
+
+    def get_compact_model(self):
+        """Get the compact rows of the users."""
+        return CompactHistoricalUser
@@ -0,0 +1,322 @@
+"""
+File that contains the bulk import of the users from CSV or NDJSON files.
+
+The rows are read as a stream and processed in batches: each batch is validated, checked against the existing users
+with a single query, its passwords are hashed in a process pool, and the users and their historical records are
+inserted with bulk_create_with_history. The progress, the throughput and the errors of each row are written to an
+NDJSON report file.
+"""
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history
+
+from core.conf import get_app_setting
+from user.models import User
+
+IMPORT_FORMATS = ("csv", "ndjson")
+IMPORT_FIELDS = ("email", "first_name", "last_name", "document", "code_phone", "phone_number", "profile_image")
+TRUE_VALUES = ("true", "1", "yes")
+FALSE_VALUES = ("false", "0", "no")
+
+DEFAULT_USER_IMPORT_SETTINGS = {
+    "BATCH_SIZE": 1000,
+    "WORKERS": None,
+    "REPORT_DIR": None,
+}
+
+
+def get_user_import_setting(name):
+    """
+    Get a setting of the import of users.
+
+    The values defined in the USER_IMPORT setting override the default values. WORKERS defaults to the number
+    of CPUs, and REPORT_DIR, where the reports of the admin endpoint are written, to the imports folder of BASE_DIR.
+
+    Args:
+        name (str): The name of the setting.
+
+    Returns:
+        The value of the setting.
+    """
+    value = get_app_setting("USER_IMPORT", name, DEFAULT_USER_IMPORT_SETTINGS)
+    if value is None and name == "WORKERS":
+        return os.cpu_count() or 1
+    if value is None and name == "REPORT_DIR":
+        return Path(settings.BASE_DIR) / "imports"
+    return value
+
+
+def get_import_format(file_name, file_format=None):
+    """
+    Get the format of an import file, given or from the extension of its name.
+
+    Args:
+        file_name (str): The name of the file.
+        file_format (str, optional): The format given by the user.
+
+    Returns:
+        str: "csv" or "ndjson".
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    file_format = file_format or Path(file_name).suffix.lstrip(".").lower().replace("jsonl", "ndjson")
+    if file_format not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format {file_format}, use one of {', '.join(IMPORT_FORMATS)}")
+    return file_format
+
+
+def read_rows(stream, file_format):
+    """
+    Read the rows of an import file one by one.
+
+    Args:
+        stream: The text stream of the file.
+        file_format (str): "csv" or "ndjson".
+
+    Yields:
+        tuple: The line number, and the dictionary of the row or None, and the error of the line or None.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if isinstance(row, dict):
+            yield line_number, row, None
+        else:
+            yield line_number, None, "The line is not a JSON object"
+
+
+def clean_row(row):
+    """
+    Validate a row of an import file.
+
+    Args:
+        row (dict): The values of the row.
+
+    Returns:
+        dict: The fields of the user, its password (None for an unusable password) and is_active.
+
+    Raises:
+        ValidationError: If a value is not valid.
+    """
+    data = {}
+    for name in IMPORT_FIELDS:
+        value = row.get(name)
+        value = "" if value is None else str(value).strip()
+        max_length = User._meta.get_field(name).max_length
+        if len(value) > max_length:
+            raise ValidationError(f"{name} has more than {max_length} characters")
+        data[name] = value
+    if not data["email"]:
+        raise ValidationError("email is required")
+    validate_email(data["email"])
+    data["email"] = data["email"].lower()
+    if bool(data["code_phone"]) != bool(data["phone_number"]):
+        raise ValidationError("code_phone and phone_number must be given together")
+
+    is_active = str(row.get("is_active", "true")).strip().lower() or "true"
+    if is_active not in TRUE_VALUES + FALSE_VALUES:
+        raise ValidationError("is_active must be true or false")
+    data["is_active"] = is_active in TRUE_VALUES
+    data["password"] = row.get("password") or None
+    return data
+
+
+def setup_worker():
+    """Set up Django in the processes of the pool that hash the passwords."""
+    django.setup()
+
+
+class UserImporter:
+    """
+    Importer of users from the rows of a file, in batches.
+
+    Args:
+        report: The text stream where the NDJSON report is written.
+        batch_size (int, optional): The number of rows of each batch. Defaults to the BATCH_SIZE setting.
+        workers (int, optional): The number of processes that hash the passwords, 1 hashes them in the current
+                                 process. Defaults to the WORKERS setting.
+    """
+
+    def __init__(self, report, batch_size=None, workers=None):
+        self.report = report
+        self.batch_size = batch_size or get_user_import_setting("BATCH_SIZE")
+        self.workers = workers or get_user_import_setting("WORKERS")
+        self.seen_emails = set()
+        self.seen_phones = set()
+        self.rows = self.created = self.failed = 0
+
+    def write_report(self, entry):
+        """Write an entry in the report."""
+        self.report.write(json.dumps(entry, default=str) + "\n")
+        self.report.flush()
+
+    def reject(self, line_number, email, error):
+        """Write the error of a row in the report."""
+        self.failed += 1
+        self.write_report({"type": "error", "line": line_number, "email": email, "error": error})
+
+    def import_rows(self, rows):
+        """
+        Import the rows of a file.
+
+        Args:
+            rows (iterable): The rows returned by read_rows.
+
+        Yields:
+            dict: The progress after each batch, and the summary at the end, also written in the report.
+        """
+        started = time.monotonic()
+        pool = ProcessPoolExecutor(self.workers, initializer=setup_worker) if self.workers > 1 else nullcontext()
+        with pool as executor:
+            batch = []
+            for line_number, row, error in rows:
+                self.rows += 1
+                if error:
+                    self.reject(line_number, None, error)
+                    continue
+                try:
+                    batch.append((line_number, clean_row(row)))
+                except ValidationError as e:
+                    self.reject(line_number, row.get("email"), " ".join(e.messages))
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch, executor)
+                    batch = []
+                    yield self.get_progress("progress", started)
+            if batch:
+                self.import_batch(batch, executor)
+        yield self.get_progress("summary", started)
+
+    def get_progress(self, entry_type, started):
+        """Write the progress of the import in the report and return it."""
+        seconds = time.monotonic() - started
+        progress = {
+            "type": entry_type,
+            "rows": self.rows,
+            "created": self.created,
+            "failed": self.failed,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.rows / seconds, 1) if seconds else 0,
+        }
+        self.write_report(progress)
+        return progress
+
+    def remove_duplicates(self, batch):
+        """
+        Reject the rows whose email or phone number is already used, in the file or by an existing user.
+
+        The existing users, including the deleted ones, are found with a single query for the whole batch.
+
+        Args:
+            batch (list): The line numbers and the cleaned data of the rows.
+
+        Returns:
+            list: The rows that can be created.
+        """
+        emails = [data["email"] for _, data in batch]
+        phone_numbers = [data["phone_number"] for _, data in batch if data["phone_number"]]
+        existing_emails = set()
+        existing_phones = set()
+        for email, code_phone, phone_number in User.all_objects.filter(
+            Q(email__in=emails) | Q(phone_number__in=phone_numbers)
+        ).values_list("email", "code_phone", "phone_number"):
+            existing_emails.add(email)
+            existing_phones.add((code_phone, phone_number))
+
+        unique = []
+        for line_number, data in batch:
+            phone = (data["code_phone"], data["phone_number"]) if data["phone_number"] else None
+            if data["email"] in existing_emails or data["email"] in self.seen_emails:
+                self.reject(line_number, data["email"], "email already exists")
+            elif phone and (phone in existing_phones or phone in self.seen_phones):
+                self.reject(line_number, data["email"], "phone number already exists")
+            else:
+                self.seen_emails.add(data["email"])
+                if phone:
+                    self.seen_phones.add(phone)
+                unique.append((line_number, data))
+        return unique
+
+    def import_batch(self, batch, executor):
+        """
+        Create the users of a batch with their historical records.
+
+        If the batch is rejected by the database, for example because another request created one of its users,
+        the users are created one by one and the rejected ones are reported.
+
+        Args:
+            batch (list): The line numbers and the cleaned data of the rows.
+            executor: The process pool that hashes the passwords, or None to hash them in the current process.
+        """
+        batch = self.remove_duplicates(batch)
+        if not batch:
+            return
+        passwords = [data.pop("password") for _, data in batch]
+        if executor:
+            chunksize = max(1, len(passwords) // (self.workers * 4))
+            hashes = list(executor.map(make_password, passwords, chunksize=chunksize))
+        else:
+            hashes = [make_password(password) for password in passwords]
+
+        now = timezone.now()
+        users = []
+        for (_, data), password in zip(batch, hashes):
+            users.append(User(password=password, deleted_at=None if data["is_active"] else now, **data))
+        try:
+            with transaction.atomic():
+                bulk_create_with_history(users, User, batch_size=self.batch_size)
+            self.created += len(users)
+        except IntegrityError:
+            for (line_number, data), user in zip(batch, users):
+                user.pk = None
+                try:
+                    with transaction.atomic():
+                        bulk_create_with_history([user], User)
+                    self.created += 1
+                except IntegrityError as e:
+                    self.reject(line_number, data["email"], str(e))
+
+
+def import_users(stream, file_format, report, batch_size=None, workers=None):
+    """
+    Import the users of a file.
+
+    Args:
+        stream: The binary or text stream of the file.
+        file_format (str): "csv" or "ndjson".
+        report: The text stream where the NDJSON report is written.
+        batch_size (int, optional): The number of rows of each batch. Defaults to the BATCH_SIZE setting.
+        workers (int, optional): The number of processes that hash the passwords. Defaults to the WORKERS setting.
+
+    Yields:
+        dict: The progress after each batch, and the summary at the end.
+    """
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    importer = UserImporter(report, batch_size=batch_size, workers=workers)
+    yield from importer.import_rows(read_rows(stream, file_format))
@@ -0,0 +1,56 @@
+"""
+Django command to export the users as NDJSON or CSV.
+"""
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user.export import (
+    DEFAULT_CHUNK_SIZE,
+    EXPORT_CONTENT_TYPES,
+    export_users,
+    get_export_queryset,
+    parse_export_filters,
+)
+
+
+class Command(BaseCommand):
+    """Django command to export the users."""
+
+    help = "Export the users as NDJSON or CSV, streamed in chunks to a file or to the standard output."
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument('--format', dest='file_format', choices=sorted(EXPORT_CONTENT_TYPES), default='ndjson')
+        parser.add_argument('--output', help='The file to write, the standard output by default.')
+        parser.add_argument('--is-active', choices=['true', 'false'], help='Only export the active or inactive users.')
+        parser.add_argument('--created-after', help='Only export the users created from this ISO date or datetime.')
+        parser.add_argument('--created-before', help='Only export the users created before this ISO date or datetime.')
+        parser.add_argument('--include-deleted', action='store_true', help='Also export the soft-deleted users.')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows read per query.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        try:
+            filters = parse_export_filters(
+                is_active=options['is_active'],
+                created_after=options['created_after'],
+                created_before=options['created_before'],
+                include_deleted='true' if options['include_deleted'] else None,
+            )
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+
+        def report(rows, seconds):
+            rate = rows / seconds if seconds else 0
+            self.stderr.write(self.style.SUCCESS(f'Exported {rows} users in {seconds:.3f}s ({rate:.1f} rows/s).'))
+
+        chunks = export_users(
+            get_export_queryset(**filters), options['file_format'], chunk_size=options['chunk_size'], on_finish=report
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        else:
+            sys.stdout.writelines(chunks)
+            sys.stdout.flush()
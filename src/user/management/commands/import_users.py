@@ -0,0 +1,44 @@
+"""
+Django command to import users from a CSV or NDJSON file.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from user.imports import get_import_format, get_user_import_setting, import_users
+
+
+class Command(BaseCommand):
+    """Django command to import users in bulk."""
+
+    help = (
+        "Import users from a CSV or NDJSON file with the columns email, first_name, last_name, document, code_phone, "
+        "phone_number, profile_image, password and is_active. The progress and the errors are written to a report."
+    )
+
+    def add_arguments(self, parser):
+        """Add the arguments of the command."""
+        parser.add_argument('path', help='The file to import.')
+        parser.add_argument('--format', dest='file_format', help='csv or ndjson, by default from the extension.')
+        parser.add_argument('--batch-size', type=int, default=get_user_import_setting("BATCH_SIZE"))
+        parser.add_argument('--workers', type=int, help='Processes that hash the passwords, by default the CPUs.')
+        parser.add_argument('--report', help='The NDJSON report file, by default <path>.report.ndjson.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        try:
+            file_format = get_import_format(options['path'], options['file_format'])
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+        report_path = options['report'] or f"{options['path']}.report.ndjson"
+
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream, open(
+            report_path, 'w', encoding='utf-8'
+        ) as report:
+            for progress in import_users(
+                stream, file_format, report, batch_size=options['batch_size'], workers=options['workers']
+            ):
+                message = (
+                    f'{progress["rows"]} rows, {progress["created"]} created, {progress["failed"]} failed, '
+                    f'{progress["rows_per_second"]} rows/s'
+                )
+                self.stdout.write(self.style.SUCCESS(message) if progress['type'] == 'summary' else message)
+        self.stdout.write(f'Report written to {report_path}')
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("user", "0003_historicaluser_deleted_at_user_deleted_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="historicaluser",
+            name="tokens_revoked_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="tokens_revoked_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
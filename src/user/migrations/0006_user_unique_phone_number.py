@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:42
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_phone_numbers(apps, schema_editor):
+    """
+    Stop the migration if several users have the same phone number, which the unique constraint would reject.
+
+    The users must be merged, or their phone numbers fixed, by hand before the migration, because the right one
+    can not be chosen automatically.
+    """
+    User = apps.get_model("user", "User")
+    duplicates = list(
+        User.objects.exclude(phone_number="")
+        .values("code_phone", "phone_number")
+        .annotate(count=Count("pk"))
+        .filter(count__gt=1)
+        .values_list("code_phone", "phone_number")[:20]
+    )
+    if duplicates:
+        raise RuntimeError(f"Users with the same phone number must be merged before this migration: {duplicates}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("user", "0005_user_created_at_id_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_phone_numbers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="user",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("phone_number", ""), _negated=True),
+                fields=("code_phone", "phone_number"),
+                name="user_unique_phone_number",
+            ),
+        ),
+    ]
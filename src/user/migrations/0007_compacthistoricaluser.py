@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("user", "0006_user_unique_phone_number"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CompactHistoricalUser",
+            fields=[
+                ("history_id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("object_id", models.BigIntegerField()),
+                ("history_date", models.DateTimeField()),
+                ("history_type", models.CharField(max_length=1)),
+                ("history_user_id", models.BigIntegerField(blank=True, null=True)),
+                ("history_change_reason", models.CharField(blank=True, max_length=100, null=True)),
+                ("is_snapshot", models.BooleanField(default=False)),
+                ("data", models.JSONField()),
+            ],
+            options={
+                "indexes": [models.Index(fields=["object_id", "history_id"], name="user_compact_history_idx")],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:56
+
+from django.db import migrations, models
+
+
+def mark_inactive_users_deleted(apps, schema_editor):
+    """Set the deleted_at of the inactive users deactivated before the field existed, so the managers exclude them."""
+    User = apps.get_model("user", "User")
+    User.objects.filter(is_active=False, deleted_at__isnull=True).update(deleted_at=models.F("updated_at"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("user", "0007_compacthistoricaluser"),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_inactive_users_deleted, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="user",
+            name="user_created_at_id_idx",
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                condition=models.Q(("deleted_at__isnull", True)),
+                fields=["created_at", "id"],
+                name="user_alive_created_at_id_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                condition=models.Q(("deleted_at__isnull", True)), fields=["email"], name="user_alive_email_idx"
+            ),
+        ),
+    ]
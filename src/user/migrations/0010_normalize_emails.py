@@ -0,0 +1,44 @@
+from django.db import migrations, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Lower, Trim
+
+CHUNK_SIZE = 1000
+
+
+def normalize_emails(apps, schema_editor):
+    """
+    Store the emails of the users in lowercase and without surrounding spaces, in chunks of users.
+
+    Each chunk is updated in its own transaction, so the table is not locked during the whole migration.
+    If two users only differ by the case of their email, the migration stops before changing any row,
+    because one of them must be merged or renamed by hand before the unique index can be created.
+    """
+    User = apps.get_model("user", "User")
+    users = User.objects.annotate(normalized=Lower(Trim("email")))
+    duplicates = list(
+        users.values("normalized")
+        .annotate(count=Count("pk"))
+        .filter(count__gt=1)
+        .values_list("normalized", flat=True)[:20]
+    )
+    if duplicates:
+        raise RuntimeError(
+            f"Users with the same email in a different case must be merged before this migration: {duplicates}"
+        )
+
+    pks = list(users.exclude(email=F("normalized")).order_by("pk").values_list("pk", flat=True))
+    for start in range(0, len(pks), CHUNK_SIZE):
+        with transaction.atomic(using=schema_editor.connection.alias):
+            User.objects.filter(pk__in=pks[start:start + CHUNK_SIZE]).update(email=Lower(Trim("email")))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("user", "0009_alive_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_emails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("user", "0011_unique_lower_email"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="historicaluser",
+            name="history_inserted_at",
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+    ]
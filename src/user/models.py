@@ -3,13 +3,54 @@ Models for core app.
 """
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
-from simple_history.models import HistoricalRecords
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact
 
-from core.models import BaseModel
+from core.history import DeferredHistoricalRecords
+from core.models import BaseModel, CompactHistoricalModel, SoftDeleteManager
 
 
-class UserManager(BaseUserManager):
-    """Manager for users."""
+def normalize_email(email):
+    """
+    Normalize an email as it is stored: without surrounding spaces and in lowercase.
+
+    Args:
+        email (str): The email given by the user.
+
+    Returns:
+        str: The normalized email, empty if no email is given.
+    """
+    return (email or "").strip().lower()
+
+
+def get_email_lookup(email):
+    """
+    Build the filter of the user with an email, whatever its case.
+
+    The filter compares LOWER(email) with the normalized email, so it is a single probe of the
+    user_unique_lower_email index.
+
+    Args:
+        email (str): The email given by the user.
+
+    Returns:
+        Exact: The filter, to use in filter() or in a Q.
+    """
+    return Exact(Lower("email"), normalize_email(email))
+
+
+class UserManager(SoftDeleteManager, BaseUserManager):
+    """Manager for users, which excludes the deleted users unless it is created with alive_only=False."""
+
+    @classmethod
+    def normalize_email(cls, email):
+        """Normalize the email of a new user (see normalize_email)."""
+        return normalize_email(email)
+
+    def get_by_natural_key(self, username):
+        """Get the user of an email, whatever its case, as the authentication backends do."""
+        return self.get(get_email_lookup(username))
 
     def create_user(self, email, password=None, **extra_fields):
         """Create, save and return a new user."""
@@ -46,11 +87,35 @@ class User(AbstractBaseUser, PermissionsMixin, BaseModel):
     is_admin = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
     profile_image = models.CharField(max_length=250, blank=True)
-    historical = HistoricalRecords()
+    tokens_revoked_at = models.DateTimeField(null=True, blank=True)
+    historical = DeferredHistoricalRecords(ignored_fields=("updated_at", "last_login"))
     objects = UserManager()
+    all_objects = UserManager(alive_only=False)
 
     USERNAME_FIELD = 'email'
 
+    class Meta:
+        """
+        Meta class for User
+
+        The index covers the keyset pagination of the list of users, ordered by creation date and id. It only has
+        the users that are not deleted, the rows read by the default manager.
+        The constraints make the emails unique whatever their case, and their index covers the lookups by email of
+        get_email_lookup. They also make the phone numbers unique, the users without phone number are not constrained.
+        """
+
+        indexes = [
+            models.Index(
+                fields=["created_at", "id"], condition=Q(deleted_at__isnull=True), name="user_alive_created_at_id_idx"
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(Lower("email"), name="user_unique_lower_email"),
+            models.UniqueConstraint(
+                fields=["code_phone", "phone_number"], condition=~Q(phone_number=""), name="user_unique_phone_number"
+            ),
+        ]
+
     def __str__(self):
         """Return string representation of user."""
         return self.email
@@ -70,3 +135,16 @@ class User(AbstractBaseUser, PermissionsMixin, BaseModel):
         "Is the user a member of staff?"
         # Simplest possible answer: All admins are staff
         return self.is_admin
+
+
+class CompactHistoricalUser(CompactHistoricalModel):
+    """Compact history of the users, see user.history."""
+
+    class Meta:
+        """
+        Meta class for CompactHistoricalUser
+
+        The index covers the versions of a user, read in order to rebuild them.
+        """
+
+        indexes = [models.Index(fields=["object_id", "history_id"], name="user_compact_history_idx")]
@@ -0,0 +1,48 @@
+"""
+File with the retention policies of the user app (see core.retention).
+"""
+from datetime import timedelta
+
+from django.db.models import Exists, OuterRef
+
+from core.retention import RetentionPolicy, get_retention_setting
+from user.models import CompactHistoricalUser, User
+
+
+class HistoricalUserRetentionPolicy(RetentionPolicy):
+    """
+    Policy that deletes the historical records of the users older than HISTORY_DAYS days.
+
+    The deletions are tracked, so the change feed of the users knows the records deleted after a cursor.
+    """
+
+    name = "historical_user"
+    track_deletions = True
+
+    def get_queryset(self, now):
+        """Get the historical records of the users created before the retention period."""
+        return User.historical.model.objects.filter(
+            history_date__lt=now - timedelta(days=get_retention_setting("HISTORY_DAYS"))
+        )
+
+
+class CompactHistoricalUserRetentionPolicy(RetentionPolicy):
+    """
+    Policy that deletes the compact history of the users older than HISTORY_DAYS days.
+
+    A compact row is only deleted when a later snapshot of the user is also older than the retention period,
+    so the versions that are kept can still be rebuilt.
+    """
+
+    name = "compact_historical_user"
+
+    def get_queryset(self, now):
+        """Get the compact rows of the users that precede a snapshot created before the retention period."""
+        cutoff = now - timedelta(days=get_retention_setting("HISTORY_DAYS"))
+        later_snapshot = CompactHistoricalUser.objects.filter(
+            object_id=OuterRef("object_id"),
+            history_id__gt=OuterRef("history_id"),
+            history_date__lt=cutoff,
+            is_snapshot=True,
+        )
+        return CompactHistoricalUser.objects.filter(Exists(later_snapshot), history_date__lt=cutoff)
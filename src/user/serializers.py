@@ -1,15 +1,25 @@
 """
 File for the user serializer.
 """
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from user.models import User
+from user.models import User, normalize_email
 
 # Get the User model
 UserModel = get_user_model()
 
+# Fields of the representation of a user, the password and the relations are never read
+USER_READ_FIELDS = ('id', 'email', 'first_name', 'last_name', 'document', 'phone_number', 'is_active', 'created_at')
+# Fields that the clients can request with ?fields=
+USER_SPARSE_FIELDS = USER_READ_FIELDS + ('code_phone', 'profile_image', 'updated_at')
+# Columns always read: the id and creation date paginate the lists, and is_active hides the inactive users
+USER_REQUIRED_COLUMNS = ('id', 'created_at', 'is_active')
+
 
 class UserSerializer(serializers.ModelSerializer):
     """
@@ -32,19 +42,27 @@ class UserSerializer(serializers.ModelSerializer):
 
         model = User
         fields = "__all__"
-        extra_kwargs = {'password': {'write_only': True, 'min_length': 5}}
+        # The uniqueness of the email is checked by the views and the database, not with a query per validation
+        extra_kwargs = {
+            'password': {'write_only': True, 'min_length': 5},
+            'email': {'validators': []},
+            'tokens_revoked_at': {'read_only': True},
+        }
+
+    def validate_email(self, value):
+        """
+        Normalize the email, in lowercase and without surrounding spaces, for the creation and the update.
+        """
+        return normalize_email(value)
 
     def create(self, validated_data):
         """
         Create and return a user with encrypted password.
 
-        This method creates a new User object using the validated data.
-        If the email field is present in the validated data, it converts it to lowercase.
+        This method creates a new User object using the validated data, whose email is normalized by validate_email.
         The User object is then saved with the encrypted password and returned.
         """
 
-        if validated_data.get('email'):
-            validated_data['email'] = validated_data['email'].lower()
         return User.objects.create_user(**validated_data)
 
     def update(self, instance, validated_data):
@@ -90,6 +108,73 @@ class UserSerializer(serializers.ModelSerializer):
         return data
 
 
+@lru_cache(maxsize=None)
+def get_row_converter(field_names, from_dict):
+    """
+    Build the function that converts a user to a dictionary with the given fields.
+
+    The function is built once per tuple of fields and reused by every serializer with the same fields.
+
+    Args:
+        field_names (tuple): The fields of the dictionary, in order.
+        from_dict (bool): True if the user is a row of values(), False if it is a model instance.
+
+    Returns:
+        callable: The function that receives a user and returns its dictionary.
+    """
+    getter = (itemgetter if from_dict else attrgetter)(*field_names)
+    if len(field_names) == 1:
+        name = field_names[0]
+        return lambda row: {name: getter(row)}
+    return lambda row: dict(zip(field_names, getter(row)))
+
+
+class UserReadSerializer(serializers.BaseSerializer):
+    """
+    Read only serializer for the user object.
+
+    It returns the same representation as UserSerializer, but it does not build the DRF fields of the model:
+    it reads the values with a function built once per set of fields. The users can be model instances or,
+    to skip the model instances too, the rows returned by get_queryset, which only reads the needed columns.
+    """
+
+    def __init__(self, *args, fields=USER_READ_FIELDS, **kwargs):
+        """
+        Initialize the serializer.
+
+        Args:
+            fields (tuple, optional): The fields of the representation. Defaults to USER_READ_FIELDS.
+        """
+        super().__init__(*args, **kwargs)
+        self.field_names = tuple(fields)
+
+    @staticmethod
+    def get_queryset(queryset, fields=USER_READ_FIELDS):
+        """
+        Get the rows of a queryset of users with the columns needed by the representation.
+
+        Args:
+            queryset (QuerySet): The users.
+            fields (tuple, optional): The fields of the representation. Defaults to USER_READ_FIELDS.
+
+        Returns:
+            QuerySet: The dictionaries with the fields, and the USER_REQUIRED_COLUMNS, of the users.
+        """
+        return queryset.values(*dict.fromkeys((*fields, *USER_REQUIRED_COLUMNS)))
+
+    def to_representation(self, instance):
+        """
+        Represent a user as a dictionary with the fields of the serializer.
+
+        Raises:
+            ValidationError: If the user is not active.
+        """
+        from_dict = isinstance(instance, dict)
+        if not (instance['is_active'] if from_dict else instance.is_active):
+            raise ValidationError({'error': 'This user is not active'})
+        return get_row_converter(self.field_names, from_dict)(instance)
+
+
 class CustomUserDetailSerializer(serializers.ModelSerializer):
     """
     Serializer for the user object.
@@ -0,0 +1,29 @@
+"""
+File with the signal receivers of the user app.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.signals import bulk_updated
+from user.cache import invalidate_user_detail, invalidate_user_details
+from user.models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user_detail(sender, instance, **kwargs):
+    """
+    Invalidate the cached details of a user when it is saved or deleted.
+
+    It covers every write that goes through User.save, such as UserView.put, UserSerializer.update
+    and BaseModel.save and update.
+    """
+    invalidate_user_detail(instance.pk)
+
+
+@receiver(bulk_updated, sender=User)
+def invalidate_cached_user_details(sender, pks, **kwargs):
+    """
+    Invalidate the cached details of the users updated in bulk, such as by QuerySet.soft_delete and restore.
+    """
+    invalidate_user_details(pks)
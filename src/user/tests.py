@@ -0,0 +1,873 @@
+"""
+Tests for the user app.
+"""
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.models import EmailOutbox
+from core.retention import purge
+from core.signals import bulk_updated
+from user.cache import get_cache, get_or_build
+from user.export import EXPORT_FIELDS, export_users, get_export_queryset
+from user.history import UserCompactHistory
+from user.imports import import_users
+from user.models import CompactHistoricalUser, User
+from user.retention import CompactHistoricalUserRetentionPolicy, HistoricalUserRetentionPolicy
+from user.serializers import USER_READ_FIELDS
+from user.views import UserView
+
+
+class UserListViewTests(TestCase):
+    """Tests for the keyset pagination of the list of users."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Create the users of the list."""
+        cls.admin = User.objects.create_user(email="admin@example.com", password="password", is_active=True)
+        for index in range(24):
+            User.objects.create_user(email=f"user{index}@example.com", is_active=True)
+
+    def setUp(self):
+        """Authenticate the client without querying the user."""
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = "/api/user/list/"
+
+    def walk(self, url):
+        """Follow the next urls from a url and return the pages."""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            url = response.data["next"]
+        return pages
+
+    def test_pages_run_a_constant_number_of_queries(self):
+        """Every page, first or not, runs the same queries: the validators of the page and its rows."""
+        url = f"{self.url}?page_size=5"
+        while url:
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            url = response.data["next"]
+
+    def test_pages_cover_every_user_once_newest_first(self):
+        """Following the next urls returns every user once, ordered by creation date and id descending."""
+        pages = self.walk(f"{self.url}?page_size=7")
+        ids = [user["id"] for page in pages for user in page["results"]]
+        expected = list(User.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual([len(page["results"]) for page in pages], [7, 7, 7, 4])
+        self.assertIsNone(pages[0]["previous"])
+
+    def test_previous_url_returns_the_previous_page(self):
+        """The previous url of a page returns the page that linked to it."""
+        first = self.client.get(f"{self.url}?page_size=5").data
+        second = self.client.get(first["next"]).data
+        previous = self.client.get(second["previous"]).data
+        self.assertEqual(previous["results"], first["results"])
+        self.assertIsNone(previous["previous"])
+        self.assertIsNotNone(previous["next"])
+
+    def test_page_size_is_limited(self):
+        """The page size can not be greater than the MAX_PAGE_SIZE setting."""
+        with self.settings(KEYSET_PAGINATION={"MAX_PAGE_SIZE": 3}):
+            response = self.client.get(f"{self.url}?page_size=100")
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_invalid_cursor(self):
+        """An invalid cursor returns a 404 response."""
+        response = self.client.get(f"{self.url}?cursor=invalid")
+        self.assertEqual(response.status_code, 404)
+
+
+class UserListConditionalGetTests(TestCase):
+    """Tests for the ETag and Last-Modified validators of the pages of users."""
+
+    def setUp(self):
+        """Create the users of the list and authenticate the client."""
+        self.admin = User.objects.create_user(email="admin@example.com", password="password", is_active=True)
+        for index in range(5):
+            User.objects.create_user(email=f"user{index}@example.com", is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = "/api/user/list/?page_size=3"
+
+    def test_matching_validators_return_a_304(self):
+        """A request with the ETag or the Last-Modified date of the page is answered with a 304 without its rows."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        not_modified = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_updated_page_returns_a_200(self):
+        """The ETag of a page changes when one of its users is updated."""
+        response = self.client.get(self.url)
+        user = User.objects.get(pk=response.data["results"][1]["id"])
+        user.first_name = "Updated"
+        user.save()
+        modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified["ETag"], response["ETag"])
+        self.assertEqual(modified.data["results"][1]["first_name"], "Updated")
+
+    def test_deleted_user_replaced_by_an_older_one_returns_a_200(self):
+        """
+        A soft-deleted user replaced in the page by an older user changes the ETag, although the greatest
+        updated_at and the number of users of the page stay the same.
+        """
+        response = self.client.get(self.url)
+        ids = [user["id"] for user in response.data["results"]]
+        User.objects.filter(pk=ids[1]).soft_delete()
+        modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified["ETag"], response["ETag"])
+        new_ids = [user["id"] for user in modified.data["results"]]
+        self.assertEqual(len(new_ids), len(ids))
+        self.assertNotIn(ids[1], new_ids)
+        pages = User.objects.filter(pk__in=ids).exclude(pk=ids[1]), User.objects.filter(pk__in=new_ids)
+        self.assertEqual(*(max(page.values_list("updated_at", flat=True)) for page in pages))
+
+
+class UserSparseFieldsTests(TestCase):
+    """Tests for the fields of the users chosen with ?fields=."""
+
+    def setUp(self):
+        """Create the user and authenticate the client."""
+        self.user = User.objects.create_user(
+            email="sparse@example.com", password="password", first_name="Sparse", is_active=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_default_fields(self):
+        """Without the parameter, the detail and the list return the default fields."""
+        detail = self.client.get("/api/user/detail/")
+        self.assertEqual(list(detail.data), list(USER_READ_FIELDS))
+        listed = self.client.get("/api/user/list/")
+        self.assertEqual(list(listed.data["results"][0]), list(USER_READ_FIELDS))
+
+    def test_requested_fields_are_returned_in_order_once(self):
+        """The requested fields are returned in the given order, without the duplicates and the blanks."""
+        for url in ("/api/user/detail/", "/api/user/list/"):
+            with self.subTest(url=url):
+                response = self.client.get(url, {"fields": " first_name,id,, first_name,updated_at"})
+                self.assertEqual(response.status_code, 200)
+                user = response.data["results"][0] if "results" in response.data else response.data
+                self.assertEqual(list(user), ["first_name", "id", "updated_at"])
+                self.assertEqual(user["first_name"], "Sparse")
+
+    def test_list_reads_only_the_requested_columns(self):
+        """The rows of the list are read with the requested and required columns only."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/user/list/", {"fields": "first_name"})
+        rows_query = queries.captured_queries[-1]["sql"]
+        self.assertIn('"first_name"', rows_query)
+        self.assertNotIn('"last_name"', rows_query)
+        self.assertNotIn('"password"', rows_query)
+
+    def test_invalid_fields_are_rejected(self):
+        """An empty parameter and the fields that can not be requested, such as the password, return a 400."""
+        for value, error in (("", "At least one field is required."), ("id,password", "Unknown fields: password.")):
+            for url in ("/api/user/detail/", "/api/user/list/"):
+                with self.subTest(url=url, fields=value):
+                    response = self.client.get(url, {"fields": value})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.data["fields"], error)
+
+
+class UserDetailCacheTests(TestCase):
+    """Tests for the cache of the user details."""
+
+    def setUp(self):
+        """Create the user and the caches of the backends to test."""
+        self.user = User.objects.create_user(email="cached@example.com", first_name="Old", is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = "/api/user/detail/"
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.backends = {
+            "locmem": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "user-detail-tests"},
+            "filebased": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory.name},
+        }
+
+    def get_first_name(self):
+        """Read the first name of the user through the detail view."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.data["first_name"]
+
+    def test_reads_after_a_write_are_never_stale(self):
+        """Every write path invalidates the cached details, with the local memory and file based caches."""
+        for name, backend in self.backends.items():
+            with self.subTest(backend=name), self.settings(CACHES={"default": backend}):
+                get_cache().clear()
+                self.user.refresh_from_db()
+                self.user.first_name = "Old"
+                self.user.save()
+                self.assertEqual(self.get_first_name(), "Old")
+
+                response = self.client.put("/api/user/", {"id": self.user.id, "first_name": "Put"}, format="json")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.get_first_name(), "Put")
+
+                self.user.refresh_from_db()
+                self.user.first_name = "Saved"
+                self.user.save()
+                self.assertEqual(self.get_first_name(), "Saved")
+
+                self.user.first_name = "Updated"
+                self.user.update()
+                self.assertEqual(self.get_first_name(), "Updated")
+
+    def test_reads_with_a_non_canonical_id_are_never_stale(self):
+        """An id with leading zeros reads the cache entry of the user, which its writes invalidate."""
+        with self.settings(CACHES={"default": self.backends["locmem"]}):
+            get_cache().clear()
+            url = f"{self.url}?id=00{self.user.id}"
+            self.assertEqual(self.client.get(url).data["first_name"], "Old")
+            self.user.first_name = "New"
+            self.user.save()
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["first_name"], "New")
+
+    def test_cached_reads_do_not_query_the_database(self):
+        """Once cached, the details are returned without queries."""
+        with self.settings(CACHES={"default": self.backends["locmem"]}):
+            get_cache().clear()
+            self.get_first_name()
+            with self.assertNumQueries(0):
+                self.get_first_name()
+
+    def test_only_one_worker_rebuilds_a_missing_entry(self):
+        """Concurrent readers of a missing entry wait for the worker that rebuilds it."""
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.1)
+            return {"id": 1}
+
+        with self.settings(CACHES={"default": self.backends["locmem"]}):
+            get_cache().clear()
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(get_or_build(1, build))) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(results, [{"id": 1}] * 5)
+
+
+class UserHistoryTests(TestCase):
+    """Tests for the deferred historical records of the users."""
+
+    ignored_columns = (
+        "history_id",
+        "history_date",
+        "history_inserted_at",
+        "id",
+        "password",
+        "created_at",
+        "updated_at",
+    )
+
+    def change_users(self, prefix):
+        """Create, update and delete users in a transaction, and return the historical rows of the users."""
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user(email=f"{prefix}@example.com", first_name="First", is_active=True)
+            user.first_name = "Second"
+            user.save()
+            user.set_password("password")
+            user.save(update_fields=["password", "updated_at"])
+            other = User.objects.create_user(email=f"{prefix}.other@example.com", is_active=True)
+            other.delete()
+        rows = User.historical.filter(email__startswith=prefix).order_by("history_id").values()
+        return [
+            {
+                name: value.replace(prefix, "") if name == "email" else value
+                for name, value in row.items()
+                if name not in self.ignored_columns
+            }
+            for row in rows
+        ]
+
+    def test_history_is_identical_to_the_immediate_history(self):
+        deferred = self.change_users("deferred")
+        with override_settings(SIMPLE_HISTORY_DEFERRED=False):
+            immediate = self.change_users("immediate")
+        self.assertEqual(len(deferred), 5)
+        self.assertEqual(deferred, immediate)
+
+    def test_history_is_written_with_a_single_insert_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            for index in range(3):
+                User.objects.create_user(email=f"user{index}@example.com", is_active=True)
+        self.assertFalse(User.historical.exists())
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        inserts = [query for query in queries if "historicaluser" in query["sql"].lower()]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(User.historical.count(), 3)
+
+    def test_rolled_back_savepoint_discards_its_history(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(email="kept@example.com", is_active=True)
+            try:
+                with transaction.atomic():
+                    User.objects.create_user(email="discarded@example.com", is_active=True)
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(list(User.historical.values_list("email", flat=True)), ["kept@example.com"])
+
+    def test_ignored_fields_do_not_create_history(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user(email="user@example.com", is_active=True)
+            user.save(update_fields=["updated_at"])
+            user.save(update_fields=["last_login", "updated_at"])
+        self.assertEqual(User.historical.count(), 1)
+
+    def test_save_without_changes_does_not_create_history(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user(email="user@example.com", is_active=True)
+        user = User.objects.get(pk=user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+            user.first_name = "First"
+            user.save()
+        self.assertEqual(list(User.historical.values_list("first_name", flat=True)), ["First", ""])
+
+
+class UserUniquenessRaceTests(TestCase):
+    """Tests for the uniqueness of the users when the check of a request runs before a concurrent insert."""
+
+    def setUp(self):
+        """Create the user inserted by the concurrent request, and let the first check of the request miss it."""
+        User.objects.create_user(email="first@example.com", code_phone="+57", phone_number="3001234567", is_active=True)
+        find_conflict = UserView.find_conflict
+        calls = []
+
+        def miss_first_check(view, data, user_id=None):
+            calls.append(data)
+            return None if len(calls) == 1 else find_conflict(view, data, user_id=user_id)
+
+        patcher = patch.object(UserView, "find_conflict", miss_first_check)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = calls
+
+    def test_integrity_error_is_returned_as_a_conflict(self):
+        """The user rejected by the unique constraint is returned as a conflict, without a welcome email."""
+        data = {
+            "email": "second@example.com",
+            "first_name": "Second",
+            "last_name": "User",
+            "password": "password",
+            "code_phone": "+57",
+            "phone_number": "3001234567",
+        }
+        response = APIClient().post("/api/user/", data, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"message": "Error creating user, phone number already exists"})
+        self.assertEqual(len(self.calls), 2)
+        self.assertFalse(User.all_objects.filter(email="second@example.com").exists())
+        self.assertFalse(EmailOutbox.objects.exists())
+
+
+class UserImportTests(TestCase):
+    """Tests for the bulk import of the users."""
+
+    def setUp(self):
+        """Create the existing user, whose email and phone number can't be imported again."""
+        User.objects.create_user(email="existing@example.com", code_phone="+57", phone_number="3000000000")
+        self.report = io.StringIO()
+
+    def import_csv(self, content, batch_size=2):
+        """Import a CSV file in the current process and return the progress and the errors of the report."""
+        with self.captureOnCommitCallbacks(execute=True):
+            progress = list(import_users(io.StringIO(content), "csv", self.report, batch_size=batch_size, workers=1))
+        entries = [json.loads(line) for line in self.report.getvalue().splitlines()]
+        return progress, [entry for entry in entries if entry["type"] == "error"]
+
+    def test_valid_batch_creates_the_users(self):
+        """Every row of a valid file is created, with its password hashed and inactive rows deleted."""
+        progress, errors = self.import_csv(
+            "email,first_name,password,code_phone,phone_number,is_active\n"
+            "One@Example.com,One,secret,+57,3000000001,true\n"
+            "two@example.com,Two,,,,true\n"
+            "three@example.com,Three,,,,false\n"
+        )
+        self.assertEqual(errors, [])
+        self.assertEqual([entry["type"] for entry in progress], ["progress", "summary"])
+        self.assertEqual(
+            {key: progress[-1][key] for key in ("rows", "created", "failed")}, {"rows": 3, "created": 3, "failed": 0}
+        )
+        one = User.objects.get(email="one@example.com")
+        self.assertEqual((one.first_name, one.code_phone, one.phone_number), ("One", "+57", "3000000001"))
+        self.assertTrue(one.check_password("secret"))
+        self.assertFalse(User.objects.get(email="two@example.com").has_usable_password())
+        self.assertFalse(User.objects.filter(email="three@example.com").exists())
+        self.assertIsNotNone(User.all_objects.get(email="three@example.com").deleted_at)
+
+    def test_duplicate_and_invalid_rows_are_reported(self):
+        """The duplicated and invalid rows are reported with their line, and the other rows are still created."""
+        progress, errors = self.import_csv(
+            "email,code_phone,phone_number,is_active\n"
+            "existing@example.com,,,true\n"
+            "new@example.com,+57,3000000000,true\n"
+            "not-an-email,,,true\n"
+            "first@example.com,,,true\n"
+            "FIRST@example.com,,,true\n"
+            "phone@example.com,+57,,true\n"
+            "active@example.com,,,maybe\n"
+        )
+        self.assertEqual(
+            [(error["line"], error["error"]) for error in errors],
+            [
+                (2, "email already exists"),
+                (3, "phone number already exists"),
+                (4, "Enter a valid email address."),
+                (6, "email already exists"),
+                (7, "code_phone and phone_number must be given together"),
+                (8, "is_active must be true or false"),
+            ],
+        )
+        self.assertEqual(
+            {key: progress[-1][key] for key in ("rows", "created", "failed")}, {"rows": 7, "created": 1, "failed": 6}
+        )
+        self.assertEqual(
+            sorted(User.all_objects.values_list("email", flat=True)), ["existing@example.com", "first@example.com"]
+        )
+
+    def test_users_are_created_with_their_history(self):
+        """Every imported user has a single created historical record with its imported values."""
+        self.import_csv("email,first_name\none@example.com,One\ntwo@example.com,Two\nthree@example.com,Three\n")
+        imported = User.objects.exclude(email="existing@example.com")
+        records = User.historical.filter(id__in=imported.values("id"))
+        self.assertEqual(
+            sorted(records.values_list("email", "first_name", "history_type")),
+            [("one@example.com", "One", "+"), ("three@example.com", "Three", "+"), ("two@example.com", "Two", "+")],
+        )
+
+    def test_view_streams_the_progress_and_writes_the_report(self):
+        """The admin endpoint streams the progress of the import and writes the same report to a file."""
+        admin = User.objects.create_superuser(email="admin@example.com", password="password")
+        client = APIClient()
+        client.force_authenticate(admin)
+        upload = SimpleUploadedFile("users.ndjson", b'{"email": "one@example.com"}\n{"email": ""}\n')
+        with tempfile.TemporaryDirectory() as report_dir:
+            with override_settings(USER_IMPORT={"REPORT_DIR": report_dir, "WORKERS": 1}):
+                response = client.post("/api/user/import/", {"file": upload}, format="multipart")
+                entries = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(os.path.dirname(entries[0]["path"]), report_dir)
+            with open(entries[0]["path"], encoding="utf-8") as report:
+                report_entries = [json.loads(line) for line in report]
+        self.assertEqual(entries[-1]["type"], "summary")
+        self.assertEqual((entries[-1]["created"], entries[-1]["failed"]), (1, 1))
+        self.assertEqual(report_entries[0], {"type": "error", "line": 2, "email": "", "error": "email is required"})
+        self.assertTrue(User.objects.filter(email="one@example.com").exists())
+
+    def test_view_rejects_unsupported_formats(self):
+        """A file whose format is not supported is rejected before reading it."""
+        admin = User.objects.create_superuser(email="admin@example.com", password="password")
+        client = APIClient()
+        client.force_authenticate(admin)
+        upload = SimpleUploadedFile("users.xml", b"<users/>")
+        response = client.post("/api/user/import/", {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["message"], "Error importing users")
+
+
+class UserExportTests(TestCase):
+    """Tests for the streamed export of the users."""
+
+    def setUp(self):
+        """Create active and soft-deleted users, and authenticate an admin."""
+        self.admin = User.objects.create_superuser(email="admin@example.com", password="password")
+        for index in range(4):
+            User.objects.create_user(email=f"user{index}@example.com", is_active=True)
+        User.objects.create_user(email="inactive@example.com", is_active=False)
+        self.deleted = User.objects.create_user(email="deleted@example.com", is_active=True)
+        User.objects.filter(pk=self.deleted.pk).soft_delete()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_chunks_run_a_single_query(self):
+        """The rows are read with one query whatever the number of chunks, each chunk holding chunk_size rows."""
+        with self.assertNumQueries(1):
+            chunks = list(export_users(get_export_queryset(), "ndjson", chunk_size=2))
+        self.assertEqual([chunk.count("\n") for chunk in chunks], [2, 2, 1])
+
+    def test_ndjson_exports_the_alive_users(self):
+        """Every line is a user with the export fields, ordered by id, without the soft-deleted users."""
+        response = self.client.get("/api/user/export/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["id"] for row in rows], list(User.objects.order_by("id").values_list("id", flat=True)))
+        self.assertNotIn(self.deleted.pk, [row["id"] for row in rows])
+        self.assertEqual(list(rows[0]), list(EXPORT_FIELDS))
+        self.assertEqual(rows[0]["created_at"], self.admin.created_at.isoformat())
+
+    def test_csv_exports_a_header_and_the_filtered_users(self):
+        """The CSV export starts with the header and applies the filters."""
+        response = self.client.get("/api/user/export/?file_format=csv&is_active=false&include_deleted=true")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], list(EXPORT_FIELDS))
+        self.assertEqual(
+            [row[EXPORT_FIELDS.index("email")] for row in rows[1:]], ["inactive@example.com", "deleted@example.com"]
+        )
+
+    def test_deleted_users_are_exported_on_demand(self):
+        """The soft-deleted users are exported with their deletion date when include_deleted is true."""
+        response = self.client.get("/api/user/export/?include_deleted=true")
+        rows = {row["id"]: row for row in map(json.loads, b"".join(response.streaming_content).splitlines())}
+        self.assertEqual(len(rows), User.all_objects.count())
+        self.assertIsNotNone(rows[self.deleted.pk]["deleted_at"])
+
+    def test_invalid_filters_are_rejected(self):
+        """An invalid filter or format returns a 400 response."""
+        for query in ("file_format=xml", "is_active=maybe", "include_deleted=maybe", "created_after=yesterday"):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f"/api/user/export/?{query}").status_code, 400)
+
+    def test_command_writes_the_export_to_a_file(self):
+        """The command writes the same CSV export to its output file."""
+        with tempfile.TemporaryDirectory() as output_dir:
+            path = os.path.join(output_dir, "users.csv")
+            call_command("export_users", "--format", "csv", "--output", path, "--include-deleted", stderr=io.StringIO())
+            with open(path, encoding="utf-8", newline="") as output:
+                rows = list(csv.reader(output))
+        self.assertEqual(rows[0], list(EXPORT_FIELDS))
+        self.assertEqual(len(rows) - 1, User.all_objects.count())
+
+
+@override_settings(USER_CHANGE_FEED={"SETTLE_SECONDS": 0, "MAX_WAIT": 1, "POLL_INTERVAL": 0.01})
+class UserChangeFeedTests(TestCase):
+    """Tests for the change feed of the users."""
+
+    def setUp(self):
+        """Create the admin and two users, with their historical records."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin = User.objects.create_superuser(email="admin@example.com", password="password")
+            self.first = User.objects.create_user(email="first@example.com", is_active=True)
+            self.second = User.objects.create_user(email="second@example.com", is_active=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = "/api/user/changes/"
+
+    def get_changes(self, cursor=None, **params):
+        """Get the changes after a cursor."""
+        if cursor:
+            params["cursor"] = cursor
+        return self.client.get(self.url, params)
+
+    def test_feed_resumes_from_the_cursor(self):
+        """Following the cursors returns every change once, in the order of the commits."""
+        response = self.get_changes(page_size=2)
+        self.assertEqual([change["id"] for change in response.data["results"]], [self.admin.id, self.first.id])
+        self.assertTrue(response.data["has_more"])
+        response = self.get_changes(response.data["cursor"], page_size=2)
+        self.assertEqual([change["id"] for change in response.data["results"]], [self.second.id])
+        self.assertFalse(response.data["has_more"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.first_name = "First"
+            self.first.save()
+        response = self.get_changes(response.data["cursor"])
+        self.assertEqual(
+            [(change["event"], change["id"], change["user"]["first_name"]) for change in response.data["results"]],
+            [("updated", self.first.id, "First")],
+        )
+
+    def test_empty_poll_returns_the_cursor_of_the_request(self):
+        """A poll without new changes, waiting or not, returns no change and the cursor of the request."""
+        cursor = self.get_changes().data["cursor"]
+        for params in ({}, {"wait": 0.05}):
+            response = self.get_changes(cursor, **params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["results"], [])
+            self.assertEqual(response.data["cursor"], cursor)
+            self.assertFalse(response.data["has_more"])
+
+    @override_settings(USER_CHANGE_FEED={"SETTLE_SECONDS": 5})
+    def test_changes_wait_for_the_insert_of_their_history(self):
+        """
+        A change is returned once its history was inserted SETTLE_SECONDS seconds ago, whatever its date, and the feed
+        stops before it, so an earlier change committed later is never skipped.
+        """
+        User.historical.update(history_inserted_at=timezone.now() - timedelta(minutes=1))
+        cursor = self.get_changes().data["cursor"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.first_name = "First"
+            self.first.save()
+            self.second.first_name = "Second"
+            self.second.save()
+        late, later = User.historical.order_by("-history_id")[:2][::-1]
+        User.historical.filter(history_id=late.history_id).update(history_date=timezone.now() - timedelta(hours=1))
+        User.historical.filter(history_id=later.history_id).update(
+            history_inserted_at=timezone.now() - timedelta(minutes=1)
+        )
+        self.assertEqual(self.get_changes(cursor).data["results"], [])
+
+        User.historical.filter(history_id=late.history_id).update(
+            history_inserted_at=timezone.now() - timedelta(minutes=1)
+        )
+        response = self.get_changes(cursor)
+        self.assertEqual([change["id"] for change in response.data["results"]], [self.first.id, self.second.id])
+
+    def test_tampered_cursor_is_rejected(self):
+        """A cursor that was not returned by the feed is rejected."""
+        cursor = self.get_changes(page_size=1).data["cursor"]
+        response = self.get_changes(cursor[:-1] + ("A" if cursor[-1] != "A" else "B"))
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_followed_by_deleted_changes_requires_a_resync(self):
+        """A cursor followed by records deleted by the retention or the compaction can't resume the feed."""
+        behind = self.get_changes(page_size=1).data["cursor"]
+        last_deleted = self.get_changes(page_size=2).data["cursor"]
+        first_ids = User.historical.order_by("history_id").values("history_id")[:2]
+        User.historical.filter(history_id__in=first_ids).update(history_date=timezone.now() - timedelta(days=400))
+        self.assertEqual(purge(HistoricalUserRetentionPolicy(), timezone.now(), sleep=0)["rows"], 2)
+        response = self.get_changes(behind)
+        self.assertEqual(response.status_code, 410)
+        self.assertTrue(response.data["resync_required"])
+
+        response = self.get_changes(last_deleted)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([change["id"] for change in response.data["results"]], [self.second.id])
+
+        User.historical.update(history_date=timezone.now() - timedelta(days=60))
+        UserCompactHistory().convert(timezone.now() - timedelta(days=30), sleep=0)
+        self.assertEqual(self.get_changes(last_deleted).status_code, 410)
+
+    def test_gaps_of_the_ids_do_not_require_a_resync(self):
+        """The ids missing because of rolled back inserts are not taken for deleted records."""
+        behind = self.get_changes(page_size=1).data["cursor"]
+        User.historical.filter(id=self.first.id).delete()
+        response = self.get_changes(behind)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([change["id"] for change in response.data["results"]], [self.second.id])
+
+
+class UserBulkUpdateTests(TestCase):
+    """Tests for the bulk operations of SoftDeleteQuerySet on the users, which update them in chunks."""
+
+    def setUp(self):
+        """Create five active users and a deleted one, and record the chunks sent with bulk_updated."""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users = [User.objects.create_user(email=f"user{index}@example.com") for index in range(5)]
+            self.deleted = User.objects.create_user(email="deleted@example.com", is_active=False)
+        self.chunks = []
+
+        def record_chunk(sender, pks, fields, **kwargs):
+            self.chunks.append(list(pks))
+
+        bulk_updated.connect(record_chunk, sender=User, weak=False)
+        self.addCleanup(bulk_updated.disconnect, record_chunk, sender=User)
+
+    def get_updates(self, queries):
+        """Get the UPDATE queries of the users."""
+        return [query for query in queries if query["sql"].startswith('UPDATE "user_user"')]
+
+    def get_last_records(self):
+        """Get the type, is_active and deleted_at of the last historical record of each active user."""
+        records = {}
+        for record in User.historical.filter(id__in=[user.id for user in self.users]).order_by("history_id"):
+            records[record.id] = (record.history_type, record.is_active, record.deleted_at is not None)
+        return [records[user.id] for user in self.users]
+
+    def test_soft_delete_updates_in_chunks(self):
+        """The active rows are deactivated with an UPDATE per chunk, the deleted rows are left untouched."""
+        deleted_at = User.all_objects.get(pk=self.deleted.pk).deleted_at
+        with CaptureQueriesContext(connection) as queries:
+            rows = User.all_objects.all().soft_delete(chunk_size=2)
+        self.assertEqual(rows, 5)
+        pks = [user.pk for user in self.users]
+        self.assertEqual(self.chunks, [pks[0:2], pks[2:4], pks[4:5]])
+        self.assertEqual(len(self.get_updates(queries)), 3)
+        self.assertFalse(User.objects.exists())
+        self.assertEqual(User.all_objects.get(pk=self.deleted.pk).deleted_at, deleted_at)
+
+    def test_chunk_boundaries(self):
+        """A chunk size that divides the rows sends full chunks, a larger one sends a single chunk."""
+        for chunk_size, sizes in ((5, [5]), (4, [4, 1]), (10, [5])):
+            self.chunks = []
+            User.objects.all().soft_delete(chunk_size=chunk_size)
+            self.assertEqual([len(chunk) for chunk in self.chunks], sizes)
+            User.all_objects.filter(pk__in=[user.pk for user in self.users]).restore(chunk_size=chunk_size)
+
+    def test_soft_delete_writes_the_history(self):
+        """The bulk_updated signal writes a historical record of each deactivated row."""
+        User.objects.all().soft_delete(chunk_size=2)
+        self.assertEqual(self.get_last_records(), [("~", False, True)] * 5)
+
+    def test_restore_clears_deleted_at(self):
+        """The deleted rows are reactivated, their deleted_at is cleared and their history is written."""
+        User.objects.all().soft_delete()
+        self.chunks = []
+        rows = User.all_objects.filter(pk__in=[user.pk for user in self.users]).restore(chunk_size=3)
+        self.assertEqual(rows, 5)
+        self.assertEqual([len(chunk) for chunk in self.chunks], [3, 2])
+        self.assertEqual(User.objects.filter(deleted_at__isnull=True, is_active=True).count(), 5)
+        self.assertEqual(self.get_last_records(), [("~", True, False)] * 5)
+
+    def test_bulk_update_in_chunks(self):
+        """The instances are updated with a bulk_update per chunk, deleted_at follows is_active."""
+        for index, user in enumerate(self.users):
+            user.first_name = f"Name {index}"
+            user.is_active = index % 2 == 0
+        with CaptureQueriesContext(connection) as queries:
+            rows = User.objects.bulk_update_in_chunks(self.users, ["first_name", "is_active"], chunk_size=2)
+        self.assertEqual(rows, 5)
+        self.assertEqual([len(chunk) for chunk in self.chunks], [2, 2, 1])
+        self.assertEqual(len(self.get_updates(queries)), 3)
+        users = User.all_objects.filter(pk__in=[user.pk for user in self.users]).order_by("pk")
+        self.assertEqual(
+            [(user.first_name, user.deleted_at is None) for user in users],
+            [("Name 0", True), ("Name 1", False), ("Name 2", True), ("Name 3", False), ("Name 4", True)],
+        )
+        self.assertEqual(
+            [record[1:] for record in self.get_last_records()],
+            [(True, False), (False, True), (True, False), (False, True), (True, False)],
+        )
+        with self.assertNumQueries(0):
+            self.users[0].save()
+
+
+class UserCompactHistoryTests(TestCase):
+    """Tests for the conversion of the historical records of the users into compact rows."""
+
+    def setUp(self):
+        """Create two users with seven versions each, and make their history old enough to be converted."""
+        self.users = [self.create_user(f"user{index}@example.com", versions=7) for index in range(2)]
+        self.store = UserCompactHistory()
+
+    def create_user(self, email, versions):
+        """Create a user with some versions, each one saved in its own transaction, and age its history."""
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user(email=email, password="password", is_active=True)
+        for version in range(1, versions):
+            self.change_user(user, version)
+        User.historical.filter(id=user.id).update(history_date=timezone.now() - timedelta(days=60))
+        return user
+
+    def change_user(self, user, version):
+        """Save a new version of a user, which changes its first name and sometimes its password."""
+        with self.captureOnCommitCallbacks(execute=True):
+            user.first_name = f"Version {version}"
+            if version % 3 == 0:
+                user.set_password(f"password {version}")
+            user.save()
+
+    def get_versions(self):
+        """Rebuild every version of the users, by id, and the latest version of each user."""
+        history_ids = sorted(
+            set(User.historical.values_list("history_id", flat=True))
+            | set(CompactHistoricalUser.objects.values_list("history_id", flat=True))
+        )
+        versions = {}
+        for user in self.users:
+            for history_id in history_ids:
+                versions[(user.id, history_id)] = self.store.get_version(user.id, history_id=history_id)
+            versions[(user.id, None)] = self.store.get_version(user.id)
+        return versions
+
+    def convert(self, **kwargs):
+        """Convert the historical records older than a day."""
+        return self.store.convert(timezone.now() - timedelta(days=1), snapshot_interval=3, sleep=0, **kwargs)
+
+    def test_versions_are_identical_after_the_conversion(self):
+        """Every version, with more versions than the snapshot interval, is rebuilt from the compact rows."""
+        versions = self.get_versions()
+        result = self.convert(chunk_size=1)
+        self.assertEqual((result["objects"], result["records"]), (2, 14))
+        self.assertFalse(User.historical.exists())
+        self.assertEqual(
+            list(
+                CompactHistoricalUser.objects.filter(object_id=self.users[0].id).values_list("is_snapshot", flat=True)
+            ),
+            [True, False, False, True, False, False, True],
+        )
+        self.assertEqual(self.get_versions(), versions)
+        self.assertEqual(list(self.store.iter_versions(self.users[0].id))[-1], versions[(self.users[0].id, None)])
+
+    def test_interrupted_conversion_resumes(self):
+        """A conversion that stopped after a chunk, or runs again after new versions, keeps every version."""
+        versions = self.get_versions()
+        boundary = self.store.get_boundary(timezone.now() - timedelta(days=1))
+        self.store.convert_chunk([self.users[0].id], boundary, 3)
+        self.assertEqual(self.get_versions(), versions)
+        result = self.convert()
+        self.assertEqual((result["objects"], result["records"]), (1, 7))
+        self.assertEqual(self.get_versions(), versions)
+        self.assertEqual(self.convert()["records"], 0)
+
+        for version in range(7, 9):
+            self.change_user(self.users[0], version)
+        User.historical.update(history_date=timezone.now() - timedelta(days=60))
+        versions = self.get_versions()
+        self.assertEqual(self.convert()["records"], 2)
+        self.assertEqual(self.get_versions(), versions)
+        self.assertEqual(versions[(self.users[0].id, None)]["first_name"], "Version 8")
+
+    def test_recent_versions_are_not_converted(self):
+        """The historical records newer than the date stay in the historical table."""
+        self.change_user(self.users[0], 7)
+        self.assertEqual(self.convert()["records"], 14)
+        self.assertEqual(list(User.historical.values_list("first_name", flat=True)), ["Version 7"])
+
+    def test_password_never_reaches_the_compact_rows(self):
+        """The password hashes are not kept in the compact rows nor in the rebuilt versions."""
+        self.convert()
+        for data in CompactHistoricalUser.objects.values_list("data", flat=True):
+            self.assertNotIn("password", data)
+        self.assertNotIn("password", self.store.get_version(self.users[0].id))
+
+    def test_retention_keeps_the_versions_after_the_cutoff(self):
+        """The retention deletes the history older than HISTORY_DAYS, and keeps the snapshots of the kept versions."""
+        self.convert()
+        rows = list(CompactHistoricalUser.objects.filter(object_id=self.users[0].id).order_by("history_id"))
+        CompactHistoricalUser.objects.filter(pk__in=[row.pk for row in rows[:5]]).update(
+            history_date=timezone.now() - timedelta(days=400)
+        )
+        self.change_user(self.users[1], 7)
+        User.historical.update(history_date=timezone.now() - timedelta(days=400))
+        versions = {row.history_id: self.store.get_version(self.users[0].id, history_id=row.history_id) for row in rows}
+
+        now = timezone.now()
+        self.assertEqual(purge(CompactHistoricalUserRetentionPolicy(), now, sleep=0)["rows"], 3)
+        self.assertEqual(purge(HistoricalUserRetentionPolicy(), now, sleep=0)["rows"], 1)
+        self.assertFalse(User.historical.exists())
+        kept = CompactHistoricalUser.objects.filter(object_id=self.users[0].id).values_list("history_id", flat=True)
+        self.assertEqual(list(kept), [row.history_id for row in rows[3:]])
+        for row in rows[3:]:
+            self.assertEqual(
+                self.store.get_version(self.users[0].id, history_id=row.history_id), versions[row.history_id]
+            )
@@ -3,7 +3,15 @@ File that contains the urls of the user app.
 """
 from django.urls import path
 
-from user.views import UserDetailView, UserListView, UserView
+from user.views import (
+    UserChangesView,
+    UserDeactivateView,
+    UserDetailView,
+    UserExportView,
+    UserImportView,
+    UserListView,
+    UserView,
+)
 
 APP_NAME = 'user'
 
@@ -11,4 +19,8 @@ urlpatterns = [
     path('', UserView.as_view(), name='user_list'),
     path('list/', UserListView.as_view(), name='user_list'),
     path('detail/', UserDetailView.as_view(), name='user_detail'),
+    path('export/', UserExportView.as_view(), name='user_export'),
+    path('import/', UserImportView.as_view(), name='user_import'),
+    path('changes/', UserChangesView.as_view(), name='user_changes'),
+    path('deactivate/', UserDeactivateView.as_view(), name='user_deactivate'),
 ]
@@ -2,17 +2,28 @@
 File with the user views.
 """
 
+import json
 import os
+import time
+import uuid
 
-from django.template.loader import render_to_string
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import StreamingHttpResponse
 from rest_framework import status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from core.utils import send_email
-from user.models import User
-from user.serializers import UserSerializer
+from core.mixins import ConditionalGetMixin, SparseFieldsMixin
+from core.outbox import enqueue_template_email
+from core.pagination import ChangeFeedPagination, KeysetPagination
+from user.cache import get_user_detail
+from user.changes import get_changes_queryset, get_user_change_feed_setting, has_deleted_changes, serialize_change
+from user.export import EXPORT_CONTENT_TYPES, export_users, get_export_queryset, parse_export_filters
+from user.imports import get_import_format, get_user_import_setting, import_users
+from user.models import User, get_email_lookup, normalize_email
+from user.serializers import USER_READ_FIELDS, USER_SPARSE_FIELDS, UserReadSerializer, UserSerializer
 
 
 class UserView(APIView):
@@ -20,7 +31,9 @@ class UserView(APIView):
     A view for handling user creation and update requests.
 
     This view allows users to be created and updated. It performs validation checks to ensure that the email address
-    provided is unique and sends a welcome email to the user upon successful creation.
+    and the phone number provided are unique and queues a welcome email to the user upon successful creation.
+    The uniqueness is checked with a single query, and enforced by the database constraints, so two concurrent
+    requests with the same email or phone number can not both succeed.
 
     Methods:
     - post: Create a new user.
@@ -29,41 +42,100 @@ class UserView(APIView):
 
     permission_classes = [AllowAny]
 
+    @staticmethod
+    def get_unique_query(data):
+        """
+        Build the filter of the users that have the email or the phone number of the request.
+
+        Args:
+            data (dict): The data of the request.
+
+        Returns:
+            Q: The filter, empty if the request has no email nor phone number.
+        """
+        query = Q()
+        if data.get('email'):
+            query |= Q(get_email_lookup(data['email']))
+        if data.get('phone_number') and data.get('code_phone'):
+            query |= Q(phone_number=data['phone_number'], code_phone=data['code_phone'])
+        return query
+
+    @staticmethod
+    def get_conflict(data, users):
+        """
+        Get the unique field of the request that is already used by other users.
+
+        Args:
+            data (dict): The data of the request.
+            users (iterable): The other users found with get_unique_query.
+
+        Returns:
+            str: "email" or "phone number", or None if there is no conflict.
+        """
+        conflicts = set()
+        for user in users:
+            if data.get('email') and normalize_email(user.email) == normalize_email(data['email']):
+                conflicts.add("email")
+            elif user.phone_number == data.get('phone_number') and user.code_phone == data.get('code_phone'):
+                conflicts.add("phone number")
+        return "email" if "email" in conflicts else next(iter(conflicts), None)
+
+    def find_conflict(self, data, user_id=None):
+        """
+        Query the unique field of the request that is already used by other users.
+
+        Args:
+            data (dict): The data of the request.
+            user_id (optional): The id of the user to ignore, the one being updated.
+
+        Returns:
+            str: "email" or "phone number", or None if there is no conflict.
+        """
+        query = self.get_unique_query(data)
+        if not query:
+            return None
+        # The deleted users keep their email and phone number in the unique constraints
+        users = User.all_objects.filter(query).only('email', 'code_phone', 'phone_number')
+        if user_id:
+            users = users.exclude(id=user_id)
+        return self.get_conflict(data, users[:2])
+
     def post(self, request):
         """
         Create a new user.
 
         This method handles HTTP POST requests to create a new user. It performs validation checks to ensure that the
-        email address provided is unique. Upon successful creation, it sends a welcome email to the user.
+        email address and the phone number provided are unique. Upon successful creation, it queues a welcome email
+        to the user in the email outbox. If a concurrent request created a user with the same email or phone number,
+        the database rejects the insert and the same error is returned.
 
         Returns:
         - Response: A response indicating the success or failure of the user creation.
         """
-        if request.data.get('email'):
-            user = User.objects.filter(email=request.data['email']).first()
-            if user:
-                return Response(
-                    {"message": "Error creating user, email already exists"}, status=status.HTTP_400_BAD_REQUEST
-                )
-        if request.data.get('phone_number') and request.data.get('code_phone'):
-            user = User.objects.filter(
-                phone_number=request.data['phone_number'], code_phone=request.data['code_phone']
-            ).first()
-            if user:
-                return Response(
-                    {"message": "Error creating user, phone number already exists"}, status=status.HTTP_400_BAD_REQUEST
-                )
+        conflict = self.find_conflict(request.data)
+        if conflict:
+            return Response(
+                {"message": f"Error creating user, {conflict} already exists"}, status=status.HTTP_400_BAD_REQUEST
+            )
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
             try:
-                serializer.save()
+                with transaction.atomic():
+                    serializer.save()
 
-                context = {"first_name": request.data['first_name'], "url_frontend": os.environ.get("URL_FRONTEND")}
-                html_content = render_to_string("welcome.html", context)
-                to_send_email = [{"email": request.data['email'], "name": request.data['first_name']}]
-                send_email("Welcome to Name_APP", html_content, to_send_email)
+                    context = {"first_name": request.data['first_name'], "url_frontend": os.environ.get("URL_FRONTEND")}
+                    to_send_email = [{"email": request.data['email'], "name": request.data['first_name']}]
+                    enqueue_template_email("welcome.html", context, "Welcome to Name_APP", to_send_email)
 
                 return Response({"message": "User created successfully"}, status=status.HTTP_201_CREATED)
+            except IntegrityError as e:
+                conflict = self.find_conflict(request.data)
+                if conflict:
+                    return Response(
+                        {"message": f"Error creating user, {conflict} already exists"},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+                return Response({"message": "Error creating user", "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
                 return Response({"message": "Error creating user", "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -73,7 +145,8 @@ class UserView(APIView):
         Update an existing user.
 
         This method handles HTTP PUT requests to update an existing user. It performs validation checks to ensure that
-        the user being updated exists and that the email address provided is unique.
+        the user being updated exists and that the email address and the phone number provided are unique.
+        The user and the other users with the same email or phone number are read with a single query.
 
         Returns:
         - Response: A response indicating the success or failure of the user update.
@@ -81,61 +154,90 @@ class UserView(APIView):
         user_id = self.request.data.get('id', self.request.user.id)
         if not user_id:
             return Response({"message": "User id not found"}, status=status.HTTP_400_BAD_REQUEST)
-        user = User.objects.filter(id=user_id).first()
+        users = list(User.all_objects.filter(Q(id=user_id) | self.get_unique_query(request.data)))
+        user = next((user for user in users if str(user.id) == str(user_id)), None)
         if not user:
             return Response({"message": f"User with id {user_id} not found"}, status=status.HTTP_404_NOT_FOUND)
-        if request.data.get('email'):
-            user = User.objects.filter(email=request.data['email']).first()
-            if user and user.id != user_id:
-                return Response(
-                    {"message": "Error updating user, email already exists"}, status=status.HTTP_400_BAD_REQUEST
-                )
-        if request.data.get('phone_number') and request.data.get('code_phone'):
-            user = User.objects.filter(
-                phone_number=request.data['phone_number'], code_phone=request.data['code_phone']
-            ).first()
-            if user and user.id != user_id:
-                return Response(
-                    {"message": "Error updating user, phone number already exists"}, status=status.HTTP_400_BAD_REQUEST
-                )
+        conflict = self.get_conflict(request.data, [other for other in users if other.id != user.id])
+        if conflict:
+            return Response(
+                {"message": f"Error updating user, {conflict} already exists"}, status=status.HTTP_400_BAD_REQUEST
+            )
         serializer = UserSerializer(user, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except IntegrityError as e:
+                conflict = self.find_conflict(request.data, user_id=user.id)
+                if conflict:
+                    return Response(
+                        {"message": f"Error updating user, {conflict} already exists"},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+                return Response({"message": "Error updating user", "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             return Response({"message": "User updated successfully"}, status=status.HTTP_200_OK)
         return Response(
             {"message": "Error updating user", "error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
         )
 
 
-class UserListView(APIView):
+class UserListView(ConditionalGetMixin, SparseFieldsMixin, APIView):
     """
     A view for retrieving a list of all users.
     Requires authentication to access the view.
+
+    The users are paginated with a cursor over their creation date and id, so every page costs the same queries.
+    The deleted users are not listed.
+    The fields of the users can be chosen with ?fields=, and only their columns are read.
+    The pages have an ETag and a Last-Modified date, computed from the greatest updated_at, the number and the ids
+    of the users of the page, and the conditional requests are answered with a 304 when the page did not change.
     """
 
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    sparse_fields = USER_SPARSE_FIELDS
+    default_fields = USER_READ_FIELDS
 
     def get(self, request):
         """
-        Handles the GET request and retrieves all users.
+        Handles the GET request and retrieves a page of users, the newest first.
+
+        The page size is given with the page_size query parameter, and the other pages with the cursor
+        of the next and previous urls of the response. The fields query parameter selects the fields of the users,
+        for example ?fields=id,first_name,profile_image.
 
         Returns:
-            A Response object with the serialized user data and a status code of 200.
+            A Response object with the next and previous urls and the serialized users of the page,
+            and a status code of 200.
         """
-        user = User.objects.all()
-        serializer = UserSerializer(user, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        fields = self.get_sparse_fields()
+        paginator = self.pagination_class()
+        not_modified = self.get_not_modified_response(request, paginator.get_page_queryset(User.objects.all(), request))
+        if not_modified:
+            return not_modified
+        users = paginator.paginate_queryset(
+            UserReadSerializer.get_queryset(User.objects.all(), fields), request, view=self
+        )
+        serializer = UserReadSerializer(users, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
 
 
-class UserDetailView(APIView):
+class UserDetailView(ConditionalGetMixin, SparseFieldsMixin, APIView):
     """
     A view that returns the details of a user.
 
     Requires authentication and can receive a user id as a query parameter or use the id of the authenticated user.
     It returns a serialized representation of the user object if it exists, or an error message if it doesn't.
+    The fields of the user can be chosen with ?fields=, and only their columns are read.
+    The response has an ETag computed from the id and updated_at of the user, and a Last-Modified date,
+    and the conditional requests are answered with a 304 when the user did not change.
+    The user is read from the cache of user.cache, which is invalidated when the user is written.
     """
 
     permission_classes = [IsAuthenticated]
+    sparse_fields = USER_SPARSE_FIELDS
+    default_fields = USER_READ_FIELDS
 
     def get(self, request):
         """
@@ -143,17 +245,197 @@ class UserDetailView(APIView):
 
         If a user id is provided as a query parameter, it will retrieve the user with that id.
         If no user id is provided, it will retrieve the user with the id of the authenticated user.
+        The fields query parameter selects the fields of the user, for example ?fields=id,first_name,profile_image.
 
         Returns:
         - If the user is found, it returns a serialized representation of the user object with a status code of 200.
         - If the user id is not found, it returns an error message with a status code of 400.
         - If the user with the provided id is not found, it returns an error message with a status code of 404.
+        - If a requested field is unknown or can not be requested, it returns an error with a status code of 400.
+        - If the client has the current representation of the user, it returns a status code of 304.
         """
         user_id = self.request.query_params.get('id', self.request.user.id)
         if not user_id:
             return Response({"message": "User id not found"}, status=status.HTTP_400_BAD_REQUEST)
-        user = User.objects.filter(id=user_id).first()
+        fields = self.get_sparse_fields()
+        user = get_user_detail(int(user_id)) if str(user_id).isdigit() else None
         if not user:
             return Response({"message": f"User with id {user_id} not found"}, status=status.HTTP_404_NOT_FOUND)
-        serializer = UserSerializer(user)
+        not_modified = self.check_validators(request, user['updated_at'], 1, user['id'])
+        if not_modified:
+            return not_modified
+        serializer = UserReadSerializer(user, fields=fields)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class UserExportView(APIView):
+    """
+    A view that streams every user as NDJSON or CSV, for the jobs that need the whole table.
+
+    Requires an admin user. The rows are streamed in chunks, so the memory used does not depend on the number of users.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """
+        Stream the users.
+
+        The query parameters are file_format ("ndjson" by default, or "csv"), is_active ("true" or "false"),
+        created_after and created_before (ISO dates or datetimes), and include_deleted ("true" to export the
+        soft-deleted users too). The number of rows exported and the rows per second are logged when the export ends.
+
+        Returns:
+        - If the parameters are valid, a streaming response with the users ordered by id.
+        - If a parameter is not valid, it returns an error message with a status code of 400.
+        """
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in EXPORT_CONTENT_TYPES:
+            return Response(
+                {"message": f"Error exporting users, unsupported format {file_format}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            filters = parse_export_filters(
+                is_active=request.query_params.get('is_active'),
+                created_after=request.query_params.get('created_after'),
+                created_before=request.query_params.get('created_before'),
+                include_deleted=request.query_params.get('include_deleted'),
+            )
+        except ValueError as e:
+            return Response({"message": "Error exporting users", "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(
+            export_users(get_export_queryset(**filters), file_format), content_type=EXPORT_CONTENT_TYPES[file_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="users.{file_format}"'
+        return response
+
+
+class UserImportView(APIView):
+    """
+    A view that imports users in bulk from an uploaded CSV or NDJSON file.
+
+    Requires an admin user. The users are created in batches, with their passwords hashed in a process pool,
+    and the progress is streamed in the response while the import runs. The progress and the errors of each row
+    are also written to a report file in the REPORT_DIR of the USER_IMPORT setting.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        """
+        Import the users of the uploaded file.
+
+        The file is sent in the file field of a multipart request, and its format is given with the file_format
+        field ("csv" or "ndjson") or taken from the extension of its name. No welcome emails are sent.
+
+        Returns:
+        - If the file is valid, a streaming NDJSON response with the report file, the progress after each batch
+          and the summary of the import.
+        - If the file is missing or its format is not supported, it returns an error message with a status code of 400.
+        """
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({"message": "Error importing users, file not found"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            file_format = get_import_format(upload.name, request.data.get('file_format'))
+        except ValueError as e:
+            return Response({"message": "Error importing users", "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        report_dir = get_user_import_setting("REPORT_DIR")
+        os.makedirs(report_dir, exist_ok=True)
+        report_path = os.path.join(report_dir, f"users-{uuid.uuid4().hex}.report.ndjson")
+
+        def stream():
+            yield json.dumps({"type": "report", "path": report_path}) + "\n"
+            with open(report_path, 'w', encoding='utf-8') as report:
+                for progress in import_users(upload.file, file_format, report):
+                    yield json.dumps(progress) + "\n"
+
+        return StreamingHttpResponse(stream(), content_type="application/x-ndjson")
+
+
+class UserChangesView(APIView):
+    """
+    A view that returns the changes of the users since a cursor, for the services that keep a copy of the users.
+
+    Requires an admin user. The created, updated and deleted events are read from the historical records of the
+    users, in pages of the keyset pagination over history_id, so each poll only reads the new changes.
+    With the wait query parameter, a request without new changes waits for them instead of returning an empty page.
+    """
+
+    permission_classes = [IsAdminUser]
+    pagination_class = ChangeFeedPagination
+
+    def get(self, request):
+        """
+        Retrieve the changes of the users after the cursor of the request.
+
+        Without cursor the feed starts with the oldest historical record. The query parameters are cursor,
+        page_size and wait, the seconds to wait for new changes, limited to the MAX_WAIT of the USER_CHANGE_FEED
+        setting.
+
+        Returns:
+        - A Response object with the cursor to resume the feed, the url of the next changes, has_more, which is true
+          if more changes are already available, and the events, and a status code of 200.
+        - If the cursor is not valid, it returns an error message with a status code of 404.
+        - If changes after the cursor were deleted by the compaction or the retention of the history, it returns
+          an error message and resync_required with a status code of 410, the consumer must copy the users again
+          and restart the feed without cursor.
+        - If wait is not a number, it returns an error message with a status code of 400.
+        """
+        try:
+            wait = min(max(float(request.query_params.get('wait', 0)), 0), get_user_change_feed_setting("MAX_WAIT"))
+        except ValueError:
+            return Response({"message": "wait must be a number of seconds"}, status=status.HTTP_400_BAD_REQUEST)
+        paginator = self.pagination_class()
+        deadline = time.monotonic() + wait
+        changes = paginator.paginate_queryset(get_changes_queryset(), request, view=self)
+        if paginator.has_cursor and has_deleted_changes(paginator.position[0]):
+            return Response(
+                {"message": "The changes after the cursor were deleted, copy the users again", "resync_required": True},
+                status=status.HTTP_410_GONE,
+            )
+        while not changes and time.monotonic() < deadline:
+            time.sleep(min(get_user_change_feed_setting("POLL_INTERVAL"), max(deadline - time.monotonic(), 0)))
+            changes = paginator.paginate_queryset(get_changes_queryset(), request, view=self)
+        return paginator.get_paginated_response([serialize_change(record) for record in changes])
+
+
+class UserDeactivateView(APIView):
+    """
+    A view that deactivates users in bulk.
+
+    Requires an admin user. The users are deactivated with QuerySet.soft_delete, an UPDATE per chunk of users,
+    which writes their historical records and invalidates their caches once per chunk.
+    """
+
+    permission_classes = [IsAdminUser]
+    max_ids = 10000
+
+    def post(self, request):
+        """
+        Deactivate the users of the ids of the request.
+
+        The ids are sent as a list in the ids field. The authenticated user is never deactivated, and the users
+        already deactivated are ignored.
+
+        Returns:
+        - If the ids are valid, it returns the number of deactivated users with a status code of 200.
+        - If the ids are missing or not valid, it returns an error message with a status code of 400.
+        """
+        ids = request.data.get('ids')
+        if (
+            not isinstance(ids, list)
+            or not ids
+            or len(ids) > self.max_ids
+            or not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in ids)
+        ):
+            return Response(
+                {"message": f"Error deactivating users, ids must be a list of 1 to {self.max_ids} user ids"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        deactivated = User.objects.filter(id__in=ids).exclude(id=request.user.id).soft_delete()
+        return Response(
+            {"message": "Users deactivated successfully", "deactivated": deactivated}, status=status.HTTP_200_OK
+        )